@@ -1,81 +1,121 @@
 from pathlib import Path
+import argparse
 import json
-import pandas as pd 
-import numpy as np
-import datetime as dt
 import riverice_util as ru
+import ddcache
+import climatology
 
-prefix = "DD25"       # set to TDD for Thawing Degree Days
-lastyear = 2024
+prefixes = ["DD25"]   # add "DD20" or "TDD" to write several thresholds in one pass
 
-config = {
-    "TDD": {
-        "deltaT": 32
-    },
-    "DD20": {
-        "deltaT": 20
-    },
-    "DD25": {
-        "deltaT": 25
-    },
-}
+config = ru.DD_CONFIG
 
-PROJPATH = Path().resolve().parent
+PROJPATH = Path(__file__).resolve().parent.parent
 datapath = PROJPATH / "data/weatherstations/ACIS/stationdata/RFC_new_model"
-outpath = PROJPATH / f"data/weatherstations/ACIS/{prefix}"
-climdir = outpath / "dd_climatologies"
+acispath = PROJPATH / "data/weatherstations/ACIS"
+climdir = acispath / f"{prefixes[0]}/dd_climatologies"   # T_avg climatology is the same for all prefixes
 stations = sorted(list(datapath.glob("*.csv")))
 finalstations = PROJPATH / "data/stationdata_for_breakup/selectedstations.json"
 datasuffix = "_T_max_min_avg_sd_swe.csv"
+nmissing = 10
 
-if __name__ == '__main__':
-    with open(finalstations) as src:
-        st = json.load(src)
-    finalset = sorted(list(set(sum(st.values(), []))))
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate per-station DD files from ACIS station data')
+    parser.add_argument('-s', '--season', nargs='?', type=int, const='latest', default=None,
+        help='only recompute this year in the existing DD files (default the year of '
+             'each station\'s latest data)')
+    parser.add_argument('-p', '--prefixes', default=','.join(prefixes),
+        help=f'comma separated DD thresholds to write (default %(default)s, all: {",".join(config)})')
+    return parser.parse_args()
 
-    clims = sorted(list(climdir.glob("*.csv")))
-    nmissing = 10
-    for fp in clims:
-        name = fp.stem[:-14]
-        if not name.replace('AIRPORT', 'AP') in finalset: 
-            print(f"Excluding {name} - not in forecast")
-            continue
-        else: 
-            print(f"Working on {name}")
-        stationpth = datapath / f"{name}{datasuffix}"
-        climdf = pd.read_csv(fp, header=4, index_col=0)
-        testdf = ru.get_MAMJ_dd(ru.station2df(stationpth))
-        missing = pd.DataFrame(testdf[testdf.Tavg_F==-9999].groupby('year').size().rename('count_missing'))
-        significant_missing = missing[missing.count_missing > nmissing]
-        missing_years = sorted(list(significant_missing.index))
-        if 2024 in missing_years: missing_years.remove(2024)
-        print(missing_years)
-        print(name, missing_years)
-        testdf = testdf[~testdf.year.isin(missing_years)]
-        testdf['d_since_march1'] = list(testdf.index.to_series().apply(ru.days_past_march1))
-        testdf['Tavg_clim'] = testdf.d_since_march1.apply(lambda x: climdf.iloc[x]['Tavg_F'])
-        testdf = testdf.replace(-9999, np.nan)
-        testdf['Tavg_F'] = testdf.Tavg_F.astype(float)
-        testdf['Tavg_F'].fillna(testdf.Tavg_clim, inplace=True)
-        testdf = testdf[['Tavg_F', 'year']]
-        # make string for metadata for missing years
-        if missing_years:
-            missingstr = f"# Excluded years (more than {str(nmissing)} days of missing data): {', '.join(map(str, missing_years))}\n"
+def get_filled_temps(stationpth, climpth, season=None):
+    """March-June T_avg for a station with gaps filled from climatology, and the years
+    excluded for missing data. With season set, only that year is returned (it's never
+    excluded), otherwise the years up to ru.LASTYEAR, the current season."""
+    climdf = ddcache.read_ddcsv(climpth)
+    lastyear = season or ru.LASTYEAR
+    testdf = ru.read_station(stationpth, lastyear=lastyear)
+    count_missing = climatology.count_missing(testdf.Tavg_F, testdf.year)
+    missing_years = sorted(list(count_missing[count_missing > nmissing].index))
+    if lastyear in missing_years: missing_years.remove(lastyear)
+    testdf = testdf[~testdf.year.isin(missing_years)]
+    if season is not None:
+        testdf = testdf[testdf.year == season]
+    testdf['d_since_march1'] = ru.days_since_march1(testdf.index)
+    testdf['Tavg_F'] = climatology.fill_from_climatology(testdf.Tavg_F, testdf.d_since_march1, climdf.Tavg_F)
+    testdf = testdf[['Tavg_F', 'year']]
+    return testdf, missing_years
+
+def get_stationpath(name):
+    return datapath / f"{name}{datasuffix}"
+
+def latest_season(name) -> int:
+    """Year of the last day in a station's ACIS file, the season the fetch updated"""
+    from get_acisdata import last_stored_date
+    return last_stored_date(get_stationpath(name)).year
+
+def get_outpaths(name, prefix):
+    """Daily and cumulative per-station DD files"""
+    outpath = acispath / prefix
+    if prefix == "TDD":
+        return (outpath / f"tdd_bystation/{name}_yearly_TDD.csv",
+                outpath / f"tdd_cumul_bystation/{name}_yearly_TDD_cumul.csv")
+    return (outpath / f"dd_bystation/{name}_yearly_DD.csv",
+            outpath / f"dd_cumul_bystation/{name}_yearly_{prefix}_cumul.csv")
+
+def process_station(name, season=None, ddprefixes=None):
+    ddprefixes = ddprefixes or prefixes
+    stationpth = get_stationpath(name)
+    testdf, missing_years = get_filled_temps(stationpth, climdir / f"{name}_clim1991_2020.csv", season)
+    dddfs = ru.get_dddfs(testdf, prefixes=ddprefixes)
+    if season is not None:
+        for prefix in ddprefixes:
+            ddpth, cumulpth = get_outpaths(name, prefix)
+            ddcache.update_ddcsv(ddpth, ru.get_pivotdf(dddfs[prefix], value='dd'))
+            ddcache.update_ddcsv(cumulpth, ru.get_pivotdf(dddfs[prefix]))
+        return
+    print(name, missing_years)
+    # make string for metadata for missing years
+    if missing_years:
+        missingstr = f"# Excluded years (more than {str(nmissing)} days of missing data): {', '.join(map(str, missing_years))}\n"
+    else:
+        missingstr = f"# No years excluded (all years had {str(nmissing)} or fewer days of missing data)\n"
+    for prefix in ddprefixes:
+        ddpth, cumulpth = get_outpaths(name, prefix)
+        if prefix == "TDD":
+            ddstr, cumulstr = "Thawing degree days", "Cumulative thawing degree days"
         else:
-            missingstr = f"# No years excluded (all years had {str(nmissing)} or fewer days of missing data)\n"
+            ddstr = f"Degree days egree days > {config[prefix]['deltaT']}"
+            cumulstr = f"Cumulative degree days > {config[prefix]['deltaT']}"
         # write TDD files
-        outdf = ru.get_pivotdf(ru.get_dddf(testdf), value='dd')
-        with open(outpath / f"dd_bystation/{name}_yearly_DD.csv", 'w') as dst:
+        outdf = ru.get_pivotdf(dddfs[prefix], value='dd')
+        with open(ddpth, 'w') as dst:
             dst.write(f"# {name}\n")
-            dst.write(f"# Degree days egree days > {config[prefix]['deltaT']} starting March 1 from ACIS, gaps filled from climatology\n")
+            dst.write(f"# {ddstr} starting March 1 from ACIS, gaps filled from climatology\n")
             dst.write(missingstr)
             dst.write("#\n")
             outdf.to_csv(dst, float_format='%.2f')
         # write cumul tdd files
-        outdf = ru.get_pivotdf(ru.get_dddf(testdf))
-        with open(outpath / f"dd_cumul_bystation/{name}_yearly_{prefix}_cumul.csv", 'w') as dst:
+        outdf = ru.get_pivotdf(dddfs[prefix])
+        with open(cumulpth, 'w') as dst:
             dst.write(f"# {name}\n")
-            dst.write(f"# Cumulative degree days > {config[prefix]['deltaT']} starting March 1 from ACIS, gaps filled from climatology\n")
+            dst.write(f"# {cumulstr} starting March 1 from ACIS, gaps filled from climatology\n")
             dst.write(missingstr)
             dst.write("#\n")
-            outdf.to_csv(dst, float_format='%.2f')
\ No newline at end of file
+            outdf.to_csv(dst, float_format='%.2f')
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    prefixes = args.prefixes.split(',')
+    with open(finalstations) as src:
+        st = json.load(src)
+    finalset = sorted(list(set(sum(st.values(), []))))
+
+    clims = sorted(list(climdir.glob("*.csv")))
+    for fp in clims:
+        name = fp.stem[:-14]
+        if not name.replace('AIRPORT', 'AP') in finalset:
+            print(f"Excluding {name} - not in forecast")
+            continue
+        else:
+            print(f"Working on {name}")
+        process_station(name, season=latest_season(name) if args.season == 'latest' else args.season)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Shared client for the ACIS web services (https://www.rcc-acis.org/docs_webservices.html)
+#
+# One pooled HTTP session with timeouts, retries with exponential backoff and a minimum
+# interval between requests; a bounded thread pool to run many requests concurrently.
+# Point ACIS_URL (or the baseurl argument) at a local server to test without network access.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ACISURL = os.environ.get('ACIS_URL', 'http://data.rcc-acis.org')
+MAXWORKERS = 4          # concurrent requests
+RETRIES = 5
+BACKOFF = 1.0           # seconds, doubles with each retry
+TIMEOUT = (10, 120)     # connect, read timeouts in seconds
+MININTERVAL = 0.1       # seconds between starting two requests
+METABATCH = 50          # station ids per StnMeta request
+
+class ACISClient:
+    """Pooled, rate-limited ACIS client, usable as a context manager"""
+
+    def __init__(self, baseurl=ACISURL, max_workers=MAXWORKERS, retries=RETRIES,
+                 backoff=BACKOFF, timeout=TIMEOUT, min_interval=MININTERVAL):
+        self.baseurl = baseurl.rstrip('/')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.min_interval = min_interval
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._next_start = 0.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def fetch(self, url, params):
+        """GET url with params and return the response text"""
+        self._throttle()
+        resp = self.session.get(url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.text
+
+    def fetch_json(self, service, params):
+        self._throttle()
+        resp = self.session.get(f"{self.baseurl}/{service}", params=params, timeout=self.timeout)
+        resp.raise_for_status()
+        result = resp.json()
+        if 'error' in result:
+            raise ValueError(f"ACIS {service} error: {result['error']}")
+        return result
+
+    def map(self, func, items):
+        """Apply func to all items using up to max_workers threads, results in input order"""
+        if self.max_workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(func, items))
+
+    def stn_meta(self, sids, meta="name,uid,sids,ll,elev,valid_daterange",
+                 elems="avgt,snow", batchsize=METABATCH):
+        """Station metadata for a list of station ids, batched into StnMeta requests of
+        batchsize ids each which run concurrently"""
+        batches = [sids[ii:ii + batchsize] for ii in range(0, len(sids), batchsize)]
+        results = self.map(
+            lambda batch: self.fetch_json('StnMeta', {
+                'sids': ','.join(batch),
+                'meta': meta,
+                'elems': elems,
+            })['meta'],
+            batches)
+        return sum(results, [])
+
+    def stn_data(self, uid, sdate, edate, elems="maxt,mint,avgt,snwd,13", output='csv'):
+        """Daily data for one station. MultiStnData has no csv output and doesn't take ACIS
+        uids, so data pulls stay one StnData request per station and run via map()."""
+        return self.fetch(f"{self.baseurl}/StnData", {
+            'uid': uid,
+            'sdate': sdate,
+            'edate': edate,
+            'elems': elems,
+            'output': output,
+        })
+
+_default_client = None
+
+def get_client():
+    """Module-wide client with default settings"""
+    global _default_client
+    if _default_client is None:
+        _default_client = ACISClient()
+    return _default_client
+
+def fetch(url, params):
+    """fetch(url, params) through the module-wide client"""
+    return get_client().fetch(url, params)
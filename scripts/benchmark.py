@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# Benchmarks for the pipeline stages on synthetic data (see synthdata.py)
+#
+# Each stage is timed (best of --repeat runs) and run once more under tracemalloc for
+# its peak memory. Running at several --scales (multiples of the station, site and year
+# counts) shows how each stage scales: the exponent column is the slope of log(time)
+# against log(items) between the smallest and the largest scale.
+#
+# usage: python benchmark.py --scales 0.25,0.5,1 --output bench.csv
+
+import os
+import tempfile
+# the DD matrix cache of the synthetic files goes to a scratch directory (cleared by the
+# cold-cache stage and removed at the end), not data/cache
+os.environ['DDCACHE_DIR'] = tempfile.mkdtemp(prefix='ddcache_')
+
+from pathlib import Path
+import argparse
+import shutil
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+import ddcache
+import synthdata
+import generate_TDDcorr
+import make_forecast_2024
+import hindcast
+import climatology
+
+CORRDATES = [f"{month:02d}-{day:02d}" for month in (4, 5, 6) for day in range(1, 31)]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic data')
+    parser.add_argument('-s', '--stations', type=int, default=synthdata.NSTATIONS,
+        help=f'number of stations at scale 1 (default {synthdata.NSTATIONS})')
+    parser.add_argument('-l', '--sites', type=int, default=synthdata.NSITES,
+        help=f'number of breakup sites at scale 1 (default {synthdata.NSITES})')
+    parser.add_argument('-y', '--years', type=int, default=synthdata.LASTYEAR - synthdata.FIRSTYEAR + 1,
+        help='number of years at scale 1 (default %(default)s)')
+    parser.add_argument('--scales', default='0.25,0.5,1',
+        help='comma separated multiples of the counts above (default %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='timed runs per stage, the fastest is reported (default %(default)s)')
+    parser.add_argument('--stages', default=None,
+        help=f'comma separated subset of {",".join(STAGES)}')
+    parser.add_argument('-w', '--workdir', type=Path, default=None,
+        help='where to write the synthetic data (default a temporary directory, removed afterwards)')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+        help='write the results table to this csv')
+    return parser.parse_args()
+
+def load_inputs(paths: dict) -> dict:
+    """Parsed inputs for the stages that don't benchmark reading them"""
+    inputs = {'paths': paths}
+    inputs['stationfiles'] = sorted(paths['stationdata'].glob("*.csv"))
+    inputs['ddfiles'] = sorted(paths['ddcumul'].glob("*.csv"))
+    inputs['temps'] = [ru.read_station(pth) for pth in inputs['stationfiles']]
+    breakupDF = hindcast.read_breakups(paths['breakup'])
+    inputs['breakupDF'] = breakupDF
+    inputs['siteIDs'] = list(breakupDF.siteID.unique())
+    inputs['combined'] = {
+        siteID: ddcache.load_ddframe(paths['combined'] / f"{synthdata.PREFIX}_combined_{siteID.replace(' ', '_')}.csv")
+        for siteID in inputs['siteIDs']}
+    inputs['breakups'] = {
+        siteID: breakupDF[breakupDF.siteID == siteID].sort_values(by='year').reset_index(drop=True)
+        for siteID in inputs['siteIDs']}
+    inputs['anomalycube'] = ru.build_anomaly_cube(inputs['ddfiles'], paths['climatology'])
+    return inputs
+
+# Stages: run(inputs) returns the number of items processed (for the throughput),
+# setup(inputs), if given, runs untimed before every run
+
+def run_station2df(inputs):
+    return sum(len(ru.station2df(pth)) for pth in inputs['stationfiles'])
+
+def run_read_station(inputs):
+    return sum(len(ru.read_station(pth)) for pth in inputs['stationfiles'])
+
+def run_dddf_pivot(inputs):
+    for tempdf in inputs['temps']:
+        ru.get_pivotdf(ru.get_dddf(tempdf))
+    return sum(len(tempdf) for tempdf in inputs['temps'])
+
+def run_climatology(inputs):
+    """T_avg and DD climatologies of all stations and thresholds, without writing them"""
+    tavg, present, years = climatology.read_tavg(inputs['stationfiles'], lastyear=synthdata.LASTYEAR)
+    climtavg, _, _ = climatology.tavg_climatology(tavg, present, years)
+    climatology.dd_climatologies(climtavg)
+    return int(present.sum())
+
+def clear_ddcache(inputs):
+    shutil.rmtree(ddcache.CACHEDIR, ignore_errors=True)
+    ru.read_climatologies.cache_clear()
+
+def run_anomaly_cube(inputs):
+    cube, _, _ = ru.build_anomaly_cube(inputs['ddfiles'], inputs['paths']['climatology'])
+    return cube.size
+
+def run_correlations(inputs):
+    records = generate_TDDcorr.get_correlationrecords(
+        inputs['anomalycube'], inputs['breakupDF'], CORRDATES, inputs['siteIDs'])
+    return sum(len(dayrecords) for dayrecords in records.values())
+
+def run_calculate_corr(inputs):
+    """Pairwise pearsonr per station and site for one date, as before the batched version"""
+    cube, stationnames, cubeyears = inputs['anomalycube']
+    breakupDF = inputs['breakupDF'].sort_values(by='year')
+    days = ru.fixed_date_days(breakupDF.year, '04-15')
+    anomalies = ru.gather_anomalies(cube, cubeyears, breakupDF.year.to_numpy(), days)
+    breakupDF = pd.concat([breakupDF, pd.DataFrame(anomalies.T, columns=stationnames,
+                                                   index=breakupDF.index)], axis=1)
+    return len(ru.calculate_corr(breakupDF, inputs['siteIDs'], stationnames=stationnames))
+
+def run_likelihood(inputs):
+    return sum(len(make_forecast_2024.make_likelihood_DF(inputs['breakups'][siteID],
+                                                         inputs['combined'][siteID]))
+               for siteID in inputs['siteIDs'])
+
+def setup_forecast_fit(inputs):
+    if 'likelihoods' not in inputs:
+        inputs['likelihoods'] = [make_forecast_2024.make_likelihood_DF(
+            inputs['breakups'][siteID], inputs['combined'][siteID]) for siteID in inputs['siteIDs']]
+
+def run_forecast_fit(inputs):
+    """Per-day fits and window probabilities for every site, as in forecast_site"""
+    nfits = 0
+    for likelihoodDF in inputs['likelihoods']:
+        fits = ru.fit_forecastdays(likelihoodDF)
+        mus = fits.intercept.to_numpy() + fits.slope.to_numpy() * 100.
+        cdf = ru.breakup_cdf(mus, fits.sigma.to_numpy())
+        ru.window_probabilities(cdf)
+        ru.interval_probability(cdf, *ru.mostlikely_window(np.round(mus).astype(int)))
+        nfits += len(fits)
+    return nfits
+
+def run_hindcast(inputs):
+    dd, breakupdays, days, _ = hindcast.build_cube(
+        inputs['siteIDs'], inputs['breakupDF'], combinedpath=inputs['paths']['combined'])
+    daysto, mu, sigma, _ = hindcast.leave_one_out_fits(dd, breakupdays, days)
+    keep = np.isfinite(dd) & (daysto >= 0) & np.isfinite(mu) & (sigma > 0)
+    hindcast.score_forecasts(daysto[keep], mu[keep], sigma[keep])
+    return int(keep.sum())
+
+STAGES = {
+    'station2df': (None, run_station2df),
+    'read_station': (None, run_read_station),
+    'dddf_pivot': (None, run_dddf_pivot),
+    'climatology': (None, run_climatology),
+    'anomaly_cube_cold': (clear_ddcache, run_anomaly_cube),
+    'anomaly_cube': (None, run_anomaly_cube),
+    'correlations': (None, run_correlations),
+    'calculate_corr': (None, run_calculate_corr),
+    'likelihood': (None, run_likelihood),
+    'forecast_fit': (setup_forecast_fit, run_forecast_fit),
+    'hindcast': (None, run_hindcast),
+}
+
+def measure(setup, run, inputs, repeat=3) -> dict:
+    """Best wall time of repeat runs, and the peak traced memory of one more run"""
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, not {repeat}")
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup(inputs)
+        start = time.perf_counter()
+        run(inputs)
+        times.append(time.perf_counter() - start)
+    if setup is not None:
+        setup(inputs)
+    tracemalloc.start()
+    nitems = run(inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    seconds = min(times)
+    return {'items': nitems, 'seconds': seconds, 'items_per_s': nitems / seconds,
+            'peak_MB': peak / 2**20}
+
+def scaling_exponents(results: pd.DataFrame) -> pd.Series:
+    """Slope of log(seconds) vs. log(items) between the smallest and largest scale per stage"""
+    def exponent(df):
+        first, last = df.sort_values('scale').iloc[[0, -1]].itertuples()
+        if last.items == first.items:
+            return np.nan
+        return np.log(last.seconds / first.seconds) / np.log(last.items / first.items)
+    return results.groupby('stage', sort=False)[['scale', 'items', 'seconds']].apply(exponent).rename('exponent')
+
+def run_benchmarks(workdir: Path, scales, nstations, nsites, nyears, stages, repeat=3) -> pd.DataFrame:
+    rows = []
+    for scale in scales:
+        counts = (max(2, round(nstations * scale)), max(2, round(nsites * scale)),
+                  max(5, round(nyears * scale)))
+        print(f"scale {scale}: {counts[0]} stations, {counts[1]} sites, {counts[2]} years")
+        paths = synthdata.make_dataset(workdir / f"scale_{scale}", *counts)
+        inputs = load_inputs(paths)
+        for stage in stages:
+            setup, run = STAGES[stage]
+            result = measure(setup, run, inputs, repeat)
+            print(f"  {stage:18s} {result['seconds']:8.3f} s {result['items_per_s']:12.0f} items/s "
+                  f"{result['peak_MB']:8.1f} MB")
+            rows.append({'stage': stage, 'scale': scale, 'stations': counts[0], 'sites': counts[1],
+                         'years': counts[2], **result})
+    results = pd.DataFrame(rows)
+    if len(scales) > 1:
+        results = results.merge(scaling_exponents(results), left_on='stage', right_index=True)
+    return results
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    scales = [float(scale) for scale in args.scales.split(',')]
+    stages = args.stages.split(',') if args.stages else list(STAGES)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix='riverice_bench_'))
+    try:
+        results = run_benchmarks(workdir, scales, args.stations, args.sites, args.years,
+                                 stages, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(ddcache.CACHEDIR, ignore_errors=True)
+    print(results.to_string(index=False, float_format=lambda val: f"{val:.4g}"))
+    if args.output:
+        results.to_csv(args.output, index=False)
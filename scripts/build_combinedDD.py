@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Combined (multi-station) cumulative DD files for the breakup sites
+#
+# Scripted version of the APRFC_ACIS_combinedstations notebook: all per-station cumulative
+# DD matrices are stacked into one (station, day, year) array, NaN where a station has no
+# data (e.g. excluded years), and every site's combined series is the weighted mean over
+# its stations that have data, computed for all sites in one matrix product.
+# Writes ACIS_combined_DD/<prefix>_combined_<site>.csv; with --season only that year's
+# column is recomputed and replaced in the existing files.
+
+from pathlib import Path
+import argparse
+import json
+import re
+import numpy as np
+import pandas as pd
+import ddcache
+import riverice_util as ru
+
+PREFIX = "DD25"
+SEASON = ru.LASTYEAR
+PROJPATH = Path(__file__).resolve().parent.parent
+selectedstations = PROJPATH / "data/stationdata_for_breakup/selectedstations.json"
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build the combined-station DD files for the breakup sites')
+    parser.add_argument('-p', '--prefix', default=PREFIX,
+        help=f'DD threshold (default {PREFIX})')
+    parser.add_argument('-s', '--season', nargs='?', type=int, const=SEASON, default=None,
+        help=f'only recompute this year\'s column in the existing files (default year {SEASON})')
+    parser.add_argument('--stations', type=Path, default=None,
+        help=f'JSON of stations per site (default {selectedstations.name} if it exists, '
+             'otherwise the station lists in the existing combined files)')
+    parser.add_argument('--weights', type=Path, default=None,
+        help='JSON of {site: {station: weight}}, stations not listed get weight 1')
+    parser.add_argument('-o', '--outdir', type=Path, default=ddcache.COMBINEDPATH,
+        help='output directory (default %(default)s)')
+    return parser.parse_args()
+
+def read_sitestations(pth: Path) -> dict[str, dict[str, float]]:
+    """Stations per site from a JSON file like selectedstations.json. Values are lists of
+    stations (equal weights) or {station: weight} dicts."""
+    with open(pth) as src:
+        sitestations = json.load(src)
+    return {site: dict(stations) if isinstance(stations, dict) else {name: 1. for name in stations}
+            for site, stations in sitestations.items()}
+
+def sitestations_from_headers(prefix: str = PREFIX) -> dict[str, dict[str, float]]:
+    """Stations per site as listed in the 'Sites:' line of the existing combined files"""
+    sitestations = {}
+    for site, matrix in ddcache.load_locations(prefix).items():
+        weights = matrix.meta.get('weights', [1.] * len(matrix.meta['stations']))
+        sitestations[site] = dict(zip(matrix.meta['stations'], weights))
+    return sitestations
+
+def apply_weights(sitestations: dict, weights: dict) -> dict[str, dict[str, float]]:
+    return {site: {name: weights.get(site, {}).get(name, weight) for name, weight in stations.items()}
+            for site, stations in sitestations.items()}
+
+def resolve_stationfiles(names, prefix: str = PREFIX) -> dict[str, Path]:
+    """Per-station cumulative DD file for each station name. Station lists use _AP where
+    some file names have _AIRPORT."""
+    files = {pth.stem.split('_yearly_')[0]: pth for pth in ddcache.get_stationfiles(prefix)}
+    resolved = {}
+    for name in names:
+        for candidate in (name, re.sub(r'_AP$', '_AIRPORT', name)):
+            if candidate in files:
+                resolved[name] = files[candidate]
+                break
+        else:
+            raise FileNotFoundError(f"No {prefix} cumulative DD file for station {name}")
+    return resolved
+
+def stack_stations(stationfiles: list[Path], years=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Aligned (station, day, year) array of the stations' cumulative DD, NaN where a station
+    has no data. Restricted to the given years if set. Returns the array, days and years."""
+    matrices = [ddcache.load_ddmatrix(pth) for pth in stationfiles]
+    if years is None:
+        years = sorted({int(col) for matrix in matrices for col in matrix.columns})
+    years = np.asarray(years)
+    days = np.arange(max(max(matrix.index) for matrix in matrices) + 1)
+    cube = np.full((len(matrices), len(days), len(years)), np.nan)
+    for ii, matrix in enumerate(matrices):
+        cols = np.array([int(col) for col in matrix.columns])
+        yidx = np.searchsorted(years, cols).clip(0, len(years) - 1)
+        inyears = years[yidx] == cols
+        cube[ii][np.ix_(matrix.index, yidx[inyears])] = matrix.values[:, inyears]
+    return cube, days, years
+
+def weight_matrix(sitestations: dict, stationnames: list[str]) -> np.ndarray:
+    """(site, station) weights, zero for stations that don't belong to a site"""
+    stationidx = {name: ii for ii, name in enumerate(stationnames)}
+    weights = np.zeros((len(sitestations), len(stationnames)))
+    for kk, stations in enumerate(sitestations.values()):
+        for name, weight in stations.items():
+            weights[kk, stationidx[name]] = weight
+    return weights
+
+def combine(cube: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Weighted mean over the stations with data, for all sites at once: (site, day, year),
+    NaN where none of a site's stations has data"""
+    valid = ~np.isnan(cube)
+    total = np.einsum('ks,sdy->kdy', weights, np.where(valid, cube, 0.))
+    norm = np.einsum('ks,sdy->kdy', weights, valid.astype(float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norm > 0, total / norm, np.nan)
+
+def build_combined(sitestations: dict, prefix: str = PREFIX, years=None) -> dict[str, pd.DataFrame]:
+    """Combined DD DataFrame (day since March 1 x year) per site, years without any
+    station data are dropped"""
+    stationnames = sorted({name for stations in sitestations.values() for name in stations})
+    stationfiles = resolve_stationfiles(stationnames, prefix)
+    cube, days, years = stack_stations([stationfiles[name] for name in stationnames], years)
+    combined = combine(cube, weight_matrix(sitestations, stationnames))
+    frames = {}
+    for site, values in zip(sitestations, combined):
+        frame = pd.DataFrame(values, index=pd.Index(days, name='d_since_march1'),
+                             columns=[str(year) for year in years])
+        frames[site] = frame.dropna(axis=1, how='all')
+    return frames
+
+def get_outpath(site: str, prefix: str = PREFIX, outdir: Path = ddcache.COMBINEDPATH) -> Path:
+    return outdir / f"{prefix}_combined_{site.replace(' ', '_')}.csv"
+
+def write_combined(pth: Path, site: str, stations: dict, frame: pd.DataFrame, prefix: str = PREFIX):
+    with open(pth, 'w') as dst:
+        dst.write(f"# Cumulative {prefix} averaged for {site}\n")
+        dst.write(f"# Sites: {', '.join(stations)}\n")
+        if any(weight != 1 for weight in stations.values()):
+            dst.write(f"# Weights: {', '.join(f'{weight:g}' for weight in stations.values())}\n")
+        dst.write("#\n")
+        frame.to_csv(dst, float_format='%.2f')
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.stations is not None or selectedstations.exists():
+        sitestations = read_sitestations(args.stations or selectedstations)
+    else:
+        print(f"{selectedstations} not found, using the station lists of the existing files")
+        sitestations = sitestations_from_headers(args.prefix)
+    if args.weights is not None:
+        with open(args.weights) as src:
+            sitestations = apply_weights(sitestations, json.load(src))
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    frames = build_combined(sitestations, args.prefix,
+                            years=None if args.season is None else [args.season])
+    for site, frame in frames.items():
+        outpth = get_outpath(site, args.prefix, args.outdir)
+        if args.season is not None:
+            print(f"updating {args.season} for {site}")
+            ddcache.update_ddcsv(outpth, frame)
+        else:
+            print(f"writing {site}: {', '.join(sitestations[site])}")
+            write_combined(outpth, site, sitestations[site], frame, args.prefix)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# 1991-2020 T_avg and degree day climatologies for the ACIS stations
+#
+# Scripted version of the ACIS_temp2dd / ACIS_ddcumulclimatology notebooks. All station
+# csvs are read once into a (station, year, day since March 1) T_avg array; missing day
+# counts, excluded years, the gap interpolation, the daily mean and the DD20/DD25/TDD
+# climatologies are then computed for all stations and thresholds together.
+# Writes <prefix>/dd_climatologies/<station>_clim1991_2020.csv (tdd_climatologies for TDD),
+# <prefix>/all_cumul_clim1991_2020.csv and the rejected stations list. Columns and files of
+# stations that aren't recomputed are kept.
+
+from pathlib import Path
+import argparse
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+import ddcache
+
+PREFIXES = list(ru.DD_CONFIG)
+CLIMYEARS = (1991, 2020)
+MAXMISSING = 5      # years with more missing March-June days are left out of the climatology
+MAXEXCLUDED = 10    # stations with more excluded years get no climatology
+NDAYS = 122         # March 1 to June 30
+
+datapath = ddcache.ACISPATH / "stationdata/RFC_new_model"
+datasuffix = "_T_max_min_avg_sd_swe.csv"
+climsuffix = f"_clim{CLIMYEARS[0]}_{CLIMYEARS[1]}"
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build the 1991-2020 T_avg and DD climatologies of the ACIS stations')
+    parser.add_argument('-p', '--prefixes', default=','.join(PREFIXES),
+        help='comma separated DD thresholds (default %(default)s)')
+    parser.add_argument('-d', '--datapath', type=Path, default=datapath,
+        help='folder of ACIS station csvs (default %(default)s)')
+    parser.add_argument('-o', '--outdir', type=Path, default=ddcache.ACISPATH,
+        help='root of the <prefix> output folders (default %(default)s)')
+    return parser.parse_args()
+
+def stationname(pth: Path) -> str:
+    return pth.name.removesuffix(datasuffix)
+
+def read_tavg(stationfiles: list[Path], lastyear: int = ru.LASTYEAR):
+    """March-June T_avg of all stations as a (station, year, day since March 1) array, NaN where
+    missing, and a mask of the days that have a row in the station file. Returns both and the years."""
+    stationdfs = [ru.read_station(pth, lastyear=lastyear) for pth in stationfiles]
+    firstyear = min(df.year.min() for df in stationdfs)
+    years = np.arange(firstyear, max(df.year.max() for df in stationdfs) + 1)
+    tavg = np.full((len(stationdfs), len(years), NDAYS), np.nan)
+    present = np.zeros(tavg.shape, dtype=bool)
+    for ii, df in enumerate(stationdfs):
+        yidx, didx = df.year.to_numpy() - firstyear, ru.days_since_march1(df.index)
+        tavg[ii, yidx, didx] = df.Tavg_F.to_numpy()
+        present[ii, yidx, didx] = True
+    return tavg, present, years
+
+def count_missing(values, groups) -> pd.Series:
+    """Number of NaN values per group, e.g. missing days per year of a station series"""
+    return pd.Series(np.isnan(np.asarray(values, dtype=float))).groupby(np.asarray(groups)).sum()
+
+def excluded_years(tavg, present, years, climyears=CLIMYEARS, maxmissing=MAXMISSING) -> np.ndarray:
+    """(station, year) mask of climatology years with more than maxmissing missing days"""
+    nmissing = (present & np.isnan(tavg)).sum(axis=-1)
+    inclim = (years >= climyears[0]) & (years <= climyears[1])
+    return (nmissing > maxmissing) & inclim
+
+def interpolate_gaps(rows: np.ndarray) -> np.ndarray:
+    """Linear interpolation of the NaNs in a (year, day) array read as one continuous series,
+    like pandas' interpolate(): leading NaNs stay, trailing ones get the last value"""
+    series = rows.ravel()
+    valid = np.flatnonzero(~np.isnan(series))
+    if len(valid) == 0:
+        return rows
+    filled = np.interp(np.arange(len(series)), valid, series[valid], left=np.nan)
+    return filled.reshape(rows.shape)
+
+def tavg_climatology(tavg, present, years, climyears=CLIMYEARS, maxexcluded=MAXEXCLUDED):
+    """Daily mean T_avg over the climatology years that aren't excluded, (station, day).
+    Returns it with the excluded years mask and the mask of rejected stations (NaN rows)."""
+    excluded = excluded_years(tavg, present, years, climyears)
+    rejected = excluded.sum(axis=-1) > maxexcluded
+    keep = ((years >= climyears[0]) & (years <= climyears[1]) & present.any(axis=-1)
+            & ~excluded & ~rejected[:, None])
+    clim = np.full((len(tavg), tavg.shape[-1]), np.nan)
+    for ii in np.flatnonzero(keep.any(axis=-1)):
+        clim[ii] = np.nanmean(interpolate_gaps(tavg[ii, keep[ii]]), axis=0)
+    return clim, excluded, rejected
+
+def dd_climatologies(climtavg, prefixes=PREFIXES) -> dict[str, np.ndarray]:
+    """Daily DD of the mean T_avg for all thresholds at once, {prefix: (station, day)}"""
+    deltas = np.array([ru.DD_CONFIG[prefix]['deltaT'] for prefix in prefixes], dtype=float)
+    dd = np.clip(climtavg[None] - deltas[:, None, None], 0, None)
+    return dict(zip(prefixes, dd))
+
+def fill_from_climatology(values, days, climtavg) -> np.ndarray:
+    """Missing values replaced by the climatological T_avg of their day since March 1"""
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), np.asarray(climtavg, dtype=float)[days], values)
+
+def get_climdir(prefix: str, outdir: Path = ddcache.ACISPATH) -> Path:
+    return outdir / prefix / ("tdd_climatologies" if prefix == "TDD" else "dd_climatologies")
+
+def write_station_climatology(pth: Path, name: str, prefix: str, tavg, dd, excluded: list[int],
+                              climyears=CLIMYEARS):
+    col = "tdd" if prefix == "TDD" else "dd"
+    outdf = pd.DataFrame({'Tavg_F': tavg, col: dd},
+                         index=pd.RangeIndex(len(tavg), name='d_since_march1'))
+    with open(pth, 'w') as dst:
+        dst.write(f"# {name}\n")
+        dst.write(f"# {climyears[0]}-{climyears[1]} climatology of T_avg and {prefix} for ACIS station\n")
+        if excluded:
+            dst.write(f"# Excluded years (more than {MAXMISSING} days of missing data): {', '.join(map(str, excluded))}\n")
+        else:
+            dst.write(f"# No years excluded (all years had {MAXMISSING} or fewer days of missing data)\n")
+        dst.write("#\n")
+        outdf.to_csv(dst, float_format='%.2f')
+
+def write_all_cumul(pth: Path, prefix: str, names: list[str], cumul: np.ndarray, climyears=CLIMYEARS):
+    """All-station cumulative climatology, replacing the given stations' columns in an existing file"""
+    outdf = pd.DataFrame(cumul.T, columns=names, index=pd.RangeIndex(cumul.shape[-1], name='d_since_march1'))
+    if pth.exists():
+        olddf = ddcache.read_ddcsv(pth)
+        outdf = olddf.drop(columns=names, errors='ignore').join(outdf, how='outer')
+        outdf = outdf[[col for col in olddf.columns if col in outdf.columns]
+                      + [name for name in names if name not in olddf.columns]]
+    if prefix == "TDD":
+        title, subtitle = "cumulative TDD", "Cumulative thawing degree days"
+    else:
+        title, subtitle = f"cumulative degree days > {ru.DD_CONFIG[prefix]['deltaT']}", "Cumulative degree days"
+    with open(pth, 'w') as dst:
+        dst.write(f"# All climatologies for {title}, {climyears[0]}-{climyears[1]}\n")
+        dst.write(f"# {subtitle} starting March 1 from ACIS\n")
+        dst.write("#\n")
+        outdf.to_csv(dst, float_format='%.2f')
+
+def write_rejected(pth: Path, names: list[str], rejected: dict[str, int], climyears=CLIMYEARS):
+    """List of stations without climatology, keeping the entries of stations not in names"""
+    lines = {}
+    if pth.exists():
+        with open(pth) as src:
+            lines = {line.split(' excluded:')[0]: line.rstrip('\n') for line in src if line.strip()}
+    for name in names:
+        lines.pop(name, None)
+    for name, nexcluded in rejected.items():
+        lines[name] = (f"{name} excluded: {nexcluded} years {climyears[0]}-{climyears[1]} "
+                       f"with more than {MAXMISSING} March-June days missing")
+    with open(pth, 'w') as dst:
+        dst.writelines(f"{lines[name]}\n" for name in sorted(lines))
+
+def build_climatologies(stationfiles: list[Path], prefixes=PREFIXES, outdir: Path = ddcache.ACISPATH):
+    """Compute and write all climatology products for the given station files"""
+    names = [stationname(pth) for pth in stationfiles]
+    with ru.timer('read_tavg'):
+        tavg, present, years = read_tavg(stationfiles)
+    with ru.timer('climatology'):
+        climtavg, excluded, rejected = tavg_climatology(tavg, present, years)
+        climtavg = np.round(climtavg, 2)    # as written, so the DD match the files
+        dds = dd_climatologies(climtavg, prefixes)
+    good = np.flatnonzero(~rejected)
+    goodnames = [names[ii] for ii in good]
+    for prefix, dd in dds.items():
+        climdir = get_climdir(prefix, outdir)
+        climdir.mkdir(parents=True, exist_ok=True)
+        for ii in good:
+            write_station_climatology(climdir / f"{names[ii]}{climsuffix}.csv", names[ii], prefix,
+                                      climtavg[ii], dd[ii], list(years[excluded[ii]]))
+        write_all_cumul(outdir / prefix / f"all_cumul{climsuffix}.csv", prefix, goodnames,
+                        np.round(dd[good], 2).cumsum(axis=-1))
+        write_rejected(outdir / prefix / f"{'TDD' if prefix == 'TDD' else 'DD'}_climatology_rejectedstations.txt",
+                       names, {names[ii]: int(excluded[ii].sum()) for ii in np.flatnonzero(rejected)})
+    ru.count('climatologies', len(good) * len(dds))
+    return goodnames, [names[ii] for ii in np.flatnonzero(rejected)]
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    stationfiles = sorted(args.datapath.glob(f"*{datasuffix}"))
+    goodnames, rejectednames = build_climatologies(stationfiles, args.prefixes.split(','), args.outdir)
+    print(f"{len(goodnames)} station climatologies written for {args.prefixes}")
+    for name in rejectednames:
+        print(f"{name}: too many years with missing data, no climatology")
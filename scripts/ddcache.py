@@ -0,0 +1,173 @@
+# Binary cache for the ACIS degree day matrices
+#
+# The cumulative DD files (per station, per breakup location, climatologies) are
+# commented CSVs with one row per day since March 1 and one column per year or station.
+# This module keeps a float64 .npy copy of each matrix (the values exactly as parsed
+# from the CSV) plus a JSON sidecar with the labels and header metadata, and
+# memory-maps it on load. A cache entry is rebuilt when the source CSV's modification
+# time or size (or, optionally, content hash) changes.
+# Set DDCACHE_DIR to keep the cache somewhere other than data/cache/ddmatrix.
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+
+PROJPATH = Path(__file__).resolve().parent.parent
+ACISPATH = PROJPATH / "data/weatherstations/ACIS"
+COMBINEDPATH = PROJPATH / "data/weatherstations/ACIS_combined_DD"
+CACHEDIR = Path(os.environ.get('DDCACHE_DIR', PROJPATH / "data/cache/ddmatrix"))
+CACHEVERSION = 2     # 2: float64 values
+
+class DDMatrix(NamedTuple):
+    values: np.ndarray      # (day, column) float64, memory-mapped
+    index: list[int]        # days since March 1 (or whatever the first CSV column holds)
+    columns: list[str]      # years or station names as in the CSV header
+    meta: dict              # parsed header metadata
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame view on the matrix, laid out like pd.read_csv(..., index_col=0)"""
+        df = pd.DataFrame(self.values, index=pd.Index(self.index, name=self.meta['index_name']),
+                          columns=self.columns, copy=False)
+        df.attrs.update(self.meta)
+        return df
+
+def read_header(pth: Path) -> list[str]:
+    """Leading comment lines of a DD csv file, without the '#'"""
+    lines = []
+    with open(pth) as src:
+        for line in src:
+            if not line.startswith('#'):
+                break
+            lines.append(line[1:].strip())
+    return lines
+
+def parse_header(lines: list[str]) -> dict:
+    """Metadata from the comment header: title, excluded years, member stations and weights"""
+    meta = {'header': lines, 'title': lines[0] if lines else '',
+            'excluded_years': [], 'stations': []}
+    for line in lines:
+        if line.startswith('Excluded years'):
+            meta['excluded_years'] = [int(year) for year in re.findall(r'\d{4}', line.split(':', 1)[1])]
+        elif line.startswith('Sites:'):
+            meta['stations'] = [name.strip() for name in line.split(':', 1)[1].split(',')]
+        elif line.startswith('Weights:'):
+            meta['weights'] = [float(weight) for weight in line.split(':', 1)[1].split(',')]
+    return meta
+
+def read_ddcsv(pth: Path) -> pd.DataFrame:
+    """Parse a commented DD csv file, skipping however many comment lines it has"""
+    lines = read_header(pth)
+    df = pd.read_csv(pth, skiprows=len(lines), index_col=0)
+    df.attrs.update(parse_header(lines))
+    return df
+
+def update_ddcsv(pth: Path, seasondf: pd.DataFrame):
+    """Replace the season's column(s) in an existing DD csv file, keeping its header and other years"""
+    header = read_header(pth)
+    outdf = pd.read_csv(pth, skiprows=len(header), index_col=0)
+    seasondf = seasondf.rename(columns=str)
+    outdf = outdf.reindex(outdf.index.union(seasondf.index))
+    for col in seasondf.columns:
+        outdf[col] = seasondf[col]
+    with open(pth, 'w') as dst:
+        for line in header:
+            dst.write(f"# {line}\n" if line else "#\n")
+        outdf.to_csv(dst, float_format='%.2f')
+
+def file_sha256(pth: Path) -> str:
+    with open(pth, 'rb') as src:
+        return hashlib.sha256(src.read()).hexdigest()
+
+def get_cachepaths(pth: Path, cachedir: Path = CACHEDIR) -> tuple[Path, Path]:
+    key = hashlib.sha1(str(Path(pth).resolve()).encode()).hexdigest()[:12]
+    stem = cachedir / f"{Path(pth).stem}_{key}"
+    return stem.with_suffix('.npy'), stem.with_suffix('.json')
+
+def is_fresh(pth: Path, meta: dict, check: str = 'mtime') -> bool:
+    """Whether a cache entry still matches its source file"""
+    if meta.get('version') != CACHEVERSION:
+        return False
+    if check == 'hash':
+        return meta['source_sha256'] == file_sha256(pth)
+    stat = os.stat(pth)
+    return (meta['source_mtime_ns'], meta['source_size']) == (stat.st_mtime_ns, stat.st_size)
+
+def write_cache(pth: Path, cachedir: Path = CACHEDIR) -> dict:
+    """Parse the source csv and (re)write its cache entry, returns the sidecar metadata"""
+    stat = os.stat(pth)
+    df = read_ddcsv(pth)
+    npypth, metapth = get_cachepaths(pth, cachedir)
+    npypth.parent.mkdir(parents=True, exist_ok=True)
+    meta = dict(df.attrs,
+        version=CACHEVERSION,
+        source=str(Path(pth).resolve()),
+        source_mtime_ns=stat.st_mtime_ns,
+        source_size=stat.st_size,
+        source_sha256=file_sha256(pth),
+        index_name=df.index.name,
+        index=[int(day) for day in df.index],
+        columns=[str(col) for col in df.columns],
+    )
+    # write to temporary files and rename so that concurrent readers never see partial entries
+    tmpnpy = npypth.with_suffix(f'.{os.getpid()}.tmp.npy')
+    tmpmeta = metapth.with_suffix(f'.{os.getpid()}.tmp')
+    np.save(tmpnpy, df.to_numpy(dtype=np.float64))
+    with open(tmpmeta, 'w') as dst:
+        json.dump(meta, dst)
+    os.replace(tmpnpy, npypth)
+    os.replace(tmpmeta, metapth)
+    return meta
+
+def load_ddmatrix(pth: Path, cachedir: Path = CACHEDIR, check: str = 'mtime') -> DDMatrix:
+    """Memory-mapped DD matrix for a csv file, from the cache if it's fresh.
+    check is 'mtime' (modification time and size) or 'hash' (SHA-256 of the file)."""
+    npypth, metapth = get_cachepaths(pth, cachedir)
+    meta = None
+    if npypth.exists() and metapth.exists():
+        with open(metapth) as src:
+            meta = json.load(src)
+        if not is_fresh(pth, meta, check):
+            meta = None
+    if meta is None:
+        meta = write_cache(pth, cachedir)
+    values = np.load(npypth, mmap_mode='r')
+    index = meta.pop('index')
+    columns = meta.pop('columns')
+    return DDMatrix(values, index, columns, meta)
+
+def load_ddframe(pth: Path, cachedir: Path = CACHEDIR, check: str = 'mtime') -> pd.DataFrame:
+    """Cached replacement for pd.read_csv(pth, skiprows=..., index_col=0) on DD csv files,
+    header metadata is in the DataFrame's attrs"""
+    return load_ddmatrix(pth, cachedir, check).to_frame()
+
+def get_stationfiles(prefix: str) -> list[Path]:
+    """Cumulative DD files per station (dd_cumul_bystation, tdd_cumul_bystation for TDD)"""
+    return sorted((ACISPATH / prefix).glob("*cumul_bystation/*.csv"))
+
+def get_locationfiles(prefix: str) -> list[Path]:
+    return sorted(COMBINEDPATH.glob(f"{prefix}_combined_*.csv"))
+
+def latest_year(prefix: str = 'DD25') -> int | None:
+    """Latest year that has a column in any of the combined DD files of a prefix, None
+    without files"""
+    years = []
+    for pth in get_locationfiles(prefix):
+        with open(pth) as src:
+            columns = next(line for line in src if not line.startswith('#')).strip().split(',')
+        years += [int(col) for col in columns[1:] if col.isdigit()]
+    return max(years, default=None)
+
+def load_stations(prefix: str, **kwargs) -> dict[str, DDMatrix]:
+    """Cumulative DD matrices for all stations of a prefix, keyed by station name"""
+    return {pth.stem.split('_yearly_')[0]: load_ddmatrix(pth, **kwargs)
+            for pth in get_stationfiles(prefix)}
+
+def load_locations(prefix: str, **kwargs) -> dict[str, DDMatrix]:
+    """Combined-station DD matrices for all breakup locations of a prefix, keyed by siteID"""
+    return {pth.stem[len(f"{prefix}_combined_"):].replace('_', ' '): load_ddmatrix(pth, **kwargs)
+            for pth in get_locationfiles(prefix)}
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# Columnar store of the ML predictors and breakup targets
+#
+# Reads the long-format ERA5 HUC6 tables (data/predictors/era5_<var>_by_month_HUC6.csv),
+# the teleconnection/sea ice table, the Nenana ice thickness and the breakup dates once,
+# and keeps them as one .npy file per column (like ddcache) with a JSON manifest:
+#   monthly  huc6, year, month, t2m, ssr, sd      sorted and partitioned by huc6
+#   yearly   year and the basin-independent predictors
+#   targets  site, year, days_since_march1        sorted and partitioned by site
+# Columns are memory-mapped and a HUC6's or site's rows are a slice, so selecting
+# columns copies nothing; site_frame() pivots a site's monthly rows to the wide
+# per-site frame of the Riverice_ML notebooks (data/ML_2024*/DF/DF_<site>).
+# The store is rebuilt when a source file's modification time or size changes.
+# Set FEATURESTORE_DIR to keep the store somewhere other than data/cache/features.
+
+from pathlib import Path
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+
+PROJPATH = Path(__file__).resolve().parent.parent
+PREDICTORDIR = PROJPATH / "data/predictors"
+BREAKUPPTH = PROJPATH / "data/breakupdata/derived/breakupDate_cleaned.csv"
+HUCTABLEPTH = PROJPATH / "data/breakupdata/derived/breakupDate_mean_std_HUC_augmented.csv"
+STOREDIR = Path(os.environ.get('FEATURESTORE_DIR', PROJPATH / "data/cache/features"))
+STOREVERSION = 1
+
+ERA5VARS = ('t2m', 'ssr', 'sd')
+STATICFN = "predictors_tele_seaice_20240409.csv"
+ICEFN = "ice_thickness_POR_BobBusey.csv"
+# redundant with the ones kept (RiverIce_dataframe_finalize)
+DROPPED = ['SOI_DJ', 'SOI_FM', 'Nino3_DJ', 'Nino3_FM', 'Nino3.4_DJ', 'Nino3.4_FM',
+           'ONI_DJ', 'ONI_FM', 'ONI_DJ.1', 'ONI_FM.1']
+FIRSTYEAR = 1980
+TARGET = 'days_since_march1'
+# suffixes of the monthly features, March is 'M' as in the trained models' predictor names
+MONTHLABELS = {1: 'Jan', 2: 'Feb', 3: 'M', 4: 'Apr', 5: 'May', 6: 'Jun',
+               7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build the ML predictor store and write per-site frames')
+    parser.add_argument('-r', '--rebuild', action='store_true',
+        help='rebuild the store even if the sources are unchanged')
+    parser.add_argument('-e', '--export', type=Path, default=None,
+        help='write DF_<site> csvs for all sites to this folder')
+    parser.add_argument('-m', '--months', default='3',
+        help='comma separated months of the ERA5 predictors (default %(default)s)')
+    return parser.parse_args()
+
+def get_sources(predictordir: Path = PREDICTORDIR, breakuppth: Path = BREAKUPPTH,
+                huctablepth: Path = HUCTABLEPTH) -> dict[str, Path]:
+    sources = {var: predictordir / f"era5_{var}_by_month_HUC6.csv" for var in ERA5VARS}
+    sources.update(static=predictordir / STATICFN, ice=predictordir / ICEFN,
+                   breakup=breakuppth, huctable=huctablepth)
+    return sources
+
+def source_stats(sources: dict[str, Path]) -> dict[str, list]:
+    return {name: [str(Path(pth).resolve()), os.stat(pth).st_mtime_ns, os.stat(pth).st_size]
+            for name, pth in sources.items()}
+
+def read_monthly(sources: dict[str, Path]) -> pd.DataFrame:
+    """ERA5 variables per HUC6, year and month in the units of the predictor files:
+    t2m in °F, ssr in 1e9 J/m², sd as is"""
+    monthly = None
+    for var in ERA5VARS:
+        df = pd.read_csv(sources[var], usecols=['huc6', 'year', 'month', var])
+        monthly = df if monthly is None else monthly.merge(df, on=['huc6', 'year', 'month'], how='outer')
+    monthly['t2m'] = (monthly['t2m'] - 273.15) * 9 / 5 + 32
+    monthly['ssr'] = monthly['ssr'] / 1e9
+    return monthly.sort_values(['huc6', 'year', 'month'], ignore_index=True)
+
+def read_yearly(sources: dict[str, Path]) -> pd.DataFrame:
+    """Teleconnection, sea ice and ice thickness predictors per year. Ice thickness
+    before its record starts is the record mean."""
+    static = pd.read_csv(sources['static'], index_col=0).drop(columns=DROPPED, errors='ignore')
+    ice = pd.read_csv(sources['ice']).set_index('year').NenanaIceThick
+    ice = ice.reindex(range(min(FIRSTYEAR, ice.index.min()), ice.index.max() + 1)).fillna(
+        ice.mean())
+    yearly = static.join(ice, how='outer')
+    yearly.index.name = 'year'
+    return yearly.reset_index()
+
+def read_targets(sources: dict[str, Path]) -> tuple[pd.DataFrame, list[str]]:
+    """Breakup days since March 1 per site (as an index into the site list) and year"""
+    breakup = pd.read_csv(sources['breakup'], skiprows=3, index_col=0)
+    breakup[TARGET] = ru.days_since_march1(pd.to_datetime(breakup.breakup))
+    siteIDs = sorted(breakup.siteID.unique())
+    targets = pd.DataFrame({'site': pd.Categorical(breakup.siteID, categories=siteIDs).codes,
+                            'year': breakup.year, TARGET: breakup[TARGET]})
+    return targets.sort_values(['site', 'year'], ignore_index=True), siteIDs
+
+def get_partitions(keys: np.ndarray) -> dict[str, list[int]]:
+    """[start, stop) row range of each key in a sorted column"""
+    values, starts = np.unique(keys, return_index=True)
+    stops = np.append(starts[1:], len(keys))
+    return {str(value): [int(start), int(stop)] for value, start, stop in zip(values, starts, stops)}
+
+def write_table(tabledir: Path, df: pd.DataFrame, partitionby: str = None) -> dict:
+    tabledir.mkdir(parents=True, exist_ok=True)
+    for col in df.columns:
+        np.save(tabledir / f"{col}.npy", df[col].to_numpy())
+    meta = {'columns': list(df.columns), 'nrows': len(df), 'partitionby': partitionby}
+    if partitionby is not None:
+        meta['partitions'] = get_partitions(df[partitionby].to_numpy())
+    return meta
+
+def build_store(storedir: Path = STOREDIR, sources: dict[str, Path] = None) -> dict:
+    """Parse all sources and (re)write the store, returns the manifest"""
+    sources = sources or get_sources()
+    stats = source_stats(sources)
+    targets, siteIDs = read_targets(sources)
+    huctable = pd.read_csv(sources['huctable'], index_col=0)
+    manifest = {
+        'version': STOREVERSION,
+        'sources': stats,
+        'sitehuc6': {row.siteID: int(row.huc6) for row in huctable.itertuples()},
+        'siteIDs': siteIDs,
+        'tables': {
+            'monthly': write_table(storedir / 'monthly', read_monthly(sources), 'huc6'),
+            'yearly': write_table(storedir / 'yearly', read_yearly(sources)),
+            'targets': write_table(storedir / 'targets', targets, 'site'),
+        },
+    }
+    tmpmanifest = storedir / f"manifest.{os.getpid()}.tmp"
+    with open(tmpmanifest, 'w') as dst:
+        json.dump(manifest, dst)
+    os.replace(tmpmanifest, storedir / "manifest.json")
+    return manifest
+
+def is_fresh(manifest: dict, sources: dict[str, Path]) -> bool:
+    return manifest.get('version') == STOREVERSION and manifest['sources'] == source_stats(sources)
+
+def open_store(storedir: Path = STOREDIR, sources: dict[str, Path] = None, rebuild: bool = False):
+    """FeatureStore on storedir, (re)built first if it's missing or its sources changed"""
+    sources = sources or get_sources()
+    manifest = None
+    if not rebuild and (storedir / "manifest.json").exists():
+        with open(storedir / "manifest.json") as src:
+            manifest = json.load(src)
+        if not is_fresh(manifest, sources):
+            manifest = None
+    if manifest is None:
+        manifest = build_store(storedir, sources)
+    return FeatureStore(storedir, manifest)
+
+class FeatureStore:
+    """Memory-mapped predictor tables, see the module comment for the layout"""
+
+    def __init__(self, storedir: Path = STOREDIR, manifest: dict = None):
+        self.storedir = Path(storedir)
+        if manifest is None:
+            with open(self.storedir / "manifest.json") as src:
+                manifest = json.load(src)
+        self.manifest = manifest
+        self._columns = {}
+
+    @property
+    def siteIDs(self) -> list[str]:
+        return list(self.manifest['sitehuc6'])
+
+    def column(self, table: str, name: str) -> np.ndarray:
+        key = (table, name)
+        if key not in self._columns:
+            self._columns[key] = np.load(self.storedir / table / f"{name}.npy", mmap_mode='r')
+        return self._columns[key]
+
+    def columns(self, table: str, names=None, partition=None) -> dict[str, np.ndarray]:
+        """Views on the columns of a table, only the rows of one partition if given"""
+        meta = self.manifest['tables'][table]
+        rows = slice(None)
+        if partition is not None:
+            start, stop = meta['partitions'].get(str(partition), (0, 0))
+            rows = slice(start, stop)
+        return {name: self.column(table, name)[rows] for name in (names or meta['columns'])}
+
+    def monthly_wide(self, huc6: int, months=(3,), variables=ERA5VARS) -> pd.DataFrame:
+        """A HUC6's monthly variables as one column per variable and month, indexed by year"""
+        cols = self.columns('monthly', ['year', 'month', *variables], partition=huc6)
+        years = np.unique(cols['year'])
+        wide = {}
+        for month in months:
+            rows = cols['month'] == month
+            yidx = np.searchsorted(years, cols['year'][rows])
+            for var in variables:
+                values = np.full(len(years), np.nan)
+                values[yidx] = cols[var][rows]
+                wide[f"{var}_{MONTHLABELS[month]}"] = values
+        return pd.DataFrame(wide, index=pd.Index(years, name='year'))
+
+    def target(self, siteID: str) -> pd.Series:
+        cols = self.columns('targets', ['year', TARGET],
+                            partition=self.manifest['siteIDs'].index(siteID))
+        return pd.Series(cols[TARGET], index=pd.Index(cols['year'], name='year'), name=TARGET)
+
+    def site_frame(self, siteID: str, months=(3,), predictors=None, firstyear=FIRSTYEAR) -> pd.DataFrame:
+        """Wide predictor frame of a site, one row per year from firstyear, with the
+        target (NaN in years without breakup date) as the last column. predictors selects
+        columns of the yearly and monthly (e.g. 'sd_M') predictors."""
+        yearly = self.columns('yearly')
+        years = yearly.pop('year')
+        frame = pd.DataFrame(yearly, index=pd.Index(years, name='year'))
+        frame = frame.join(self.monthly_wide(self.manifest['sitehuc6'][siteID], months), how='outer')
+        if predictors is not None:
+            frame = frame[list(predictors)]
+        frame = frame.join(self.target(siteID))
+        return frame.loc[firstyear:]
+
+    def training_data(self, siteID: str, lastyear: int, months=(3,), predictors=None):
+        """Complete training rows up to lastyear (X, y) and the predictors of the following year"""
+        frame = self.site_frame(siteID, months, predictors)
+        Xy = frame.loc[:lastyear].dropna()
+        X_pred = frame.drop(columns=TARGET).loc[lastyear + 1]
+        return Xy.drop(columns=TARGET), Xy[TARGET], X_pred
+
+def export_frames(store: FeatureStore, outdir: Path, months=(3,)):
+    """DF_<site> csvs as written by the RiverIce_dataframe_finalize notebook"""
+    outdir.mkdir(parents=True, exist_ok=True)
+    for siteID in store.siteIDs:
+        frame = store.site_frame(siteID, months)
+        frame.index.name = None
+        frame.to_csv(outdir / f"DF_{siteID.replace(' ', '_')}")
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    store = open_store(rebuild=args.rebuild)
+    tables = store.manifest['tables']
+    print(f"{STOREDIR}: " + ", ".join(f"{name} {meta['nrows']} rows" for name, meta in tables.items()))
+    if args.export is not None:
+        export_frames(store, args.export, [int(month) for month in args.months.split(',')])
+        print(f"{len(store.siteIDs)} site frames written to {args.export}")
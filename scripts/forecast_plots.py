@@ -0,0 +1,72 @@
+# Rendering of the daily DD forecast plots
+#
+# make_forecast_2024.py collects one plot spec (a dict of plain values and arrays) per site
+# and forecast day; render_forecasts draws them after the daily reports have been written,
+# optionally in a pool of worker processes. Uses the headless Agg backend.
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import scipy.stats as stats
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+import seaborn as sns
+
+xs = np.arange(-101, 101)
+
+def render_forecast(spec):
+    """Draw and save the forecast pdf and DD scatter for one site and forecast day"""
+    ii = spec['forecastday']
+    mu_0 = spec['mu']
+    mostlikely = spec['mostlikely']
+    # normalize on > 0 values
+    pdf = stats.norm.pdf(xs, mu_0, spec['sigma'])/stats.norm.pdf(xs[101:], mu_0, spec['sigma']).sum()
+    startidx = max(101, 100 + mostlikely-3)
+    endidx = startidx + 6
+    fig, ax1 = plt.subplots()
+    ax1.plot(xs[:102], pdf[:102], linestyle='dashed', color='grey', linewidth=1)
+    ax1.plot(xs[101:], pdf[101:], color='black')
+    ax1.vlines(0, 0, 0.4, colors='black', linestyles='dotted')
+    # Add most likely +/- 3 days
+    ax1.vlines(mu_0, 0, 0.4, colors='grey')
+    shiftflag = False   # do we have to shift the +/- 3 day window?
+    if  100 + mostlikely-3 < 101:
+        shiftflag = True
+    ax1.fill_between(xs[startidx:endidx+1], pdf[startidx:endidx+1], color='tab:purple', alpha=0.5)
+    ax1.text(78-ii, .36, f"Most likely breakup: ", color='tab:purple')
+    ax1.text(78-ii, .34, f"in {mostlikely} d on {spec['forecasteddate']}",
+            color='tab:purple')
+    if shiftflag:
+        textsnippet = "7d"
+    else:
+        textsnippet = "±3d"
+    ax1.text(78-ii, .32, f"P({textsnippet}) = {spec['plusminus3daysprob']*100:.1f} %", color='tab:purple')
+    ax1.text(78-ii, .29, f"P1-2 = {spec['prob_12']*100:.1f} %", color='black')
+    ax1.text(78-ii, .27, f"P3-7 = {spec['prob_37']*100:.1f} %", color='black')
+    ax1.text(78-ii, .25, f"P8-14 = {spec['prob_wk2']*100:.1f} %", color='black')
+    ax1.text(78-ii, .23, f"P15-21 = {spec['prob_wk3']*100:.1f} %", color='black')
+    ax1.set_ylim((0, 0.40))
+    ax1.set_ylabel('probability density')
+    ax1.set_xlabel("Days from forecastday")
+    ax2 = ax1.twinx()
+    color = 'tab:blue'
+    sns.scatterplot(x=spec['days_from_then'], y=spec['mean_DD'], ax=ax2)
+    ax2.scatter(x=[mu_0], y=[spec['current_DD']], c='r')
+    ax2.set_ylabel(spec['prefix'], color=color)
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.grid(None)
+    ax2.set_title(spec['title'])
+    ax2.set_xlim((45-ii, 95-ii))
+    outfn = Path(spec['outfn'])
+    outfn.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(outfn, bbox_inches='tight')
+    plt.close(fig)
+    return outfn
+
+def render_forecasts(specs, workers=1):
+    """Render all plot specs, in a pool of worker processes if workers > 1"""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(render_forecast, specs, chunksize=8))
+    return [render_forecast(spec) for spec in specs]
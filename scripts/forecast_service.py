@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+# Resident DD breakup forecast service with a local HTTP/JSON API
+#
+# Loads the HUC table, the historical breakup dates, the broken up list and every
+# site's combined DD file once, and keeps each site's likelihood table, regression fits
+# and forecasts for all forecast days (as in make_forecast_2024.py) in memory. Every
+# --interval seconds (or on POST /reload) the input files' modification times and sizes
+# are checked and only the sites whose combined DD file changed are recomputed; a
+# changed HUC table or breakup file reloads all sites. A reload builds the new state
+# and swaps it in, so requests never see a half-updated site.
+#
+#   GET  /status                            loaded inputs and reload times
+#   GET  /sites                             sites with river, locality, broken up
+#   GET  /sites/<siteID>?date=YYYY-MM-DD    forecast of a site (default latest)
+#   GET  /sites/<siteID>/forecasts          forecasts for all forecast days
+#   GET  /sites/<siteID>/likelihood?day=N   historical days to breakup vs. DD and fit
+#   GET  /rivers/<river>?date=YYYY-MM-DD    forecasts of a river's sites
+#   POST /reload                            check the inputs now
+#
+# usage: python forecast_service.py --port 8080
+
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import argparse
+import datetime as dt
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+import ddcache
+import make_forecast_2024 as mf
+
+HOST = '127.0.0.1'
+PORT = 8080
+INTERVAL = 60       # seconds between checks for changed input files
+FIRSTDAY = 20       # forecast days, days since March 1, as in make_likelihood_DF
+LASTDAY = 90
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Serve DD breakup forecasts over a local HTTP/JSON API')
+    parser.add_argument('--host', default=HOST,
+        help='address to listen on (default %(default)s)')
+    parser.add_argument('--port', type=int, default=PORT,
+        help='port to listen on (default %(default)s)')
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL,
+        help='seconds between checks for changed input files, 0 to only reload on POST /reload (default %(default)s)')
+    parser.add_argument('-p', '--prefix', default=mf.prefix,
+        help='DD threshold of the combined DD files (default %(default)s)')
+    parser.add_argument('-y', '--year', type=int, default=mf.year,
+        help='forecast year (default %(default)s)')
+    return parser.parse_args()
+
+def file_signature(pth: Path):
+    """Modification time and size of a file, None if it doesn't exist"""
+    try:
+        stat = os.stat(pth)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def to_json(obj):
+    """json.dumps default for dates and numpy values"""
+    if isinstance(obj, (dt.date, dt.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return None if np.isnan(obj) else float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+class ForecastService:
+    """In-memory forecasts for all sites of the HUC table, reloaded per site"""
+
+    def __init__(self, prefix: str = mf.prefix, year: int = mf.year, firstday: int = FIRSTDAY,
+                 lastday: int = LASTDAY, huctablepath: Path = mf.huctablepath,
+                 breakuppth: Path = mf.breakuppth, combinedpath: Path = mf.combinedpath,
+                 brokenuppth: Path | None = None):
+        self.prefix, self.year = prefix, year
+        self.firstday, self.lastday = firstday, lastday
+        self.huctablepath, self.breakuppth = Path(huctablepath), Path(breakuppth)
+        if brokenuppth is None:
+            brokenuppth = mf.PROJPATH / f"data/DDforecast_{year}/broken_up_{year}.csv"
+        self.combinedpath, self.brokenuppth = Path(combinedpath), Path(brokenuppth)
+        self.signatures = {}
+        self.huctable = self.breakupDF = None
+        self.brokenup = set()
+        self.sites = {}
+        self.reloaded = {}
+        self.lock = threading.Lock()
+
+    def ddpath(self, siteID: str) -> Path:
+        return self.combinedpath / f"{self.prefix}_combined_{siteID.replace(' ', '_')}.csv"
+
+    def reload(self) -> list[str]:
+        """Reload changed inputs and recompute the sites they affect, returns those sites.
+        Everything is loaded into new state first and swapped in only if all loads
+        succeed; if one fails, the old state stays and the next reload tries again."""
+        with self.lock, ru.timer('reload'):
+            signatures = {}
+
+            def changed(pth: Path) -> bool:
+                signatures[pth] = file_signature(pth)
+                return self.signatures.get(pth) != signatures[pth]
+
+            huctable, breakupDF, brokenup = self.huctable, self.breakupDF, self.brokenup
+            reloadall = False
+            if changed(self.huctablepath):
+                huctable = pd.read_csv(self.huctablepath, index_col=0)
+                reloadall = True
+            if changed(self.breakuppth):
+                breakupDF = pd.read_csv(self.breakuppth, header=3, index_col=0)
+                breakupDF['days_since_march1'] = breakupDF.breakup.map(ru.datestr2dayssince)
+                reloadall = True
+            if changed(self.brokenuppth):
+                brokenup = set(pd.read_csv(self.brokenuppth).location) if signatures[self.brokenuppth] else set()
+            sites = {}
+            reloaded = []
+            for item in huctable.itertuples():
+                pth = self.ddpath(item.siteID)
+                if not changed(pth) and not reloadall and item.siteID in self.sites:
+                    sites[item.siteID] = self.sites[item.siteID]
+                    continue
+                if signatures[pth] is None:
+                    continue
+                sites[item.siteID] = self.load_site(item, pth, breakupDF)
+                reloaded.append(item.siteID)
+            self.huctable, self.breakupDF, self.brokenup, self.sites = huctable, breakupDF, brokenup, sites
+            self.signatures = signatures
+            now = dt.datetime.now().isoformat(timespec='seconds')
+            self.reloaded.update({siteID: now for siteID in reloaded})
+            ru.count('site_reloads', len(reloaded))
+        return reloaded
+
+    def load_site(self, item, pth: Path, breakupDF: pd.DataFrame) -> dict:
+        """Likelihood table, fits and the forecasts of all forecast days with DD data for a site"""
+        breakup = (breakupDF[breakupDF.siteID == item.siteID]
+                   .sort_values(by='year').reset_index(drop=True))
+        mean_station = ddcache.load_ddframe(pth)
+        likelihoodDF = mf.make_likelihood_DF(breakup, mean_station, self.firstday, self.lastday)
+        fits = ru.fit_forecastdays(likelihoodDF)
+        forecasts = {}
+        if f'{self.year}' in mean_station.columns:
+            forecastdays, mus, sigmas, mostlikelys, plusminus3days, windowprobs = mf.forecast_distribution(
+                mean_station, fits, self.firstday, self.lastday, self.year)
+            for kk, day in enumerate(forecastdays.tolist()):
+                # forecast is one day later than data
+                forecastdate = ru.dayssince2date(day + 1, self.year)
+                mostlikely = int(mostlikelys[kk])
+                record = mf.result_record(
+                    item, forecastdate, mostlikely, ru.dayssince2date(mostlikely + day, self.year),
+                    plusminus3days[kk], *(windowprobs[window][kk] for window in ru.FORECAST_WINDOWS))
+                record.update(siteID=item.siteID, forecastday=day, mu=mus[kk], sigma=sigmas[kk],
+                              current_DD=mean_station.at[day, f'{self.year}'])
+                forecasts[forecastdate.isoformat()] = record
+        return {'item': item, 'likelihood': likelihoodDF, 'fits': fits, 'forecasts': forecasts}
+
+    def status(self) -> dict:
+        return {
+            'prefix': self.prefix,
+            'year': self.year,
+            'sites': len(self.sites),
+            'broken_up': sorted(self.brokenup),
+            'inputs': {str(pth): None if sig is None else dt.datetime.fromtimestamp(sig[0] / 1e9).isoformat(timespec='seconds')
+                       for pth, sig in self.signatures.items()
+                       if pth in (self.huctablepath, self.breakuppth, self.brokenuppth)},
+            'reloaded': self.reloaded,
+        }
+
+    def site_list(self) -> list[dict]:
+        return [{'siteID': siteID, 'river': site['item'].river, 'locality': site['item'].locality,
+                 'huc6': site['item'].huc6, 'broken_up': siteID in self.brokenup,
+                 'latest': max(site['forecasts'], default=None)}
+                for siteID, site in self.sites.items()]
+
+    def get_site(self, siteID: str) -> dict:
+        try:
+            return self.sites[siteID]
+        except KeyError:
+            raise LookupError(f"Unknown site {siteID}")
+
+    def forecast(self, siteID: str, date: str = None) -> dict:
+        """A site's forecast on a date, by default its latest"""
+        forecasts = self.get_site(siteID)['forecasts']
+        if not forecasts:
+            raise LookupError(f"No {self.year} forecasts for {siteID}")
+        date = date or max(forecasts)
+        if date not in forecasts:
+            raise LookupError(f"No forecast for {siteID} on {date}")
+        return dict(forecasts[date], broken_up=siteID in self.brokenup)
+
+    def forecasts(self, siteID: str) -> list[dict]:
+        return list(self.get_site(siteID)['forecasts'].values())
+
+    def likelihood(self, siteID: str, day: int) -> dict:
+        """Historical days to breakup and DD on a forecast day, with the day's fit"""
+        site = self.get_site(siteID)
+        if day not in site['fits'].index:
+            raise LookupError(f"No likelihood for forecast day {day}")
+        table = site['likelihood'][site['likelihood'].forecast_day_past_march1 == day]
+        return {'siteID': siteID, 'forecastday': day, **site['fits'].loc[day].to_dict(),
+                'year': table.year.tolist(), 'days_from_then': table.days_from_then.to_numpy(),
+                'mean_DD': table.mean_DD.to_numpy()}
+
+    def river(self, river: str, date: str = None) -> list[dict]:
+        """Forecasts of all sites on a river that have one on the date (default their latest)"""
+        siteIDs = [siteID for siteID, site in self.sites.items() if site['item'].river == river]
+        if not siteIDs:
+            raise LookupError(f"Unknown river {river}")
+        results = []
+        for siteID in siteIDs:
+            try:
+                results.append(self.forecast(siteID, date))
+            except LookupError:
+                continue
+        return results
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    service: ForecastService = None
+
+    def send_json(self, obj, status: int = 200):
+        body = json.dumps(obj, default=to_json).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        service = self.service
+        try:
+            with ru.timer('request'):
+                if parts == ['status']:
+                    result = service.status()
+                elif parts == ['sites']:
+                    result = service.site_list()
+                elif len(parts) == 2 and parts[0] == 'sites':
+                    result = service.forecast(parts[1], query.get('date'))
+                elif len(parts) == 3 and parts[0] == 'sites' and parts[2] == 'forecasts':
+                    result = service.forecasts(parts[1])
+                elif len(parts) == 3 and parts[0] == 'sites' and parts[2] == 'likelihood':
+                    result = service.likelihood(parts[1], int(query.get('day', service.firstday)))
+                elif len(parts) == 2 and parts[0] == 'rivers':
+                    result = service.river(parts[1], query.get('date'))
+                else:
+                    raise LookupError(f"Unknown path {url.path}")
+        except LookupError as err:
+            return self.send_json({'error': str(err)}, 404)
+        except ValueError as err:
+            return self.send_json({'error': str(err)}, 400)
+        self.send_json(result)
+
+    def do_POST(self):
+        if urlsplit(self.path).path.strip('/') != 'reload':
+            return self.send_json({'error': f"Unknown path {self.path}"}, 404)
+        self.send_json({'reloaded': self.service.reload()})
+
+def watch(service: ForecastService, interval: float):
+    """Check the inputs every interval seconds (run in a daemon thread)"""
+    while True:
+        time.sleep(interval)
+        try:
+            reloaded = service.reload()
+        except Exception as err:
+            print(f"reload failed: {err}")
+            continue
+        if reloaded:
+            print(f"reloaded {', '.join(reloaded)}")
+
+def serve(service: ForecastService, host: str = HOST, port: int = PORT, interval: float = INTERVAL):
+    handler = type('Handler', (ForecastHandler,), {'service': service})
+    if interval > 0:
+        threading.Thread(target=watch, args=(service, interval), daemon=True).start()
+    with ThreadingHTTPServer((host, port), handler) as server:
+        print(f"serving {len(service.sites)} sites on http://{host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    service = ForecastService(args.prefix, args.year)
+    service.reload()
+    serve(service, args.host, args.port, args.interval)
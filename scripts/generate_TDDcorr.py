@@ -2,9 +2,9 @@ import riverice_util as rutil
 from pathlib import Path
 import datetime as dt
 import pandas as pd
+import numpy as np
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
 PREFIX = "DD25"
 BREAKUPPTH = rutil.BREAKUPPTH
 CLIMPTH = rutil.get_climpath(PREFIX)
@@ -30,43 +30,55 @@ def makeDF_from_records(records: list[dict[str]]) -> pd.DataFrame:
     outdf.drop(columns=['dummydate'], inplace=True)
     return outdf
 
-def get_correlationrecords(station_dd: list[Path], 
+def get_correlationrecords(anomalycube: tuple[np.ndarray, list[str], np.ndarray], 
                            breakupDF: pd.DataFrame,
-                           datestr: str,
-                           locations: list[str]) -> list:
-        for pth in station_dd:
-            stationname = pth.stem[:(-14-len(PREFIX))]
-            logging.debug(f"   working on {stationname}")
-            teststationDF = pd.read_csv(pth, skiprows=4, index_col=0)
-            breakupDF[stationname] = breakupDF.apply(
-                lambda row: rutil.retrieve_dd_anomaly_fixed(row, stationname, teststationDF, datestr), axis=1)
-        returnrec = rutil.calculate_corr(breakupDF, locations)
-        return returnrec
+                           datestrs: list[str],
+                           locations: list[str]) -> dict[str, list]:
+        """Correlation records for each date in datestrs, computed in one batch"""
+        cube, stationnames, cubeyears = anomalycube
+        years = np.array(sorted(breakupDF.year.unique()))
+        days = np.stack([rutil.fixed_date_days(years, datestr) for datestr in datestrs])
+        anomalies = rutil.gather_anomalies(
+            cube, cubeyears, np.broadcast_to(years, days.shape), days).transpose(1, 0, 2)
+        breakupdays = rutil.make_breakupmatrix(breakupDF, years, locations)
+        return rutil.calculate_corr_batch(anomalies, breakupdays, datestrs, stationnames, locations)
 
-if __name__ == '__main__':
-    breakup = pd.read_csv(BREAKUPPTH, header=3, index_col=0)
-    breakup['days_since_march1'] = breakup.apply(lambda row: rutil.datestr2dayssince(row.breakup), axis=1)
+def get_outpath(prefix: str = PREFIX, outpath: Path = OUTPATH) -> Path:
+    return outpath / f"{prefix}_anomaly_correlations.csv"
+
+def write_correlations(prefix: str = PREFIX, breakuppth: Path = BREAKUPPTH, outpath: Path = OUTPATH) -> dict:
+    """Correlations of the prefix's DD anomalies with the breakup day for all stations,
+    locations and dates, written to outpath. Returns the counts for the run summary."""
+    with rutil.timer('read_breakup'):
+        breakup = pd.read_csv(breakuppth, header=3, index_col=0)
+        breakup['days_since_march1'] = breakup.apply(lambda row: rutil.datestr2dayssince(row.breakup), axis=1)
     logging.info(f"Read breakup DataFrame, {len(breakup)} lines")
-    climatologies = pd.read_csv(CLIMPTH, header=3, index_col=0)
-    station_dd = sorted(list(STATIONDATA.glob("*.csv")))
+    station_dd = sorted(list(rutil.get_stationdata(prefix).glob("*.csv")))
+    with rutil.timer('anomaly_cube'):
+        anomalycube = rutil.build_anomaly_cube(station_dd, rutil.get_climpath(prefix))
     locations = breakup.siteID.unique()
     logging.info("Successfully read climatologies, stations, and locations.")
 
     # Retrieve records for each correlation  dataframe 
-    records = {}
-    try:
-        for ii in range(NUMDAYS):
-            datepoint = STARTDATE + dt.timedelta(days=ii)
-            datestr = datepoint.strftime('%m-%d')
-            print(f"Working on {datestr}")
-            breakup_anomaly_fixed = breakup.copy()
-            records[datestr] = get_correlationrecords(
-                station_dd, breakup_anomaly_fixed, datestr, locations) 
-    finally:
+    datestrs = [(STARTDATE + dt.timedelta(days=ii)).strftime('%m-%d') for ii in range(NUMDAYS)]
+    logging.info(f"Correlating {len(datestrs)} dates from {datestrs[0]} to {datestrs[-1]}")
+    with rutil.timer('correlations'):
+        records = get_correlationrecords(anomalycube, breakup, datestrs, locations)
         recordsDF = makeDF_from_records(records)
+    rutil.count('correlations', len(recordsDF))
 
-    with open(OUTPATH / f"{PREFIX}_anomaly_correlations.csv", "w") as dst:
-        dst.write(f"# Correlations between {PREFIX} anomalies each date since April 1 and breakup day \n")
+    with rutil.timer('write'), open(get_outpath(prefix, outpath), "w") as dst:
+        dst.write(f"# Correlations between {prefix} anomalies each date since April 1 and breakup day \n")
         dst.write("# For all selected sites and stations\n")
         dst.write("# \n")
         recordsDF.to_csv(dst)
+    return dict(prefix=prefix, stations=len(station_dd), locations=len(locations), dates=len(datestrs))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    started = dt.datetime.now()
+    with rutil.profiling(OUTPATH, 'generate_TDDcorr'):
+        info = write_correlations()
+    summary = rutil.write_summary(OUTPATH / f"{PREFIX}_anomaly_correlations_summary.json", started,
+        script='generate_TDDcorr.py', **info)
+    logging.info(f"Done in {summary['wall_s']:.1f} s")
@@ -2,17 +2,40 @@
 # 
 # 2023-02-28 cwaigl@alaska.edu
 
+import argparse
 import csv
+import datetime as dt
+import os
 from pathlib import Path
-import requests
-import pandas as pd
-import geopandas as gp
-import numpy as np
+import acis_client
 
 PROJPATH = Path(__file__).resolve().parent.parent
 ACISDIR = PROJPATH / "data/weatherstations/ACIS"
 OUTDIR = ACISDIR / 'stationdata/RFC_new_model'
 ACISSTATIONS = "ACIS_stations_AK_fornewmodel.csv"
+ACISURL = acis_client.ACISURL
+SDATE = "1980-01-01"
+OVERLAPDAYS = 7     # re-fetch the last days already stored, ACIS fills in late reports
+# station file names that differ from the ACIS station name
+STATIONNAMES = {
+    'NENANA MUNICIPAL AIRPORT': 'NENANA_MUN_AP',
+}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Download ACIS daily data for the model stations')
+    parser.add_argument('-i', '--incremental',
+        help='only fetch the days after those already stored and append them',
+        action='store_true')
+    parser.add_argument('-e', '--edate',
+        help='last date to retrieve, YYYY-MM-DD (default today)',
+        default=dt.date.today().isoformat())
+    parser.add_argument('-u', '--url',
+        help=f'ACIS web services base URL (default {ACISURL})',
+        default=ACISURL)
+    parser.add_argument('-w', '--workers',
+        help=f'number of concurrent requests (default {acis_client.MAXWORKERS})',
+        type=int, default=acis_client.MAXWORKERS)
+    return parser.parse_args()
 
 def safelyget(alist, idx, default='N/A'):
     """Returns alist[idx] if exists, else default"""
@@ -21,27 +44,84 @@ def safelyget(alist, idx, default='N/A'):
     except (KeyError, IndexError):
         return default
 
-def get_acis_stationdata(uid):
-
-    baseurl = 'http://data.rcc-acis.org/StnData'
+def get_acis_stationdata(uid, sdate=SDATE, edate=None, baseurl=ACISURL, fetch=acis_client.fetch):
+    """Daily max/min/avg T, snow depth and SWE for a station as ACIS csv text.
+    fetch(url, params) does the request (by default through the shared ACIS client), 
+    swap it out to use another transport or a stand-in server."""
     params = {
         'uid': uid,
-        'sdate': "1980-01-01",
-        'edate': "2024-05-30",
+        'sdate': sdate,
+        'edate': edate or dt.date.today().isoformat(),
         'elems': "maxt,mint,avgt,snwd,13",
         'output': 'csv'
     }
-    resp = requests.get(url=baseurl, params=params)
-    return resp.text
+    return fetch(f"{baseurl}/StnData", params)
+
+def get_stationfile(name):
+    return OUTDIR / f"{STATIONNAMES.get(name, name.replace(' ', '_'))}_T_max_min_avg_sd_swe.csv"
+
+def last_stored_date(pth):
+    """Date of the last row in a station file, None if the file has no data rows"""
+    with open(pth, 'rb') as src:
+        src.seek(0, os.SEEK_END)
+        src.seek(max(0, src.tell() - 1024))
+        lines = src.read().decode().strip().splitlines()
+    try:
+        return dt.date.fromisoformat(lines[-1].split(',')[0])
+    except ValueError:
+        return None
+
+def update_stationfile(pth, uid, edate=None, overlap=OVERLAPDAYS, **kwargs):
+    """Fetch only the days after the last stored one (plus an overlap that gets replaced)
+    and append them to the station file. Returns the years whose data changed."""
+    lastdate = last_stored_date(pth)
+    if lastdate is None:
+        raise ValueError(f"{pth} holds no data, download the full record instead")
+    sdate = (lastdate - dt.timedelta(days=overlap)).isoformat()
+    newrows = get_acis_stationdata(uid, sdate, edate, **kwargs).strip().splitlines()[1:]
+    if not newrows:
+        # an empty or header-only response replaces nothing, keep the stored overlap
+        return []
+    # replace the stored rows from the first one fetched on, which is sdate unless
+    # ACIS has nothing for the first days of the overlap
+    firstdate = newrows[0][:10]
+    with open(pth, 'rb+') as dst:
+        content = dst.read()
+        # find the first stored row that gets replaced, working back from the end
+        cut = len(content)
+        for line in reversed(content.splitlines(keepends=True)[1:]):
+            if line[:10].decode() < firstdate:
+                break
+            cut -= len(line)
+        oldrows = content[cut:].decode().splitlines()
+        dst.seek(cut)
+        dst.truncate()
+        if not content[:cut].endswith(b'\n'):
+            dst.write(b'\n')
+        dst.write(''.join(f"{row}\n" for row in newrows).encode())
+    changed = set(newrows) - set(oldrows)
+    return sorted({int(row[:4]) for row in changed})
 
 if __name__=='__main__':
+    args = parse_arguments()
     # get station file
-    stations = pd.read_csv(ACISDIR / ACISSTATIONS)
+    with open(ACISDIR / ACISSTATIONS, newline='') as src:
+        stations = list(csv.DictReader(src))
 
-    for idx, record in stations.iterrows():
-        outfn = f"{record['name'].replace(' ', '_')}_T_max_min_avg_sd_swe.csv"
-        print(f"getting {outfn}")
-        out = get_acis_stationdata(record['acisID'])
-        with open(OUTDIR / outfn, 'w') as dst:
+    def retrieve(record):
+        outpth = get_stationfile(record['name'])
+        if args.incremental and outpth.exists():
+            print(f"updating {outpth.name}")
+            return outpth.name, update_stationfile(
+                outpth, record['acisID'], edate=args.edate, baseurl=args.url, fetch=client.fetch)
+        print(f"getting {outpth.name}")
+        out = get_acis_stationdata(record['acisID'], edate=args.edate, baseurl=args.url, fetch=client.fetch)
+        with open(outpth, 'w') as dst:
             dst.write(out)
+        return outpth.name, None
 
+    with acis_client.ACISClient(args.url, max_workers=args.workers) as client:
+        results = client.map(retrieve, stations)
+    for name, years in results:
+        if years is not None:
+            print(f"{name}: {'updated ' + ', '.join(map(str, years)) if years else 'no new data'}")
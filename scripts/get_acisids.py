@@ -4,10 +4,9 @@
 
 import csv
 from pathlib import Path
-import requests
 import pandas as pd
-import geopandas as gp
 import numpy as np
+import acis_client
 
 PROJPATH = Path(__file__).resolve().parent.parent
 DATADIR = PROJPATH / "data/weatherstations/Breakup_model_stations"
@@ -52,17 +51,9 @@ def get_stationcodes(filelist):
                 stationcodes.append(row[0])
     return sorted(list(set(stationcodes)))
     
-def get_acis_stationmeta(stationlist):
-    sidsvalue = ','.join(stationlist)
-
-    baseurl = 'http://data.rcc-acis.org/StnMeta'
-    params = {
-        'sids': sidsvalue,
-        'meta': "name,uid,sids,ll,elev,valid_daterange",
-        'elems': "avgt,snow"
-    }
-    resp = requests.get(url=baseurl, params=params)
-    return resp.json()['meta']
+def get_acis_stationmeta(stationlist, client=None):
+    client = client or acis_client.get_client()
+    return client.stn_meta(stationlist, meta="name,uid,sids,ll,elev,valid_daterange", elems="avgt,snow")
 
 def sidslist_to_dict(sidslist):
     return {
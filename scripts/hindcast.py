@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# Leave-one-year-out hindcast of the DD breakup forecast (make_forecast_2024.py)
+#
+# For every site, historical breakup year and forecast day, the days-to-breakup vs. DD
+# regression is refit without that year and used to forecast it. The regression sums
+# over all years are computed once per (site, forecast day); leaving a year out is a
+# subtraction, so the whole hindcast is a handful of array operations on a
+# (site, forecast day, year) cube built from the ACIS_combined_DD matrices.
+
+from pathlib import Path
+import argparse
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+import ddcache
+
+PREFIX = "DD25"
+FIRSTDAY = 20       # forecast days (days since March 1 with DD data) as in make_likelihood_DF
+LASTDAY = 90
+CHUNKSIZE = 50_000  # forecasts per batch when evaluating the breakup probabilities
+
+PROJPATH = Path(__file__).resolve().parent.parent
+breakuppth = PROJPATH / "data/breakupdata/derived/breakupDate_cleaned.csv"
+huctablepath = PROJPATH / "data/breakupdata/derived/breakupDate_mean_std_HUC_augmented.csv"
+outfolder = PROJPATH / "data/hindcast"
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Leave-one-year-out hindcast of the DD breakup forecast')
+    parser.add_argument('-p', '--prefix',
+        help=f'DD threshold of the combined DD files (default {PREFIX})',
+        default=PREFIX)
+    parser.add_argument('-f', '--firstday',
+        help=f'first forecast day, days since March 1 (default {FIRSTDAY})',
+        type=int, default=FIRSTDAY)
+    parser.add_argument('-l', '--lastday',
+        help=f'forecast days end before this day (default {LASTDAY})',
+        type=int, default=LASTDAY)
+    parser.add_argument('-o', '--output',
+        help=f'output csv (default {outfolder}/<prefix>_hindcast.csv)',
+        type=Path, default=None)
+    return parser.parse_args()
+
+def read_breakups(breakuppth=breakuppth) -> pd.DataFrame:
+    breakupDF = pd.read_csv(breakuppth, header=3, index_col=0)
+    breakupDF['days_since_march1'] = (pd.to_datetime(breakupDF.breakup)
+        - pd.to_datetime(breakupDF.year.astype(str) + '-03-01')).dt.days
+    return breakupDF
+
+def build_cube(siteIDs, breakupDF, prefix=PREFIX, firstday=FIRSTDAY, lastday=LASTDAY,
+               combinedpath=ddcache.COMBINEDPATH):
+    """DD on each forecast day and breakup day for every site and breakup year.
+    Returns dd (site, day, year), breakupdays (site, year), both NaN where there's no data,
+    and the forecast days and years along the axes."""
+    days = np.arange(firstday, lastday)
+    years = np.sort(breakupDF.year.unique())
+    breakupdays = (breakupDF.pivot(index='siteID', columns='year', values='days_since_march1')
+        .reindex(index=siteIDs, columns=years).to_numpy(dtype=float))
+    dd = np.full((len(siteIDs), len(days), len(years)), np.nan)
+    for ii, siteID in enumerate(siteIDs):
+        ddpth = combinedpath / f"{prefix}_combined_{siteID.replace(' ', '_')}.csv"
+        mean_station = ddcache.load_ddframe(ddpth)
+        dd[ii] = mean_station.reindex(index=days, columns=years.astype(str)).to_numpy(dtype=float)
+    return dd, breakupdays, days, years
+
+def leave_one_out_fits(dd, breakupdays, days):
+    """Regression of days to breakup on DD per (site, forecast day) without each year in turn.
+    Returns days to breakup, the forecast mean, sigma and the number of training years,
+    all shaped like dd."""
+    daysto = breakupdays[:, None, :] - days[None, :, None]
+    valid = np.isfinite(dd) & np.isfinite(daysto)
+    x = np.where(valid, dd, 0.)
+    y = np.where(valid, daysto, 0.)
+    terms = [valid.astype(float), x, y, x * x, x * y, y * y]
+    # sums over all years minus the year's own contribution
+    sums = [term.sum(axis=-1, keepdims=True) - term for term in terms]
+    slope, intercept, sigma = ru.regression_from_sums(*sums)
+    return daysto, intercept + slope * dd, sigma, sums[0]
+
+def score_forecasts(daysto, mu, sigma, windows=ru.FORECAST_WINDOWS, chunksize=CHUNKSIZE):
+    """Most likely day, error and window probabilities with the observed outcome for a flat
+    batch of forecasts, as in the daily reports"""
+    scores = {}
+    mostlikely = np.round(mu).astype(int)
+    scores['mostlikely'] = mostlikely
+    scores['error'] = mostlikely - daysto
+    first, last = ru.mostlikely_window(mostlikely)
+    allwindows = {'prob_pm3': (first, last)} | dict(windows)
+    probs = {name: np.empty(len(mu)) for name in allwindows}
+    for start in range(0, len(mu), chunksize):
+        chunk = slice(start, start + chunksize)
+        cdf = ru.breakup_cdf(mu[chunk], sigma[chunk])
+        for name, bounds in allwindows.items():
+            probs[name][chunk] = ru.interval_probability(
+                cdf, *(bound[chunk] if np.ndim(bound) else bound for bound in bounds))
+    for name, (first, last) in allwindows.items():
+        scores[name] = probs[name]
+        scores[name.replace('prob_', 'obs_')] = (daysto >= first) & (daysto <= last)
+    return scores
+
+def run_hindcast(sites, breakupDF, prefix=PREFIX, firstday=FIRSTDAY, lastday=LASTDAY) -> pd.DataFrame:
+    """Tidy hindcast table with one row per site, year and forecast day before breakup"""
+    siteIDs = [item.siteID for item in sites]
+    dd, breakupdays, days, years = build_cube(siteIDs, breakupDF, prefix, firstday, lastday)
+    daysto, mu, sigma, ntrain = leave_one_out_fits(dd, breakupdays, days)
+    # forecasts are only made for sites that haven't broken up, and need a fit
+    keep = (np.isfinite(dd) & (daysto >= 0) & np.isfinite(mu) & (sigma > 0))
+    siteidx, dayidx, yearidx = np.nonzero(keep)
+    results = pd.DataFrame({
+        'siteID': np.array(siteIDs)[siteidx],
+        'river': np.array([item.river for item in sites])[siteidx],
+        'locality': np.array([item.locality for item in sites])[siteidx],
+        'year': years[yearidx],
+        'forecast_day_past_march1': days[dayidx],
+        'n_train': ntrain[keep].astype(int),
+        'current_DD': dd[keep],
+        'days_to_breakup': daysto[keep].astype(int),
+        'mu': mu[keep],
+        'sigma': sigma[keep],
+    })
+    scores = score_forecasts(results.days_to_breakup.to_numpy(), results.mu.to_numpy(),
+                             results.sigma.to_numpy())
+    results = results.assign(**scores)
+    # forecast is one day later than data, as in the daily reports
+    results.insert(5, 'forecastdate', pd.to_datetime(results.year.astype(str) + '-03-01')
+        + pd.to_timedelta(results.forecast_day_past_march1 + 1, unit='D'))
+    return results
+
+def summarize_mae(results, by='forecast_day_past_march1') -> pd.Series:
+    """Mean absolute error of the most likely breakup day"""
+    return results.error.abs().groupby(results[by]).mean().rename('MAE')
+
+def calibration_table(results, nbins=10) -> pd.DataFrame:
+    """Reliability of the window probabilities: mean forecast probability vs. observed
+    frequency of breakup in the window, in bins of forecast probability"""
+    edges = np.linspace(0, 1, nbins + 1)
+    tables = []
+    for col in [col for col in results.columns if col.startswith('prob_')]:
+        probs = results[col]
+        bins = pd.cut(probs, edges, include_lowest=True)
+        table = pd.DataFrame({'forecast': probs,
+                              'observed': results[col.replace('prob_', 'obs_')]})
+        table = table.groupby(bins, observed=True).agg(
+            n=('forecast', 'size'), forecast=('forecast', 'mean'), observed=('observed', 'mean'))
+        tables.append(table.reset_index(names='bin').assign(window=col))
+    return pd.concat(tables, ignore_index=True)[['window', 'bin', 'n', 'forecast', 'observed']]
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    huctable = pd.read_csv(huctablepath)
+    breakupDF = read_breakups()
+    sites = []
+    for _, item in huctable.iterrows():
+        ddpth = ddcache.COMBINEDPATH / f"{args.prefix}_combined_{item.siteID.replace(' ', '_')}.csv"
+        if not ddpth.exists():
+            print(f"{item.siteID}: no combined {args.prefix} file, skipping")
+            continue
+        sites.append(item)
+    results = run_hindcast(sites, breakupDF, args.prefix, args.firstday, args.lastday)
+    outfn = args.output or outfolder / f"{args.prefix}_hindcast.csv"
+    outfn.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(outfn, float_format='%.4f', index=False)
+    print(f"{len(results)} forecasts for {len(sites)} sites written to {outfn}")
+    print(f"MAE {results.error.abs().mean():.2f} days")
+    print(calibration_table(results).to_string(index=False))
@@ -1,24 +1,23 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import pandas as pd
 import datetime as dt 
-from sklearn import linear_model
-from sklearn.metrics import mean_squared_error
-import scipy.stats as stats
 import numpy as np
-from matplotlib import pyplot as plt
-import seaborn as sns
 import riverice_util as ru
+import ddcache
+import reportstore
+import os
 import warnings
 
 warnings.filterwarnings("ignore")
 prefix = "DD25" 
-xs = np.arange(-101, 101)
-year = 2024
+year = ru.LASTYEAR
 for_ffmpeg = False
 DAILY = True
 PLOTS = True
 
-PROJPATH = Path().resolve().parent
+PROJPATH = Path(__file__).resolve().parent.parent
 tdd_anomalycorr = PROJPATH / f"data/breakupdata/derived/{prefix}_anomaly_correlations.csv"
 breakup_stats = PROJPATH / f"data/breakupdata/derived/breakupdate_mean_std_1983_2022.csv"
 breakupdata = PROJPATH / 'data/breakupdata/'
@@ -26,39 +25,207 @@ breakuppth = breakupdata / "derived/breakupDate_cleaned.csv"
 stationfolder = PROJPATH / f"data/weatherstations/ACIS/{prefix}/dd_cumul_bystation"
 combinedpath = PROJPATH / 'data/weatherstations/ACIS_combined_DD'
 huctablepath = PROJPATH / "data/breakupdata/derived/breakupDate_mean_std_HUC_augmented.csv"
-outfolder = PROJPATH / f"data/DDforecast_2024"
-broken_up = "broken_up_2024.csv"
+outfolder = PROJPATH / f"data/DDforecast_{year}"
+broken_up = f"broken_up_{year}.csv"
 
 def get_brokenup():
+    """Locations that have broken up this season, none before broken_up_<year>.csv exists"""
+    if not (outfolder / broken_up).exists():
+        return set()
     return set(pd.read_csv(outfolder / broken_up).location)
     
 
-def make_likelihood_DF(breakupDF):
-    """Generate a dataframe of breakup likelihoods from historical data"""
-    possible_days = sorted(list(set(breakupDF['days_since_march1'])))
-    records = []
-    for days_after_march_1 in range(20, 90):
-        days_from_now_possible = [item-days_after_march_1 for item in possible_days]
-        if len(days_from_now_possible) != 0:
-            for days in days_from_now_possible:
-                days_possible = days + days_after_march_1
-                years = breakup[breakup['days_since_march1']==days_possible].year.astype(str).to_list()
-                if len(years) == 0: 
-                    print("This shouldnt happen")
-                    continue
-                for year in years:
-                    records.append({
-                        'forecast_day_past_march1': days_after_march_1,
-                        'year': year,
-                        'days_from_then': days,
-                        'mean_DD': mean_station[year][days_after_march_1]}
-                    )
-    likelihoodDF = pd.DataFrame.from_records(records)
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Make DD breakup forecasts for all sites that have not broken up')
+    parser.add_argument('-w', '--workers',
+        help='number of worker processes, sites are distributed among them (default 1)',
+        type=int, default=1)
+    parser.add_argument('-p', '--profile',
+        help=f'profile the run: cprofile, tracemalloc or both, comma separated (same as setting {ru.PROFILE_ENV})',
+        default=None)
+    return parser.parse_args()
+
+def make_likelihood_DF(breakupDF, mean_station, first_day=20, last_day=90):
+    """Generate a dataframe of breakup likelihoods from historical data: for each forecast day 
+    and each historical breakup, the days until breakup and the (combined station) DD on the 
+    forecast day in that year"""
+    forecastdays = pd.DataFrame({'forecast_day_past_march1': np.arange(first_day, last_day)})
+    breakups = breakupDF[['year', 'days_since_march1']].sort_values(
+        'days_since_march1', kind='stable').astype({'year': str})
+    likelihoodDF = forecastdays.merge(breakups, how='cross')
+    likelihoodDF['days_from_then'] = (likelihoodDF['days_since_march1'] 
+                                      - likelihoodDF['forecast_day_past_march1'])
+    ddmatrix = mean_station.reindex(index=forecastdays.forecast_day_past_march1, 
+                                    columns=breakups.year.unique()).to_numpy()
+    likelihoodDF['mean_DD'] = ddmatrix[
+        likelihoodDF['forecast_day_past_march1'].to_numpy() - first_day,
+        pd.Index(breakups.year.unique()).get_indexer(likelihoodDF['year'])]
+    likelihoodDF = likelihoodDF.drop(columns='days_since_march1')
     likelihoodDF['day_absolute_since_march_1'] = likelihoodDF['forecast_day_past_march1'] + likelihoodDF['days_from_then']
-    likelihoodDF['forecastdate'] = likelihoodDF['forecast_day_past_march1'].apply(ru.dayssince2date)
+    forecastdates = {day: ru.dayssince2date(day) for day in range(first_day, last_day)}
+    likelihoodDF['forecastdate'] = likelihoodDF['forecast_day_past_march1'].map(forecastdates)
     return likelihoodDF
 
+def forecast_distribution(mean_station, fits, days_start, days_end, year=year):
+    """Breakup forecast for each forecast day from days_start to days_end, stopping at
+    the first day without DD data for year and leaving out days without a fit: forecast
+    days, mean and sigma of the days to breakup, most likely day, probability within ± 3
+    days of it and the window probabilities"""
+    forecastdays = np.arange(days_start, days_end)
+    DDvals = mean_station[f'{year}'].reindex(forecastdays).to_numpy(dtype=float)
+    if np.isnan(DDvals).any():
+        forecastdays = forecastdays[:np.argmax(np.isnan(DDvals))]
+        DDvals = DDvals[:len(forecastdays)]
+    fit = fits.reindex(forecastdays)
+    mus = fit.intercept.to_numpy() + fit.slope.to_numpy() * DDvals
+    # days without a fit (e.g. after the site's latest historical breakup) have no forecast
+    fitted = ~np.isnan(mus)
+    forecastdays, mus = forecastdays[fitted], mus[fitted]
+    sigmas = fit.sigma.to_numpy()[fitted]
+    cdf = ru.breakup_cdf(mus, sigmas)
+    windowprobs = ru.window_probabilities(cdf)
+    mostlikelys = np.round(mus).astype(int)
+    plusminus3days = ru.interval_probability(cdf, *ru.mostlikely_window(mostlikelys))
+    return forecastdays, mus, sigmas, mostlikelys, plusminus3days, windowprobs
+
+def result_record(item, forecastdate, mostlikely, forecasteddate, plusminus3daysprob,
+                  prob_12, prob_37, prob_wk2, prob_wk3) -> dict:
+    """One site's row of a daily report"""
+    return {
+        "location": item.locality,
+        "river": item.river,
+        "forecastdate": forecastdate,
+        "most likely breakup in (days)": mostlikely,
+        "forecasted date": forecasteddate,
+        "average breakup date": item.mean_date,
+        "probability of breakup within ± 3 days around forecasted": plusminus3daysprob,
+        "probability of breakup within 1 or 2 days": prob_12, 
+        "probability of breakup within 3-7 days": prob_37, 
+        "probability of breakup within week 2 from now": prob_wk2, 
+        "probability of breakup within week 3 from now": prob_wk3
+    }
+
+def forecast_site(item, breakup, days_start, days_end):
+    """Forecast records for one site (a row of the HUC table) for each forecast day, plot
+    specs for forecast_plots if PLOTS is set, and the site's metrics. breakup holds the 
+    historical breakup records for the site"""
+    with ru.collect_metrics() as metrics, ru.profiling(outfolder, item.siteID), \
+            ru.timer('forecast_site', site=item.siteID):
+        records, plotspecs = _forecast_site(item, breakup, days_start, days_end)
+    return records, plotspecs, metrics.snapshot()
+
+def _forecast_site(item, breakup, days_start, days_end):
+    location = item.siteID
+    river = item.river
+    locality = item.locality
+    print(f"working on {location}")
+    # load combined station data
+    with ru.timer('load_dd'):
+        mean_station = ddcache.load_ddframe(combinedpath / f"{prefix}_combined_{location.replace(' ', '_')}.csv")
+    with ru.timer('likelihood'):
+        likelihoodDF = make_likelihood_DF(breakup, mean_station)
+
+    # fit all forecast days at once
+    with ru.timer('fit'):
+        fits = ru.fit_forecastdays(likelihoodDF)
+    forecastdays, mus, sigmas, mostlikelys, plusminus3days, windowprobs = forecast_distribution(
+        mean_station, fits, days_start, days_end)
+
+    # generate records and plot specs
+    records = []
+    plotspecs = []
+    if for_ffmpeg: icount = 1
+    for kk, ii in enumerate(forecastdays.tolist()):
+        mu_0 = mus[kk]
+        sigma_0 = sigmas[kk]
+        prob_12 = windowprobs['prob_12'][kk]
+        prob_37 = windowprobs['prob_37'][kk]
+        prob_wk2 = windowprobs['prob_wk2'][kk]
+        prob_wk3 = windowprobs['prob_wk3'][kk]
+        forecastdate = ru.dayssince2date(ii + 1, year) # forecast is one day later than data
+        mostlikely = int(mostlikelys[kk])
+        forecasteddate = ru.dayssince2date(mostlikely+ii, year)
+        plusminus3daysprob = plusminus3days[kk]
+        print(f"Forecast on {forecastdate}")
+        print(mu_0, np.round(mu_0), sigma_0, prob_12, prob_37, prob_wk2, prob_wk3)
+        if PLOTS:
+            DF = likelihoodDF[likelihoodDF.forecast_day_past_march1==ii]
+            loc = locality.upper().replace(' ', '_')
+            outdir = outfolder / f"{river.replace(' ', '_')}"
+            if not for_ffmpeg:
+                outfn = (outdir / 
+                        f"{loc}_DD25_{year}_{forecastdate}.png")
+            else:
+                outfn = (outdir /
+                        f"{loc}_DD25_{year}_{icount:02d}.png")
+                icount += 1 
+            plotspecs.append({
+                "forecastday": ii,
+                "mu": mu_0,
+                "sigma": sigma_0,
+                "mostlikely": mostlikely,
+                "forecasteddate": forecasteddate,
+                "plusminus3daysprob": plusminus3daysprob,
+                "prob_12": prob_12,
+                "prob_37": prob_37,
+                "prob_wk2": prob_wk2,
+                "prob_wk3": prob_wk3,
+                "days_from_then": DF['days_from_then'].to_numpy(),
+                "mean_DD": DF['mean_DD'].to_numpy(),
+                "current_DD": mean_station.iloc[ii-1][f"{year}"],
+                "prefix": prefix,
+                "title": f"{locality} ({river}), prediction on {forecastdate}",
+                "outfn": outfn,
+            })
+        records.append(result_record(item, forecastdate, mostlikely, forecasteddate, plusminus3daysprob,
+                                     prob_12, prob_37, prob_wk2, prob_wk3))
+    ru.count('forecasts', len(records))
+    return records, plotspecs
+
+def run_forecasts(sites, breakupDF, days_start, days_end, workers=1):
+    """Forecast all sites, optionally in a pool of worker processes. 
+    Returns records per forecast date, in the order of the sites, and the plot specs. 
+    The sites' metrics are added to ru.METRICS."""
+    breakups = [
+        breakupDF[breakupDF.siteID == item.siteID].sort_values(by='year').reset_index(drop=True)
+        for item in sites
+    ]
+    nsites = len(sites)
+    args = (sites, breakups, [days_start] * nsites, [days_end] * nsites)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            siteresults = list(pool.map(forecast_site, *args))
+    else:
+        siteresults = list(map(forecast_site, *args))
+    results = {}
+    plotspecs = []
+    for records, specs, metrics in siteresults:
+        ru.METRICS.merge(metrics)
+        for resultrecord in records:
+            results.setdefault(resultrecord['forecastdate'], []).append(resultrecord)
+        plotspecs.extend(specs)
+    return results, plotspecs
+
+@ru.timer('write_reports')
+def write_reports(results):
+    """Write one daily_report_<date>.csv per forecast date and append the records to
+    the report store"""
+    ru.count('reports', len(results))
+    reportstore.ReportStore().append([record for forecastdate in sorted(results) for record in results[forecastdate]])
+    for forecastdate in sorted(results):
+        outdf = pd.DataFrame.from_records(results[forecastdate])
+        outdf.sort_values(['river', "average breakup date"], inplace=True)
+        outfn = f"daily_report_{forecastdate}.csv"
+        with open(outfolder / outfn, 'w') as dst:
+            outdf.to_csv(dst, float_format='%.2f', index=False)
+
 if __name__ == '__main__':
+    args = parse_arguments()
+    if args.profile:
+        # set in the environment so that worker processes profile too
+        os.environ[ru.PROFILE_ENV] = args.profile
+    started = dt.datetime.now()
+    outfolder.mkdir(parents=True, exist_ok=True)
     days_start = 31
     days_end = 90
     if DAILY:
@@ -67,127 +234,30 @@ if __name__ == '__main__':
         days_end = ru.datestr2dayssince(today)
         days_start = ru.datestr2dayssince(today) - 1
 
-    huctable = pd.read_csv(huctablepath)
-    breakupDF = pd.read_csv(breakuppth, header=3, index_col=0)
-    breakupDF['days_since_march1'] = breakupDF.apply(
-        lambda row: ru.datestr2dayssince(row.breakup), axis=1)
-    broken_upSet = get_brokenup()
-    print(broken_upSet)
-
-    results = {}
-    for _, item in huctable.iterrows():
-        location = item.siteID
-        if location in broken_upSet:
-            print(f"{location} has broken up")
-            continue
-        river = item.river
-        locality = item.locality
-        print(f"working on {location}")
-        # load combined station data
-        mean_station = pd.read_csv(combinedpath / f"{prefix}_combined_{location.replace(' ', '_')}.csv", 
-            skiprows=3, index_col=0)
-        # filter breakup data
-        breakup = breakupDF.copy()
-        breakup = breakup[breakup.siteID == location].sort_values(by='year').reset_index(drop=True)
-        likelihoodDF = make_likelihood_DF(breakup)
-
-        # do calculation and generate plots
-        if for_ffmpeg: icount = 1
-        for ii in range (days_start, days_end, 1):
-            breakup_avg_model = linear_model.LinearRegression() 
-            DF = likelihoodDF[likelihoodDF.forecast_day_past_march1==ii].copy()
-            DDval = mean_station[f'{year}'][ii].squeeze()
-            breakup_avg_model.fit(DF[['mean_DD']].values, DF[['days_from_then']].values)
-            try: 
-                mu_0 = breakup_avg_model.predict([[DDval]]).item()
-            except ValueError:
-                break
-            sigma_0 = mean_squared_error([breakup_avg_model.predict([[dd]]).item() for dd in DF['mean_DD'].tolist()],
-                        DF['days_from_then'].tolist(), squared=False)
-            # normalize on > 0 values
-            pdf = stats.norm.pdf(xs, mu_0, sigma_0)/stats.norm.pdf(xs[101:], mu_0, sigma_0).sum()
-            prob_12 = pdf[101:103].sum()
-            prob_37 = pdf[103:108].sum()
-            prob_wk2 = pdf[108:115].sum()
-            prob_wk3 = pdf[115:122].sum()
-            forecastdate = ru.dayssince2date(ii + 1, year) # forecast is one day later than data
-            mostlikely = int(np.round(mu_0))
-            forecasteddate = ru.dayssince2date(mostlikely+ii, year)
-            startidx = max(101, 100 + mostlikely-3)
-            endidx = startidx + 6
-            plusminus3daysprob = pdf[startidx:endidx+1].sum()
-            print(f"Forecast on {forecastdate}")
-            print(mu_0, np.round(mu_0), sigma_0, prob_12, prob_37, prob_wk2, prob_wk3)
-            if PLOTS:
-                fig, ax1 = plt.subplots()
-                ax1.plot(xs[:102], pdf[:102], linestyle='dashed', color='grey', linewidth=1)
-                ax1.plot(xs[101:], pdf[101:], color='black')
-                ax1.vlines(0, 0, 0.4, colors='black', linestyles='dotted')
-                # Add most likely +/- 3 days
-                ax1.vlines(mu_0, 0, 0.4, colors='grey')
-                shiftflag = False   # do we have to shift the +/- 3 day window?
-                if  100 + mostlikely-3 < 101:
-                    shiftflag = True
-                ax1.fill_between(xs[startidx:endidx+1], pdf[startidx:endidx+1], color='tab:purple', alpha=0.5)
-                ax1.text(78-ii, .36, f"Most likely breakup: ", color='tab:purple')
-                ax1.text(78-ii, .34, f"in {mostlikely} d on {forecasteddate}", 
-                        color='tab:purple')
-                if shiftflag: 
-                    textsnippet = "7d"
-                else:
-                    textsnippet = "±3d"
-                ax1.text(78-ii, .32, f"P({textsnippet}) = {plusminus3daysprob*100:.1f} %", color='tab:purple')
-                ax1.text(78-ii, .29, f"P1-2 = {prob_12*100:.1f} %", color='black')
-                ax1.text(78-ii, .27, f"P3-7 = {prob_37*100:.1f} %", color='black')
-                ax1.text(78-ii, .25, f"P8-14 = {prob_wk2*100:.1f} %", color='black')
-                ax1.text(78-ii, .23, f"P15-21 = {prob_wk3*100:.1f} %", color='black')
-                ax1.set_ylim((0, 0.40))
-                ax1.set_ylabel('probability density')
-                ax1.set_xlabel("Days from forecastday")
-                ax2 = ax1.twinx()
-                color = 'tab:blue'
-                sns.scatterplot(data=DF, x='days_from_then', y='mean_DD', ax=ax2)
-                ax2.scatter(x=[mu_0], y=[mean_station.iloc[ii-1][f"{year}"]], c='r')
-                ax2.set_ylabel('DD25', color=color)
-                ax2.tick_params(axis='y', labelcolor=color)
-                ax2.grid(b=None)
-                plt.title(f"{locality} ({river}), prediction on {forecastdate}")
-                plt.xlim((45-ii, 95-ii))
-                loc = locality.upper().replace(' ', '_')
-                outdir = outfolder / f"{river.replace(' ', '_')}"
-                outdir.mkdir(parents=True, exist_ok=True)
-                if not for_ffmpeg:
-                    outfn = (outdir / 
-                            f"{loc}_DD25_{year}_{forecastdate}.png")
-                else:
-                    outfn = (outdir /
-                            f"{loc}_DD25_{year}_{icount:02d}.png")
-                    icount += 1 
-                fig.savefig(outfn, bbox_inches='tight')
-            resultrecord = {
-                "location": locality,
-                "river": river,
-                "forecastdate": forecastdate,
-                "most likely breakup in (days)": mostlikely,
-                "forecasted date": forecasteddate,
-                "average breakup date": item.mean_date,
-                "probability of breakup within ± 3 days around forecasted": plusminus3daysprob,
-                "probability of breakup within 1 or 2 days": prob_12, 
-                "probability of breakup within 3-7 days": prob_37, 
-                "probability of breakup within week 2 from now": prob_wk2, 
-                "probability of breakup within week 3 from now": prob_wk3
-            }
-            try:
-                results[forecastdate].append(resultrecord)
-            except KeyError:
-                results[forecastdate] = [resultrecord]
-
-    for forecastdate in results:
-        outdf = pd.DataFrame.from_records(results[forecastdate])
-        outdf.sort_values(['river', "average breakup date"], inplace=True)
-        outfn = f"daily_report_{forecastdate}.csv"
-        with open(outfolder / outfn, 'w') as dst:
-            outdf.to_csv(dst, float_format='%.2f', index=False)
-            
+    # with worker processes, cProfile runs per site in the workers instead
+    with ru.profiling(outfolder, 'make_forecast_2024', cprofile=args.workers == 1):
+        with ru.timer('read_inputs'):
+            huctable = pd.read_csv(huctablepath)
+            breakupDF = pd.read_csv(breakuppth, header=3, index_col=0)
+            breakupDF['days_since_march1'] = breakupDF.apply(
+                lambda row: ru.datestr2dayssince(row.breakup), axis=1)
+            broken_upSet = get_brokenup()
+        print(broken_upSet)
 
-        
\ No newline at end of file
+        sites = []
+        for _, item in huctable.iterrows():
+            if item.siteID in broken_upSet:
+                print(f"{item.siteID} has broken up")
+                continue
+            sites.append(item)
+        with ru.timer('run_forecasts'):
+            results, plotspecs = run_forecasts(sites, breakupDF, days_start, days_end, workers=args.workers)
+        write_reports(results)
+        if plotspecs:
+            import forecast_plots
+            print(f"rendering {len(plotspecs)} plots")
+            with ru.timer('render_plots'):
+                ru.count('figures', len(forecast_plots.render_forecasts(plotspecs, workers=args.workers)))
+    ru.write_summary(outfolder / f"run_summary_{started:%Y-%m-%dT%H%M%S}.json", started,
+        script='make_forecast_2024.py', args=vars(args), prefix=prefix, year=year,
+        days_start=days_start, days_end=days_end, sites=len(sites))
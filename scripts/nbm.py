@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# 2 m temperature forecasts from the National Blend of Models (NBM) Alaska GRIB2 files
+#
+# Every NBM GRIB2 file has a wgrib2-style .idx inventory, one line per message:
+# "number:byte offset:d=YYYYMMDDHH:variable:level:forecast:extra". For each forecast hour
+# only the byte range of the TMP:2 m above ground message is read, by seeking in a local
+# file or with an HTTP range request on the NOAA open data bucket, and decoded with
+# eccodes (imported when a message is decoded). Values are sampled at the nearest grid
+# point of the stations and breakup sites, so one message is in memory at a time. The
+# daily (max + min) / 2 of the forecast temperatures, like ACIS avgt, gives forecast DD
+# that continue the observed cumulative DD of the season.
+#
+# usage: python nbm.py --date 2024-04-16 --hours 1-36 --source ../data/weatherstations/NBM
+
+from pathlib import Path
+import argparse
+import datetime as dt
+import os
+import numpy as np
+import pandas as pd
+import requests
+from scipy.spatial import cKDTree
+import riverice_util as ru
+
+PROJPATH = Path(__file__).resolve().parent.parent
+NBMURL = os.environ.get('NBM_URL', 'https://noaa-nbm-grib2-pds.s3.amazonaws.com')
+stationtable = PROJPATH / "data/weatherstations/ACIS/ACIS_for_RFCmodel.csv"
+huctablepath = PROJPATH / "data/breakupdata/derived/breakupDate_mean_std_HUC_augmented.csv"
+REGION = "ak"
+CYCLE = 12
+TIMEZONE = "America/Anchorage"
+# core product lead times: hourly to 36 h, 3-hourly to 192 h, 6-hourly to 264 h
+FORECASTHOURS = [*range(1, 37), *range(39, 193, 3), *range(198, 265, 6)]
+TIMEOUT = (10, 120)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Sample NBM 2 m temperature forecasts at the stations and breakup sites')
+    parser.add_argument('-d', '--date', type=dt.date.fromisoformat, default=dt.date.today(),
+        help='model run date (default today)')
+    parser.add_argument('-c', '--cycle', type=int, default=CYCLE,
+        help=f'model run hour UTC (default {CYCLE})')
+    parser.add_argument('--hours', default=None,
+        help='forecast hours like 1-36 or 1,2,3 (default all published hours of the core product)')
+    parser.add_argument('-s', '--source', default=NBMURL,
+        help='local folder with the .grib2 and .idx files, or base URL (default %(default)s)')
+    parser.add_argument('-p', '--prefix', default='DD25',
+        help='DD threshold of the daily forecast DD (default %(default)s)')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+        help='folder for the sampled temperatures and forecast DD csvs (default print a summary)')
+    return parser.parse_args()
+
+def parse_hours(hours: str) -> list[int]:
+    if hours is None:
+        return FORECASTHOURS
+    selected = []
+    for item in hours.split(','):
+        first, _, last = item.partition('-')
+        selected.extend(range(int(first), int(last or first) + 1))
+    return [hour for hour in selected if hour in FORECASTHOURS]
+
+def get_filename(fhour: int, cycle: int = CYCLE, region: str = REGION) -> str:
+    return f"blend.t{cycle:02d}z.core.f{fhour:03d}.{region}.grib2"
+
+def get_source(fhour: int, date: dt.date, cycle: int = CYCLE, base=NBMURL, region: str = REGION) -> str:
+    """Local path (files directly in base) or URL (bucket layout) of a forecast hour's file"""
+    filename = get_filename(fhour, cycle, region)
+    if str(base).startswith(('http://', 'https://')):
+        return f"{str(base).rstrip('/')}/blend.{date:%Y%m%d}/{cycle:02d}/core/{filename}"
+    return str(Path(base) / filename)
+
+def parse_idx(text: str) -> pd.DataFrame:
+    """wgrib2 inventory as a table with each message's byte range; the last message's
+    end is NaN (it runs to the end of the file)"""
+    records = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        msg, offset, date, variable, level, forecast, extra = (line.split(':', 6) + [''] * 7)[:7]
+        records.append({'msg': int(msg), 'offset': int(offset), 'date': date.removeprefix('d='),
+                        'variable': variable, 'level': level, 'forecast': forecast,
+                        'extra': extra.rstrip(':')})
+    idx = pd.DataFrame.from_records(records)
+    idx['end'] = idx.offset.shift(-1)
+    return idx
+
+def find_message(idx: pd.DataFrame, variable: str = 'TMP', level: str = '2 m above ground',
+                 extra: str = '') -> tuple[int, int]:
+    """Byte range (offset, end or None) of the one message matching variable, level and extra
+    (the empty extra is the deterministic forecast, not e.g. 'ens std dev')"""
+    rows = idx[(idx.variable == variable) & (idx.level == level) & (idx.extra == extra)]
+    if len(rows) != 1:
+        raise KeyError(f"{len(rows)} messages for {variable}:{level}:{extra}")
+    row = rows.iloc[0]
+    return int(row.offset), None if pd.isna(row.end) else int(row.end)
+
+def read_bytes(source: str, start: int = 0, end: int = None, session: requests.Session = None) -> bytes:
+    """Bytes [start, end) of a local file or a URL (range request), to the end if end is None"""
+    if source.startswith(('http://', 'https://')):
+        session = session or requests
+        headers = {} if (start, end) == (0, None) else {'Range': f"bytes={start}-{'' if end is None else end - 1}"}
+        response = session.get(source, headers=headers, timeout=TIMEOUT)
+        response.raise_for_status()
+        # a server that ignores the range sends the whole file with 200
+        if headers and response.status_code != 206:
+            raise requests.HTTPError(f"{source} answered {response.status_code} to a range request, "
+                                     "not 206 Partial Content", response=response)
+        return response.content
+    with open(source, 'rb') as src:
+        src.seek(start)
+        return src.read(-1 if end is None else end - start)
+
+def read_idx(source: str, session: requests.Session = None) -> pd.DataFrame:
+    return parse_idx(read_bytes(f"{source}.idx", session=session).decode())
+
+def read_message(source: str, session: requests.Session = None, **select) -> bytes:
+    """One GRIB2 message of a file, located with its .idx"""
+    offset, end = find_message(read_idx(source, session), **select)
+    message = read_bytes(source, offset, end, session)
+    if message[:4] != b'GRIB':
+        raise ValueError(f"No GRIB message at byte {offset} of {source}")
+    # the total length is in section 0, trim whatever follows the message
+    return message[:int.from_bytes(message[8:16], 'big')]
+
+def decode_message(message: bytes, latlons: bool = False) -> dict:
+    """Values (K for TMP), valid time and, if asked, the grid's latitudes and longitudes"""
+    import eccodes
+    gid = eccodes.codes_new_from_message(message)
+    try:
+        decoded = {
+            'values': eccodes.codes_get_values(gid),
+            'validtime': dt.datetime.strptime(
+                f"{eccodes.codes_get(gid, 'validityDate')}{eccodes.codes_get(gid, 'validityTime'):04d}",
+                '%Y%m%d%H%M').replace(tzinfo=dt.timezone.utc),
+        }
+        if latlons:
+            decoded['latitudes'] = eccodes.codes_get_array(gid, 'latitudes')
+            decoded['longitudes'] = eccodes.codes_get_array(gid, 'longitudes')
+    finally:
+        eccodes.codes_release(gid)
+    return decoded
+
+def unit_vectors(lats, lons) -> np.ndarray:
+    """Points on the unit sphere, the same for either longitude convention (-180-180, 0-360)"""
+    lats, lons = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+def nearest_gridpoints(gridlats, gridlons, lats, lons) -> np.ndarray:
+    """Index of the nearest grid point of every location"""
+    _, nearest = cKDTree(unit_vectors(gridlats, gridlons)).query(unit_vectors(lats, lons))
+    return nearest
+
+def get_locations(stationtable: Path = stationtable, huctablepath: Path = huctablepath) -> pd.DataFrame:
+    """Stations (named like the ACIS station files) and breakup sites with their HUC6"""
+    stations = pd.read_csv(stationtable)
+    huctable = pd.read_csv(huctablepath, index_col=0)
+    return pd.concat([
+        pd.DataFrame({'name': stations.name.str.replace(' ', '_'), 'kind': 'station',
+                      'lat': stations.latitude, 'lon': stations.longitude, 'huc6': np.nan}),
+        pd.DataFrame({'name': huctable.siteID, 'kind': 'site',
+                      'lat': huctable.lat, 'lon': huctable.lon, 'huc6': huctable.huc6}),
+    ], ignore_index=True)
+
+def sample_forecasts(sources: list[str], locations: pd.DataFrame, decode=decode_message,
+                     session: requests.Session = None) -> pd.DataFrame:
+    """2 m temperature (°F) at the locations, one row per forecast file (valid time, UTC).
+    The nearest grid points are found on the first message and reused for the others."""
+    nearest = None
+    rows, validtimes = [], []
+    for source in sources:
+        with ru.timer('nbm_message'):
+            decoded = decode(read_message(source, session), latlons=nearest is None)
+        if nearest is None:
+            nearest = nearest_gridpoints(decoded['latitudes'], decoded['longitudes'],
+                                         locations.lat, locations.lon)
+        rows.append((np.asarray(decoded['values'])[nearest] - 273.15) * 9 / 5 + 32)
+        validtimes.append(decoded['validtime'])
+        ru.count('nbm_messages')
+    return pd.DataFrame(np.array(rows), columns=list(locations.name),
+                        index=pd.DatetimeIndex(validtimes, name='validtime'))
+
+def sample_intervals(times: pd.DatetimeIndex) -> pd.Series:
+    """Sampling interval at each valid time: the shorter gap to its neighbours"""
+    times = pd.Series(times, index=times)
+    return pd.concat([times.diff(), -times.diff(-1)], axis=1).min(axis=1)
+
+def daily_tavg(temps: pd.DataFrame, timezone: str = TIMEZONE) -> pd.DataFrame:
+    """Daily (max + min) / 2 per local calendar day. Days that are cut off by the start or
+    end of the run (or a gap in the forecast hours) are dropped: the first sample of a day
+    has to be less than one sampling interval after local midnight and the last one
+    within one interval of the next midnight, so days of 3- and 6-hourly lead times count"""
+    local = temps.index.tz_convert(timezone)
+    days = pd.Index(local.date, name='date')
+    grouped = temps.groupby(days)
+    tavg = (grouped.max() + grouped.min()) / 2
+    samples = pd.DataFrame({'time': local, 'interval': sample_intervals(local).to_numpy()}, index=days)
+    first = samples.groupby(level=0).first()
+    last = samples.groupby(level=0).last()
+    midnight = first.time.dt.normalize()
+    keep = ((first.time - midnight < first.interval)
+            & (midnight + pd.Timedelta(days=1) - last.time <= last.interval))
+    tavg = tavg[keep.reindex(tavg.index, fill_value=False).to_numpy()]
+    tavg.index = pd.DatetimeIndex(tavg.index, name='date')
+    return tavg
+
+def forecast_dd(tavg: pd.DataFrame, prefix: str = 'DD25') -> pd.DataFrame:
+    """Daily DD of the forecast temperatures, indexed by day since March 1"""
+    dd = np.clip(tavg - ru.DD_CONFIG[prefix]['deltaT'], 0, None)
+    dd.index = pd.Index(ru.days_since_march1(tavg.index), name='d_since_march1')
+    return dd
+
+def extend_cumulative(observed: pd.DataFrame, dd: pd.DataFrame) -> pd.DataFrame:
+    """Forecast cumulative DD continuing an observed season (day since March 1 x location):
+    the forecast DD of the days after the last observed day of each location, added up
+    from its last observed value. Locations without observed data this season are left out"""
+    projected = {}
+    for col in dd.columns.intersection(observed.columns):
+        season = observed[col].dropna()
+        if season.empty:
+            continue
+        lastday = season.index.max()
+        future = dd.loc[dd.index > lastday, col]
+        projected[col] = season.iloc[-1] + future.cumsum()
+    return pd.DataFrame(projected)
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    hours = parse_hours(args.hours)
+    sources = [get_source(hour, args.date, args.cycle, args.source) for hour in hours]
+    locations = get_locations()
+    with requests.Session() as session:
+        temps = sample_forecasts(sources, locations, session=session)
+    dd = forecast_dd(daily_tavg(temps), args.prefix)
+    if args.output:
+        args.output.mkdir(parents=True, exist_ok=True)
+        runlabel = f"{args.date:%Y%m%d}t{args.cycle:02d}z"
+        temps.to_csv(args.output / f"nbm_t2m_{runlabel}.csv", float_format='%.2f')
+        dd.to_csv(args.output / f"nbm_{args.prefix}_{runlabel}.csv", float_format='%.2f')
+    print(f"{len(temps)} forecast hours at {len(locations)} locations, "
+          f"{len(dd)} complete days {dd.index.min()}-{dd.index.max()} since March 1")
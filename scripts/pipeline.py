@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# Dependency-tracked runner for the forecast pipeline
+#
+#   fetch (ACIS, per station, with --fetch)
+#     -> station DD files (acis2combinedDD, per station and prefix)
+#       -> combined DD files (build_combinedDD, per site and prefix)
+#            -> forecast records (make_forecast_2024, per site) -> daily reports
+#       -> anomaly correlations (generate_TDDcorr, per prefix)
+#
+# Every task declares its input and output files; a task depends on the tasks that
+# produce its inputs. The SHA-256 of each input and output is recorded in
+# data/cache/pipeline/state.json after a task runs (files are only rehashed when their
+# modification time or size changed). A task runs again if one of its inputs' hashes
+# or its parameters changed, or its outputs are missing or were changed since. A
+# rebuilt output with the same content doesn't make the tasks downstream of it stale,
+# so a day with new data at one station only rebuilds that station's DD files, the
+# sites that use the station, their forecasts and the reports. Independent tasks run in
+# parallel in --workers processes. The forecast season is riverice_util.LASTYEAR, set
+# RIVERICE_YEAR to change it.
+#
+# usage: RIVERICE_YEAR=2024 python pipeline.py --fetch --workers 4
+
+from pathlib import Path
+import argparse
+import datetime as dt
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, NamedTuple
+import pandas as pd
+import riverice_util as ru
+import ddcache
+import acis2combinedDD
+import build_combinedDD
+import generate_TDDcorr
+import make_forecast_2024 as mf
+
+STATEPTH = ru.PROJPATH / "data/cache/pipeline/state.json"
+RECORDDIR = ru.PROJPATH / "data/cache/pipeline/forecasts"
+FIRSTDAY = 31       # forecast days of the season with --season, as in make_forecast_2024
+LASTDAY = 90
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Rebuild the stale parts of the forecast pipeline')
+    parser.add_argument('-p', '--prefixes', default='DD25',
+        help='comma separated DD thresholds of the station and combined DD files (default %(default)s)')
+    parser.add_argument('-d', '--date', type=dt.date.fromisoformat, default=dt.date.today(),
+        help='forecast date, forecasts use the DD up to the day before (default today)')
+    parser.add_argument('-s', '--season', action='store_true',
+        help='forecast every day of the season up to --date instead of only --date')
+    parser.add_argument('-f', '--fetch', action='store_true',
+        help='fetch new ACIS data for the stations first (always runs)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+        help='number of worker processes (default %(default)s)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+        help='list the tasks that would run')
+    parser.add_argument('--force', action='store_true',
+        help='run all tasks regardless of their state')
+    return parser.parse_args()
+
+class Task(NamedTuple):
+    name: str
+    func: Callable
+    args: tuple
+    inputs: tuple
+    outputs: tuple
+    always: bool = False
+
+    def signature(self) -> str:
+        return f"{self.func.__module__}.{self.func.__qualname__}{self.args!r}"
+
+# Task actions, module-level so that they can run in worker processes
+
+def fetch_station(name: str, uid: str, edate: str):
+    import acis_client
+    import get_acisdata
+    pth = get_acisdata.get_stationfile(name)
+    with acis_client.ACISClient() as client:
+        if pth.exists():
+            get_acisdata.update_stationfile(pth, uid, edate=edate, fetch=client.fetch)
+        else:
+            with open(pth, 'w') as dst:
+                dst.write(get_acisdata.get_acis_stationdata(uid, edate=edate, fetch=client.fetch))
+
+def station_dd(name: str, prefix: str):
+    acis2combinedDD.process_station(name, ddprefixes=[prefix])
+
+def combine_site(site: str, stations: dict, prefix: str):
+    frame = build_combinedDD.build_combined({site: stations}, prefix)[site]
+    build_combinedDD.write_combined(build_combinedDD.get_outpath(site, prefix), site, stations, frame, prefix)
+
+def correlations(prefix: str):
+    generate_TDDcorr.write_correlations(prefix)
+
+def forecast_records(item: dict, days_start: int, days_end: int, outpth: str):
+    breakupDF = read_breakups()
+    breakup = breakupDF[breakupDF.siteID == item['siteID']].sort_values(by='year').reset_index(drop=True)
+    records, _, _ = mf.forecast_site(pd.Series(item), breakup, days_start, days_end)
+    Path(outpth).parent.mkdir(parents=True, exist_ok=True)
+    with open(outpth, 'w') as dst:
+        json.dump(records, dst, default=str)
+
+def daily_reports(recordpths: list[str]):
+    results = {}
+    for pth in recordpths:
+        with open(pth) as src:
+            for record in json.load(src):
+                results.setdefault(record['forecastdate'], []).append(record)
+    mf.write_reports(results)
+
+# Building the task graph
+
+def read_breakups(breakuppth: Path = mf.breakuppth) -> pd.DataFrame:
+    breakupDF = pd.read_csv(breakuppth, header=3, index_col=0)
+    breakupDF['days_since_march1'] = breakupDF.breakup.map(ru.datestr2dayssince)
+    return breakupDF
+
+def get_sitestations(prefix: str) -> dict[str, dict[str, float]]:
+    if build_combinedDD.selectedstations.exists():
+        return build_combinedDD.read_sitestations(build_combinedDD.selectedstations)
+    return build_combinedDD.sitestations_from_headers(prefix)
+
+def station_cumulfile(name: str, prefix: str, produced: set) -> Path:
+    """A station's cumulative DD file, produced by a task or existing (station lists use
+    _AP where some file names have _AIRPORT)"""
+    candidates = [acis2combinedDD.get_outpaths(candidate, prefix)[1]
+                  for candidate in (name, re.sub(r'_AP$', '_AIRPORT', name))]
+    for pth in candidates:
+        if pth in produced or pth.exists():
+            return pth
+    raise FileNotFoundError(f"No {prefix} cumulative DD file for station {name}")
+
+def build_tasks(prefixes: list[str], date: dt.date, season: bool = False, fetch: bool = False) -> list[Task]:
+    tasks = []
+    sitestations = {prefix: get_sitestations(prefix) for prefix in prefixes}
+    finalset = {name for stations in sitestations.values() for site in stations.values() for name in site}
+    stationnames = [pth.stem[:-len('_clim1991_2020')] for pth in sorted(acis2combinedDD.climdir.glob("*.csv"))]
+    stationnames = [name for name in stationnames if name.replace('AIRPORT', 'AP') in finalset]
+
+    if fetch:
+        import get_acisdata
+        stationlist = pd.read_csv(get_acisdata.ACISDIR / get_acisdata.ACISSTATIONS)
+        for record in stationlist.itertuples():
+            pth = get_acisdata.get_stationfile(record.name)
+            if pth.name[:-len(acis2combinedDD.datasuffix)] in stationnames:
+                tasks.append(Task(f"fetch {record.name}", fetch_station, (record.name, record.acisID, date.isoformat()),
+                                  (), (pth,), always=True))
+
+    fetched = {pth for task in tasks for pth in task.outputs}
+    for name in stationnames:
+        stationpth = acis2combinedDD.datapath / f"{name}{acis2combinedDD.datasuffix}"
+        if not (stationpth.exists() or stationpth in fetched):
+            continue
+        climpth = acis2combinedDD.climdir / f"{name}_clim1991_2020.csv"
+        for prefix in prefixes:
+            tasks.append(Task(f"dd {prefix} {name}", station_dd, (name, prefix),
+                              (stationpth, climpth), acis2combinedDD.get_outpaths(name, prefix)))
+
+    produced = {pth for task in tasks for pth in task.outputs}
+    for prefix in prefixes:
+        for site, stations in sitestations[prefix].items():
+            inputs = tuple(station_cumulfile(name, prefix, produced) for name in stations)
+            if build_combinedDD.selectedstations.exists():
+                inputs += (build_combinedDD.selectedstations,)
+            tasks.append(Task(f"combine {prefix} {site}", combine_site, (site, stations, prefix),
+                              inputs, (build_combinedDD.get_outpath(site, prefix),)))
+        stationfiles = sorted({pth for pth in produced if pth.parent == ru.get_stationdata(prefix)}
+                              | set(ru.get_stationdata(prefix).glob("*.csv")))
+        tasks.append(Task(f"correlations {prefix}", correlations, (prefix,),
+                          (generate_TDDcorr.BREAKUPPTH, ru.get_climpath(prefix), *stationfiles),
+                          (generate_TDDcorr.get_outpath(prefix),)))
+
+    if mf.prefix in prefixes:
+        if season:
+            # every forecast day of the season up to the date
+            days_start, days_end = FIRSTDAY, min(LASTDAY, ru.datestr2dayssince(date.isoformat()))
+        else:
+            # forecasts on a date use the DD up to the day before
+            days_end = ru.datestr2dayssince(date.isoformat())
+            days_start = days_end - 1
+        huctable = pd.read_csv(mf.huctablepath)
+        brokenup = mf.get_brokenup()
+        recordpths = []
+        for item in huctable.itertuples():
+            if item.siteID in brokenup:
+                continue
+            recordpth = RECORDDIR / f"{mf.year}_{item.siteID.replace(' ', '_')}.json"
+            site = {key: getattr(item, key) for key in ('siteID', 'river', 'locality', 'mean_date')}
+            tasks.append(Task(f"forecast {item.siteID}", forecast_records,
+                              (site, days_start, days_end, str(recordpth)),
+                              (mf.combinedpath / f"{mf.prefix}_combined_{item.siteID.replace(' ', '_')}.csv",
+                               mf.breakuppth), (recordpth,)))
+            recordpths.append(recordpth)
+        reportpths = tuple(mf.outfolder / f"daily_report_{ru.dayssince2date(day + 1, mf.year)}.csv"
+                           for day in range(days_start, days_end))
+        tasks.append(Task("reports", daily_reports, ([str(pth) for pth in recordpths],), tuple(recordpths), reportpths))
+    return tasks
+
+# State and scheduling
+
+def load_state(pth: Path = STATEPTH) -> dict:
+    if not pth.exists():
+        return {'files': {}, 'tasks': {}}
+    with open(pth) as src:
+        return json.load(src)
+
+def save_state(state: dict, pth: Path = STATEPTH):
+    pth.parent.mkdir(parents=True, exist_ok=True)
+    tmppth = pth.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmppth, 'w') as dst:
+        json.dump(state, dst, indent=1)
+    os.replace(tmppth, pth)
+
+def file_hash(pth: Path, state: dict):
+    """SHA-256 of a file, None if it doesn't exist. Rehashed only if its modification time
+    or size changed since the last time."""
+    try:
+        stat = os.stat(pth)
+    except FileNotFoundError:
+        return None
+    known = state['files'].get(str(pth))
+    if known and known[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return known[2]
+    sha256 = ddcache.file_sha256(pth)
+    state['files'][str(pth)] = [stat.st_mtime_ns, stat.st_size, sha256]
+    return sha256
+
+def get_hashes(paths, state: dict) -> dict:
+    return {str(pth): file_hash(pth, state) for pth in paths}
+
+def is_stale(task: Task, state: dict, inputs: dict) -> bool:
+    recorded = state['tasks'].get(task.name)
+    if task.always or recorded is None:
+        return True
+    outputs = get_hashes(task.outputs, state)
+    return (recorded['signature'] != task.signature() or recorded['inputs'] != inputs
+            or None in outputs.values() or recorded['outputs'] != outputs)
+
+def get_dependencies(tasks: list[Task]) -> dict[str, set]:
+    producers = {pth: task.name for task in tasks for pth in task.outputs}
+    return {task.name: {producers[pth] for pth in task.inputs if pth in producers} - {task.name}
+            for task in tasks}
+
+def run(tasks: list[Task], state: dict, workers: int = 1, force: bool = False, dryrun: bool = False) -> dict[str, str]:
+    """Run the stale tasks in dependency order, returns each task's status: ran, current,
+    failed, skipped (an upstream task failed) or, with dryrun, stale"""
+    bynames = {task.name: task for task in tasks}
+    dependencies = get_dependencies(tasks)
+    dependents = {name: set() for name in bynames}
+    for name, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].add(name)
+    waiting = {name: len(deps) for name, deps in dependencies.items()}
+    status = {}
+    running = {}
+
+    def finish(name: str, result: str):
+        status[name] = result
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            # skip everything downstream of a failed task
+            if result in ('failed', 'skipped') and dependent not in status:
+                finish(dependent, 'skipped')
+
+    def ready():
+        return [name for name, count in waiting.items()
+                if count == 0 and name not in status and name not in running]
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and not dryrun else None
+    try:
+        while True:
+            for name in ready():
+                task = bynames[name]
+                inputs = get_hashes(task.inputs, state)
+                upstream = any(status.get(dep) == 'stale' for dep in dependencies[name])
+                if not (force or upstream or is_stale(task, state, inputs)):
+                    finish(name, 'current')
+                    continue
+                if dryrun:
+                    print(f"would run {name}")
+                    finish(name, 'stale')
+                    continue
+                print(f"running {name}")
+                if executor is None:
+                    running[name] = (inputs, None)
+                    complete(task, inputs, state, status, finish, call=True)
+                    del running[name]
+                else:
+                    running[name] = (inputs, executor.submit(task.func, *task.args))
+            futures = {future: name for name, (_, future) in running.items()}
+            if not futures:
+                if not ready():
+                    break
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                inputs, _ = running.pop(name)
+                complete(bynames[name], inputs, state, status, finish, future=future)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return status
+
+def complete(task: Task, inputs: dict, state: dict, status: dict, finish: Callable, call: bool = False, future=None):
+    """Run (call) or collect (future) a task and record its state"""
+    try:
+        task.func(*task.args) if call else future.result()
+    except Exception as err:
+        print(f"{task.name} failed: {err!r}", file=sys.stderr)
+        state['tasks'].pop(task.name, None)
+        finish(task.name, 'failed')
+        return
+    state['tasks'][task.name] = {
+        'signature': task.signature(),
+        'inputs': inputs,
+        'outputs': get_hashes(task.outputs, state),
+        'finished': dt.datetime.now().isoformat(timespec='seconds'),
+    }
+    finish(task.name, 'ran')
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    started = dt.datetime.now()
+    state = load_state()
+    tasks = build_tasks(args.prefixes.split(','), args.date, args.season, args.fetch)
+    try:
+        status = run(tasks, state, args.workers, args.force, args.dry_run)
+    finally:
+        if not args.dry_run:
+            save_state(state)
+    counts = pd.Series(status).value_counts()
+    print(', '.join(f"{count} {result}" for result, count in counts.items()) + f" of {len(tasks)} tasks")
+    if not args.dry_run:
+        ru.write_summary(STATEPTH.parent / f"run_summary_{started:%Y-%m-%dT%H%M%S}.json", started,
+            script='pipeline.py', args={key: str(value) for key, value in vars(args).items()},
+            year=mf.year, status=counts.to_dict())
+    sys.exit(1 if 'failed' in status.values() else 0)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Append-only store of the daily forecast reports
+#
+# Every forecast run appends its records (one row per site and forecast date, the rows
+# of the daily_report_<date>.csv files) as a segment: one .npy file per typed column,
+# like featurestore, in <store>/season=<year>/<segment>/. Each season has a
+# segments.jsonl log with one line per segment (rows, forecast dates, sites), appended
+# after the segment is in place, so readers never see partial segments. A site and
+# forecast date that was appended again (a rerun) is read from the latest segment.
+# compact() merges a season's segments into one. Queries return typed DataFrames:
+# a site's forecasts over the season, all sites on one forecast date, and the
+# forecasts against the actual breakup dates of broken_up_<year>.csv. report() and
+# export_csv() give back the daily report format.
+# The store is in data/forecaststore, set REPORTSTORE_DIR to keep it elsewhere.
+#
+# usage: python reportstore.py --import ../data/working/daily_report_*.csv ../data/DDforecast_2024/daily_report_*.csv
+#        python reportstore.py --export 2024-04-16 -o /tmp/reports
+
+from pathlib import Path
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+PROJPATH = Path(__file__).resolve().parent.parent
+STOREDIR = Path(os.environ.get('REPORTSTORE_DIR', PROJPATH / "data/forecaststore"))
+HUCTABLEPTH = PROJPATH / "data/breakupdata/derived/breakupDate_mean_std_HUC_augmented.csv"
+# store column: daily report column, dtype
+COLUMNS = {
+    'location': ("location", str),
+    'river': ("river", str),
+    'forecastdate': ("forecastdate", 'datetime64[D]'),
+    'mostlikely': ("most likely breakup in (days)", np.int16),
+    'forecasted': ("forecasted date", 'datetime64[D]'),
+    'average': ("average breakup date", str),
+    'prob_pm3': ("probability of breakup within ± 3 days around forecasted", np.float64),
+    'prob_12': ("probability of breakup within 1 or 2 days", np.float64),
+    'prob_37': ("probability of breakup within 3-7 days", np.float64),
+    'prob_wk2': ("probability of breakup within week 2 from now", np.float64),
+    'prob_wk3': ("probability of breakup within week 3 from now", np.float64),
+}
+KEY = ['site', 'forecastdate']
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Append, query and export the daily forecast report store')
+    parser.add_argument('-i', '--import', dest='reports', type=Path, nargs='+', default=None,
+        help='append daily report csvs to the store')
+    parser.add_argument('-e', '--export', type=dt.date.fromisoformat, default=None,
+        help='write the daily report of this forecast date')
+    parser.add_argument('-o', '--outdir', type=Path, default=Path('.'),
+        help='folder for --export (default the current folder)')
+    parser.add_argument('-c', '--compact', type=int, default=None,
+        help='merge the segments of this season')
+    parser.add_argument('-s', '--site', default=None,
+        help="print a site's forecasts over --season")
+    parser.add_argument('-y', '--season', type=int, default=None,
+        help='season for --site (default the last one in the store)')
+    return parser.parse_args()
+
+def get_siteids(huctablepth: Path = HUCTABLEPTH) -> dict[tuple[str, str], str]:
+    """siteID of each (location, river) of the reports"""
+    huctable = pd.read_csv(huctablepth, index_col=0)
+    return {(row.locality, row.river): row.siteID for row in huctable.itertuples()}
+
+def fill_sites(locations, siteids: dict) -> tuple[list[str], list[str]]:
+    """Locations and rivers of report rows without a river column (the older report
+    layout), from the sites of each location. A location with several sites (Gakona)
+    has one row per site, in the order of the HUC table. Locations that were cut short
+    in some reports (McGr) are matched to the one location they start."""
+    rivers = {}
+    for location, river in siteids:
+        rivers.setdefault(location, []).append(river)
+    seen = {}
+    filled = []
+    for location in locations:
+        if location not in rivers:
+            matches = [name for name in rivers if name.startswith(location)]
+            location = matches[0] if len(matches) == 1 else location
+        nth = seen.get(location, 0)
+        seen[location] = nth + 1
+        candidates = rivers.get(location, [])
+        filled.append((location, candidates[nth] if nth < len(candidates) else ''))
+    return [location for location, _ in filled], [river for _, river in filled]
+
+def to_columns(records, siteids: dict = None) -> dict[str, np.ndarray]:
+    """Typed columns of report records (dicts or a DataFrame with the daily report
+    column names); report columns that are missing are NaN, a missing river column is
+    filled in from the HUC table"""
+    df = pd.DataFrame(records)
+    siteids = get_siteids() if siteids is None else siteids
+    if "river" not in df.columns:
+        df["location"], df["river"] = fill_sites(df["location"], siteids)
+    columns = {'site': np.array([siteids.get((location, river), f"{river} at {location}")
+                                 for location, river in zip(df["location"], df["river"])], dtype=str)}
+    for name, (header, dtype) in COLUMNS.items():
+        if header not in df.columns:
+            columns[name] = np.full(len(df), np.nan)
+        elif dtype == 'datetime64[D]':
+            columns[name] = pd.to_datetime(df[header].astype(str)).to_numpy().astype(dtype)
+        else:
+            columns[name] = df[header].to_numpy().astype(dtype)
+    return columns
+
+def read_report(pth: Path) -> pd.DataFrame:
+    """A daily report csv. Some older reports have a stale header line above the one
+    written with the DataFrame index (starting with a comma); that line is skipped."""
+    with open(pth) as src:
+        src.readline()
+        indexed = src.readline().startswith(',')
+    if indexed:
+        return pd.read_csv(pth, skiprows=1, index_col=0, dtype={COLUMNS['average'][0]: str})
+    return pd.read_csv(pth, dtype={COLUMNS['average'][0]: str})
+
+class ReportStore:
+    """Season-partitioned segments of daily report records, see the module comment"""
+
+    def __init__(self, storedir: Path = STOREDIR):
+        self.storedir = Path(storedir)
+        self._frames = {}
+
+    def seasondir(self, season: int) -> Path:
+        return self.storedir / f"season={season}"
+
+    def seasons(self) -> list[int]:
+        return sorted(int(pth.name.split('=')[1]) for pth in self.storedir.glob("season=*")
+                      if (pth / "segments.jsonl").exists())
+
+    def segments(self, season: int) -> list[dict]:
+        pth = self.seasondir(season) / "segments.jsonl"
+        if not pth.exists():
+            return []
+        with open(pth) as src:
+            return [json.loads(line) for line in src if line.strip()]
+
+    def append(self, records, siteids: dict = None) -> list[str]:
+        """Append report records as one segment per season, returns the segment names"""
+        if not len(records):
+            return []
+        columns = to_columns(records, siteids)
+        seasons = columns['forecastdate'].astype('datetime64[Y]').astype(int) + 1970
+        names = []
+        for season in np.unique(seasons):
+            rows = seasons == season
+            names.append(self.write_segment(int(season), {name: values[rows] for name, values in columns.items()}))
+        return names
+
+    def write_segment(self, season: int, columns: dict[str, np.ndarray]) -> str:
+        # object arrays (pandas strings) can't be memory-mapped
+        columns = {col: values.astype(str) if values.dtype == object else values
+                   for col, values in ((col, np.asarray(values)) for col, values in columns.items())}
+        seasondir = self.seasondir(season)
+        name = f"{dt.datetime.now():%Y%m%dT%H%M%S%f}_{os.getpid()}"
+        tmpdir = seasondir / f".{name}.tmp"
+        tmpdir.mkdir(parents=True)
+        for col, values in columns.items():
+            np.save(tmpdir / f"{col}.npy", values)
+        os.replace(tmpdir, seasondir / name)
+        dates = columns['forecastdate']
+        entry = {'name': name, 'nrows': len(dates), 'first': str(dates.min()), 'last': str(dates.max()),
+                 'sites': sorted(set(columns['site'].tolist()))}
+        with open(seasondir / "segments.jsonl", 'a') as dst:
+            dst.write(json.dumps(entry) + "\n")
+        self._frames.pop(season, None)
+        return name
+
+    def read_segment(self, season: int, name: str) -> pd.DataFrame:
+        segdir = self.seasondir(season) / name
+        return pd.DataFrame({col: np.load(segdir / f"{col}.npy", mmap_mode='r')
+                             for col in ['site', *COLUMNS]})
+
+    def frame(self, season: int) -> pd.DataFrame:
+        """All records of a season, the latest append of each site and forecast date"""
+        if season not in self._frames:
+            segments = self.segments(season)
+            if not segments:
+                raise LookupError(f"No forecasts for {season} in {self.storedir}")
+            df = pd.concat([self.read_segment(season, entry['name']) for entry in segments], ignore_index=True)
+            self._frames[season] = df[~df.duplicated(KEY, keep='last')].reset_index(drop=True)
+        return self._frames[season]
+
+    def site_series(self, site: str, season: int = None, columns=None) -> pd.DataFrame:
+        """A site's forecasts over a season, indexed by forecast date"""
+        season = season or self.seasons()[-1]
+        df = self.frame(season)
+        df = df[df.site == site].sort_values('forecastdate').set_index('forecastdate')
+        return df[columns] if columns is not None else df
+
+    def snapshot(self, date: dt.date) -> pd.DataFrame:
+        """The forecasts of all sites on a forecast date, in report order"""
+        df = self.frame(date.year)
+        return df[df.forecastdate == np.datetime64(date, 'D')].reset_index(drop=True)
+
+    def report(self, date: dt.date) -> pd.DataFrame:
+        """A forecast date's records as a daily report (columns, names and sort order),
+        leaving out probability columns that are empty for all sites"""
+        df = self.snapshot(date)
+        out = pd.DataFrame({header: df[name] for name, (header, _) in COLUMNS.items()})
+        for col in (COLUMNS['forecastdate'][0], COLUMNS['forecasted'][0]):
+            out[col] = out[col].dt.strftime('%Y-%m-%d')
+        out = out.dropna(axis=1, how='all')
+        return out.sort_values([col for col in ('river', COLUMNS['average'][0]) if col in out.columns])
+
+    def export_csv(self, date: dt.date, outdir: Path) -> Path:
+        outpth = Path(outdir) / f"daily_report_{date}.csv"
+        with open(outpth, 'w') as dst:
+            self.report(date).to_csv(dst, float_format='%.2f', index=False)
+        return outpth
+
+    def verify(self, brokenuppth: Path, season: int = None) -> pd.DataFrame:
+        """Forecasts of the sites that broke up with the actual date (broken_up_<year>.csv):
+        lead time and error (forecasted - actual) in days"""
+        season = season or self.seasons()[-1]
+        brokenup = pd.read_csv(brokenuppth, parse_dates=['date']).rename(
+            columns={'location': 'site', 'date': 'actual'})
+        df = self.frame(season).merge(brokenup, on='site')
+        df['lead_days'] = (df.actual - df.forecastdate).dt.days
+        df['error_days'] = (df.forecasted - df.actual).dt.days
+        return df.sort_values(KEY, ignore_index=True)
+
+    def compact(self, season: int) -> str:
+        """Replace a season's segments by one with the latest record of each site and date"""
+        old = self.segments(season)
+        df = self.frame(season).sort_values('forecastdate', kind='stable')
+        name = self.write_segment(season, {col: df[col].to_numpy() for col in df.columns})
+        entry = self.segments(season)[-1]
+        tmplog = self.seasondir(season) / f"segments.{os.getpid()}.tmp"
+        with open(tmplog, 'w') as dst:
+            dst.write(json.dumps(entry) + "\n")
+        os.replace(tmplog, self.seasondir(season) / "segments.jsonl")
+        for item in old:
+            shutil.rmtree(self.seasondir(season) / item['name'])
+        return name
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    store = ReportStore()
+    if args.reports:
+        siteids = get_siteids()
+        # in the order given, a site and date imported again replaces the earlier one
+        for pth in args.reports:
+            try:
+                report = read_report(pth)
+                store.append(report, siteids)
+            except (KeyError, ValueError) as err:
+                print(f"skipping {pth.name}: not a daily report ({err})")
+                continue
+            print(f"appended {pth.name}, {len(report)} sites")
+    if args.compact:
+        store.compact(args.compact)
+        print(f"compacted {args.compact}: {len(store.frame(args.compact))} records")
+    if args.export:
+        print(f"written {store.export_csv(args.export, args.outdir)}")
+    if args.site:
+        print(store.site_series(args.site, args.season).drop(columns='site').to_string())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Single command line entry point for the river ice scripts:
+#
+#   python riverice.py fetch --incremental
+#   python riverice.py update-dd --season
+#
+# Each command runs one of the scripts in this folder as if it had been called directly,
+# with the remaining arguments. Only the module of the chosen command is imported, so a
+# fetch doesn't import pandas and a DD update doesn't import scipy or the plotting
+# libraries. Symlink it onto the PATH (e.g. ~/bin/riverice) to call it from anywhere.
+
+import os
+import runpy
+import sys
+
+SCRIPTDIR = os.path.dirname(os.path.realpath(__file__))
+COMMANDS = {
+    'fetch': ('get_acisdata', 'download ACIS daily data for the model stations'),
+    'stations': ('get_acisids', 'look up the model stations in ACIS'),
+    'update-dd': ('acis2combinedDD', 'DD files per station from the ACIS data'),
+    'combine': ('build_combinedDD', 'combined multi-station DD per breakup site'),
+    'select': ('stationselect', 'search the station subset of each breakup site'),
+    'climatology': ('climatology', 'DD climatologies per station'),
+    'forecast': ('make_forecast_2024', 'breakup forecasts from the current season'),
+    'serve': ('forecast_service', 'HTTP/JSON forecast service'),
+    'reports': ('reportstore', 'store and query the daily forecast reports'),
+    'hindcast': ('hindcast', 'forecasts for past seasons'),
+    'predictors': ('update_predictors', 'teleconnection predictor tables'),
+    'features': ('featurestore', 'feature store for the ML predictors'),
+    'zonal': ('zonalstats', 'HUC6 means of gridded (ERA5) fields'),
+    'nbm': ('nbm', 'NBM 2 m temperature forecasts at the stations and sites'),
+    'pipeline': ('pipeline', 'rebuild the stale parts of the pipeline'),
+    'benchmark': ('benchmark', 'time the pipeline stages'),
+}
+
+def usage() -> str:
+    lines = [f"usage: {os.path.basename(sys.argv[0])} COMMAND [ARGS ...]", "", "commands:"]
+    lines += [f"  {name:<12} {description}" for name, (_, description) in COMMANDS.items()]
+    lines += ["", "COMMAND -h shows the options of a command"]
+    return "\n".join(lines)
+
+def main(argv: list[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"unknown command {argv[0]}\n\n{usage()}", file=sys.stderr)
+        return 2
+    module = COMMANDS[argv[0]][0]
+    if SCRIPTDIR not in sys.path:
+        sys.path.insert(0, SCRIPTDIR)
+    sys.argv = [f"{module}.py", *argv[1:]]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,20 @@
 # Utility functions for river ice breakup project
+#
+# scipy and the plotting libraries are imported by the functions that use them, so that
+# scripts that only read station data and compute DD don't pay for importing them.
 
+from contextlib import ContextDecorator, contextmanager
 import datetime as dt
+from functools import lru_cache, wraps
+import json
+import os
+import sys
+import time
+import tracemalloc
 import numpy as np
 import pandas as pd
-import seaborn as sb
 from pathlib import Path
-from matplotlib import pyplot as plt
-from scipy.stats import pearsonr
+import ddcache
 
 DD_CONFIG = {
     "TDD": {
@@ -20,12 +28,23 @@ DD_CONFIG = {
     },
 }
 
-PROJPATH = Path().resolve().parent
+PROJPATH = Path(__file__).resolve().parent.parent
 BREAKUPPTH = PROJPATH / "data/breakupdata/derived/breakupDate_cleaned_selected_redux.csv"
 CLIMPTH = PROJPATH / "data/weatherstations/ACIS/TDD/all_cumul_clim1991_2020.csv"
 STATIONDATA = PROJPATH / "data/weatherstations/ACIS/TDD/tdd_cumul_bystation"
 COLNAMES = ["Tmax_f", "Tmin_F", "Tavg_F", "sd_m", "swe"]
-LASTYEAR = 2024
+SNOWCOLS = ("sd_m", "swe")
+TRACE = 0.     # snow depth and SWE of trace ('T') reports
+# the forecast season: RIVERICE_YEAR if set, else the latest year in the combined DD files
+LASTYEAR = int(os.environ.get('RIVERICE_YEAR') or ddcache.latest_year() or dt.date.today().year)
+# breakup windows in days from the forecast day (inclusive) as reported in the daily forecasts
+FORECAST_WINDOWS = {
+    "prob_12": (0, 1),
+    "prob_37": (2, 6),
+    "prob_wk2": (7, 13),
+    "prob_wk3": (14, 20),
+}
+FORECAST_HORIZON = 100
 
 def get_climpath(ddprefix):
     return PROJPATH / f"data/weatherstations/ACIS/{ddprefix}/all_cumul_clim1991_2020.csv"
@@ -53,6 +72,47 @@ def station2df(stationpth):
     df['year'] = df.index.year
     return df 
 
+def snow_value(value: str) -> float:
+    """Snow depth or SWE of an ACIS csv field: trace ('T') is TRACE, missing ('M') NaN"""
+    if value == 'T':
+        return TRACE
+    if value == 'M':
+        return np.nan
+    return float(value)
+
+def read_station(stationpth, columns=('Tavg_F',), months=(3, 4, 5, 6), 
+                 firstyear=None, lastyear=None, chunksize=100_000) -> pd.DataFrame:
+    """Read an ACIS station csv straight to float32, chunk by chunk, keeping only the requested 
+    columns and the rows in the given months and years. Missing ('M') values become NaN, trace
+    ('T') snow depth and SWE become TRACE; the uint8 'missing' column has bit i set when
+    columns[i] was missing."""
+    snowcols = [col for col in columns if col in SNOWCOLS]
+    tempcols = [col for col in columns if col not in SNOWCOLS]
+    reader = pd.read_csv(stationpth, skiprows=1, header=None, names=['date'] + COLNAMES,
+                         usecols=['date', *columns], index_col='date', parse_dates=['date'],
+                         na_values={col: ['M', 'T'] for col in tempcols}, keep_default_na=False,
+                         dtype={col: np.float32 for col in tempcols},
+                         converters={col: snow_value for col in snowcols},
+                         chunksize=chunksize)
+    chunks = []
+    for chunk in reader:
+        for col in snowcols:
+            chunk[col] = chunk[col].astype(np.float32)
+        keep = chunk.index.month.isin(months)
+        if firstyear is not None:
+            keep &= chunk.index.year >= firstyear
+        if lastyear is not None:
+            keep &= chunk.index.year <= lastyear
+        chunks.append(chunk[keep])
+    stationdf = pd.concat(chunks)[list(columns)]
+    missing = np.zeros(len(stationdf), dtype=np.uint8)
+    for bit, col in enumerate(columns):
+        missing |= stationdf[col].isna().to_numpy().astype(np.uint8) << bit
+    stationdf['missing'] = missing
+    stationdf['year'] = stationdf.index.year
+    count('station_rows', len(stationdf))
+    return stationdf
+
 def get_MAMJ_dd(stationdf):
     stationdf.drop(columns=["Tmax_f", "Tmin_F", "sd_m", "swe"], inplace=True)
     tempdf = stationdf[stationdf.index.month.isin([3, 4, 5, 6])]
@@ -64,14 +124,33 @@ def days_past_march1(rowind):
     timed = rowind.date() - march1
     return timed.days
 
+def days_since_march1(index) -> np.ndarray:
+    """Integer days since March 1 of the same year for every entry of a DatetimeIndex"""
+    days = np.asarray(index, dtype='datetime64[D]')
+    march1 = (days.astype('datetime64[Y]').astype('datetime64[M]') 
+              + np.timedelta64(2, 'M')).astype('datetime64[D]')
+    return (days - march1).astype(int)
+
+def get_dddfs(tempdf, prefixes=tuple(DD_CONFIG)) -> dict:
+    """Daily and cumulative degree days for several thresholds in one pass over a station's 
+    temperature series. Returns a dict of DataFrames keyed by prefix, one row per day."""
+    tempdf = tempdf[tempdf['Tavg_F'].notna()]
+    tdddf = pd.DataFrame({
+        'year': tempdf['year'].to_numpy(),
+        'd_since_march1': days_since_march1(tempdf.index),
+        'Tavg_F': tempdf['Tavg_F'].to_numpy(),
+    }).sort_values(['year', 'd_since_march1'], kind='stable', ignore_index=True)
+    tavg = tdddf['Tavg_F'].to_numpy(dtype=float)
+    deltas = np.array([DD_CONFIG[prefix]['deltaT'] for prefix in prefixes], dtype=float)
+    dd = pd.DataFrame(np.clip(tavg[:, None] - deltas[None, :], 0, None), columns=list(prefixes))
+    dd_cumul = dd.groupby(tdddf['year'].to_numpy()).cumsum()
+    return {
+        prefix: tdddf.assign(dd=dd[prefix].to_numpy(), dd_cumul=dd_cumul[prefix].to_numpy())
+        for prefix in prefixes
+    }
+
 def get_dddf(tempdf, prefix='DD25'):
-    tempdf['d_since_march1'] = list(tempdf.index.to_series().apply(days_past_march1))
-    tempdf['dd'] = tempdf['Tavg_F'].astype('float') - DD_CONFIG[prefix]['deltaT']
-    tempdf.loc[tempdf['dd'] < 0, 'dd'] = 0
-    tdddf = tempdf.groupby(['year', "d_since_march1", 'Tavg_F'], as_index=False)['dd'].sum().assign(
-        dd_cumul=lambda x: x.groupby('year')['dd'].cumsum()
-    ) 
-    return tdddf
+    return get_dddfs(tempdf, prefixes=(prefix,))[prefix]
 
 def get_pivotdf(tdddf, index="d_since_march1", column='year', value='dd_cumul'):
     pivotdf = tdddf.pivot(index=[index], columns=[column], values=[value] )
@@ -88,8 +167,13 @@ def retrieve_dd(row, stationDF, offset=0):
     except KeyError:
         return np.nan
 
+@lru_cache(maxsize=None)
+def read_climatologies(climpth: Path) -> pd.DataFrame:
+    """Read (and cache) the all-station cumulative DD climatology file"""
+    return ddcache.load_ddframe(climpth)
+
 def retrieve_dd_anomaly(row, stationname, stationDF, offset=0):
-    climatologies = pd.read_csv(CLIMPTH, header=3, index_col=0)
+    climatologies = read_climatologies(CLIMPTH)
     try:
         return ( stationDF.iloc[row.days_since_march1-offset][str(row.year)] 
                 - climatologies[stationname].iloc[row.days_since_march1-offset] )
@@ -98,13 +182,51 @@ def retrieve_dd_anomaly(row, stationname, stationDF, offset=0):
     
 def retrieve_dd_anomaly_fixed(row, stationname, stationDF, datestring):
     """Datestring is something like 04-15"""
-    climatologies = pd.read_csv(CLIMPTH, header=3, index_col=0)
+    climatologies = read_climatologies(CLIMPTH)
     days_since_march1 = datestr2dayssince(f"{str(row.year)}-{datestring}")
     try:
         return stationDF.iloc[days_since_march1][str(row.year)] - climatologies[stationname].iloc[days_since_march1]
     except KeyError:
         return np.nan
 
+def ddpth2stationname(pth: Path) -> str:
+    """Station name from a file name like FAIRBANKS_INTL_AP_yearly_DD25_cumul.csv"""
+    return pth.stem.split('_yearly_')[0]
+
+def build_anomaly_cube(station_dd: list[Path], climpth: Path) -> tuple[np.ndarray, list[str], np.ndarray]:
+    """Read per-station cumulative DD files once and subtract the climatology. 
+    Returns a (station, year, day since March 1) anomaly array, the station names and the years. 
+    Entries are NaN where a station has no data for a year or no climatology."""
+    climatologies = read_climatologies(climpth)
+    stationnames = [ddpth2stationname(pth) for pth in station_dd]
+    stationDFs = [ddcache.load_ddframe(pth) for pth in station_dd]
+    years = np.array(sorted(set(int(col) for df in stationDFs for col in df.columns)))
+    ndays = max(len(df) for df in stationDFs)
+    cube = np.full((len(station_dd), len(years), ndays), np.nan)
+    for ii, (stationname, df) in enumerate(zip(stationnames, stationDFs)):
+        if stationname not in climatologies.columns:
+            continue
+        clim = climatologies[stationname].to_numpy()[:len(df)]
+        yidx = np.searchsorted(years, df.columns.astype(int))
+        cube[ii, yidx, :len(clim)] = (df.to_numpy()[:len(clim)] - clim[:, None]).T
+    return cube, stationnames, years
+
+def fixed_date_days(years, datestring: str) -> np.ndarray:
+    """Days since March 1 of a fixed calendar date like '04-15' in each of the given years"""
+    dates = pd.to_datetime([f"{year}-{datestring}" for year in years], format='%Y-%m-%d')
+    return days_since_march1(dates)
+
+def gather_anomalies(cube: np.ndarray, cubeyears: np.ndarray, years, days) -> np.ndarray:
+    """Look up anomalies for matching arrays of years and days since March 1 in one gather. 
+    Returns an array with the station axis first; NaN where the year or day isn't in the cube."""
+    years = np.asarray(years)
+    days = np.asarray(days)
+    yidx = np.searchsorted(cubeyears, years).clip(0, len(cubeyears) - 1)
+    valid = (cubeyears[yidx] == years) & (days >= 0) & (days < cube.shape[2])
+    out = cube[:, yidx, days.clip(0, cube.shape[2] - 1)]
+    out[:, ~valid] = np.nan
+    return out
+
 def calculate_corr(breakupDF: pd.DataFrame, 
                    locations: list[str], 
                    show_plots: bool = False, save_plots: bool = False, 
@@ -112,6 +234,7 @@ def calculate_corr(breakupDF: pd.DataFrame,
                    stationnames: list[str] | None = None,
                    outpath: Path = Path().resolve()) -> list[dict]:
     """Calculate pairwise correlations between DD anomalies in dataframe and stations, optionally plotting them"""
+    from scipy.stats import pearsonr
     if not set(locations) <= set(breakupDF.siteID):
         raise Exception("Sorry, the location isn't available in the breakup dataset. Check spelling?")
     outputrecords = []
@@ -135,21 +258,302 @@ def calculate_corr(breakupDF: pd.DataFrame,
                 }
             )
             if show_plots or save_plots:
-                sb.regplot(data=testDF, y='days_since_march1', x=stationname, scatter=False)
-                ax = sb.scatterplot(data=testDF, y='days_since_march1', x=stationname, 
-                                    hue='year', palette="crest")
-                ax.set_title(f"{stationname.replace('_', ' ').title()} station for {location} "
-                             f"{prefix.replace('_', ' ')}")
-                ax.set_xlabel(f"DD anomaly")
-                ax.set_ylabel("Days since March 1")
-                plt.legend(loc='upper right')
-                ax.text(0.06, 0.1, 
-                        f'r = {result.statistic:.2f}\nr2 = {result.statistic**2:.2f}\np = {result.pvalue:.2E}', 
-                        transform=ax.transAxes)
-                if show_plots:
-                    plt.show()
-                if save_plots:
-                    fn = f"{prefix}_{location.replace(' ', '_')}_AT_{stationname}.png"
-                    plt.savefig(outpath / fn, bbox_inches='tight')
-                    plt.close()
-    return outputrecords
\ No newline at end of file
+                plot_corr(testDF, location, stationname, result.statistic, result.pvalue,
+                          show_plots=show_plots, save_plots=save_plots, prefix=prefix, outpath=outpath)
+    return outputrecords
+
+def plot_corr(testDF: pd.DataFrame, location: str, stationname: str, 
+              rvalue: float, pvalue: float, 
+              show_plots: bool = False, save_plots: bool = True, 
+              prefix: str = "DD_breakup", 
+              outpath: Path = Path().resolve()):
+    """Scatter and regression plot of breakup day against one station's DD anomalies for one location"""
+    import seaborn as sb
+    from matplotlib import pyplot as plt
+    sb.regplot(data=testDF, y='days_since_march1', x=stationname, scatter=False)
+    ax = sb.scatterplot(data=testDF, y='days_since_march1', x=stationname, 
+                        hue='year', palette="crest")
+    ax.set_title(f"{stationname.replace('_', ' ').title()} station for {location} "
+                 f"{prefix.replace('_', ' ')}")
+    ax.set_xlabel(f"DD anomaly")
+    ax.set_ylabel("Days since March 1")
+    plt.legend(loc='upper right')
+    ax.text(0.06, 0.1, 
+            f'r = {rvalue:.2f}\nr2 = {rvalue**2:.2f}\np = {pvalue:.2E}', 
+            transform=ax.transAxes)
+    if show_plots:
+        plt.show()
+    if save_plots:
+        fn = f"{prefix}_{location.replace(' ', '_')}_AT_{stationname}.png"
+        plt.savefig(outpath / fn, bbox_inches='tight')
+    plt.close()
+
+def batch_pearson(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pearson r, two-sided p-value and sample size along the last axis, masking NaNs pairwise. 
+    x and y broadcast against each other, so any number of leading axes is computed at once."""
+    from scipy import special
+    x, y = np.broadcast_arrays(x, y)
+    mask = ~(np.isnan(x) | np.isnan(y))
+    n = mask.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xm = np.where(mask, x, 0).sum(axis=-1) / n
+        ym = np.where(mask, y, 0).sum(axis=-1) / n
+        xd = np.where(mask, x - xm[..., None], 0)
+        yd = np.where(mask, y - ym[..., None], 0)
+        r = (xd * yd).sum(axis=-1) / np.sqrt((xd**2).sum(axis=-1) * (yd**2).sum(axis=-1))
+        r = r.clip(-1, 1)
+        dof = n - 2
+        # same as scipy.stats.pearsonr: two-sided p from the t distribution with n-2 dof
+        pvalue = special.betainc(dof / 2, 0.5, 1 - r**2)
+    pvalue = np.where(np.abs(r) == 1, 0., pvalue)
+    pvalue = np.where(n == 2, 1., pvalue)
+    r = np.where(n < 2, np.nan, r)
+    return r, pvalue, n
+
+def make_breakupmatrix(breakupDF: pd.DataFrame, years: np.ndarray, 
+                       locations: list[str]) -> np.ndarray:
+    """(location, year) array of breakup days since March 1, NaN where there's no record"""
+    return (breakupDF.pivot(index='siteID', columns='year', values='days_since_march1')
+            .reindex(index=locations, columns=years).to_numpy(dtype=float))
+
+def calculate_corr_batch(anomalies: np.ndarray, breakupdays: np.ndarray,
+                         dates: list[str], stationnames: list[str], 
+                         locations: list[str]) -> dict[str, list[dict]]:
+    """Correlations between DD anomalies and breakup day for all dates, stations and locations at once. 
+    anomalies is (date, station, year), breakupdays is (location, year) on the same years. 
+    Returns per-date records in the format produced by calculate_corr."""
+    rvalues, pvalues, _ = batch_pearson(anomalies[:, None, :, :], breakupdays[None, :, None, :])
+    return {
+        datestr: [
+            {
+                "stationname": stationname,
+                "location": location,
+                "pvalue": pvalues[ii, jj, kk],
+                "rvalue": rvalues[ii, jj, kk],
+                "r2value": rvalues[ii, jj, kk]**2
+            }
+            for jj, location in enumerate(locations) for kk, stationname in enumerate(stationnames)
+        ]
+        for ii, datestr in enumerate(dates)
+    }
+
+def regression_from_sums(n, sx, sy, sxx, sxy, syy) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Least-squares slope, intercept and residual RMSE from the sums of 1, x, y, x², xy and y². 
+    Works elementwise, so many regressions can be solved at once."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Sxx = sxx - sx**2 / n
+        Sxy = sxy - sx * sy / n
+        Syy = syy - sy**2 / n
+        slope = Sxy / Sxx
+        intercept = (sy - slope * sx) / n
+        sigma = np.sqrt(np.clip(Syy - slope * Sxy, 0, None) / n)
+    return slope, intercept, sigma
+
+def fit_forecastdays(likelihoodDF: pd.DataFrame, x='mean_DD', y='days_from_then', 
+                     by='forecast_day_past_march1') -> pd.DataFrame:
+    """Fit days to breakup against DD for every forecast day of a likelihood table in one go, 
+    skipping rows without data. Returns n, slope, intercept and sigma (residual RMSE) indexed 
+    by forecast day."""
+    likelihoodDF = likelihoodDF[likelihoodDF[x].notna() & likelihoodDF[y].notna()]
+    xv = likelihoodDF[x].to_numpy(dtype=float)
+    yv = likelihoodDF[y].to_numpy(dtype=float)
+    sums = pd.DataFrame({
+        'n': np.ones_like(xv), 'sx': xv, 'sy': yv, 'sxx': xv * xv, 'sxy': xv * yv, 'syy': yv * yv,
+    }).groupby(likelihoodDF[by].to_numpy()).sum()
+    slope, intercept, sigma = regression_from_sums(*(sums[col].to_numpy() for col in sums.columns))
+    count('fits', len(sums))
+    return pd.DataFrame({'n': sums['n'].astype(int).to_numpy(), 'slope': slope, 
+                         'intercept': intercept, 'sigma': sigma}, index=sums.index.rename(by))
+
+def breakup_cdf(mu, sigma, horizon: int = FORECAST_HORIZON) -> np.ndarray:
+    """Cumulative breakup probability for each whole day 0..horizon from now. The normal 
+    density is sampled on whole days and normalized to days >= 0, as in the daily forecasts. 
+    mu and sigma may be arrays, days become the last axis."""
+    days = np.arange(horizon + 1)
+    mu = np.asarray(mu, dtype=float)[..., None]
+    sigma = np.asarray(sigma, dtype=float)[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cumul = np.exp(-0.5 * ((days - mu) / sigma)**2).cumsum(axis=-1)
+        return cumul / cumul[..., -1:]
+
+def interval_probability(cdf: np.ndarray, first, last) -> np.ndarray:
+    """Probability of breakup between day first and day last from now (inclusive)"""
+    horizon = cdf.shape[-1] - 1
+    first = np.broadcast_to(np.clip(first, 0, horizon), cdf.shape[:-1])
+    last = np.broadcast_to(np.clip(last, 0, horizon), cdf.shape[:-1])
+    upper = np.take_along_axis(cdf, last[..., None], axis=-1)[..., 0]
+    lower = np.take_along_axis(cdf, np.maximum(first - 1, 0)[..., None], axis=-1)[..., 0]
+    return upper - np.where(first > 0, lower, 0.)
+
+def mostlikely_window(mostlikely) -> tuple[np.ndarray, np.ndarray]:
+    """First and last day of the 7-day window reported around the most likely breakup day, 
+    shifted to start no earlier than the forecast day"""
+    first = np.maximum(0, np.asarray(mostlikely) - 4)
+    return first, first + 6
+
+def window_probabilities(cdf: np.ndarray, windows: dict = FORECAST_WINDOWS) -> dict[str, np.ndarray]:
+    """Breakup probabilities for each of the forecast windows"""
+    return {name: interval_probability(cdf, first, last) for name, (first, last) in windows.items()}
+
+# Instrumentation: timers, counters and optional profiling, summarized as JSON per run.
+# Set RIVERICE_PROFILE to a comma separated list of 'cprofile' and/or 'tracemalloc'
+# (or use a script's --profile flag) to switch on profiling; timers also record the
+# traced peak memory while tracemalloc is on.
+
+PROFILE_ENV = 'RIVERICE_PROFILE'
+
+class Metrics:
+    """Accumulated timers, counters and per-item records, e.g. one per site"""
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.records = []
+
+    def add_time(self, name, seconds, peak_MB=None):
+        entry = self.timers.setdefault(name, {'count': 0, 'total_s': 0., 'max_s': 0.})
+        entry['count'] += 1
+        entry['total_s'] += seconds
+        entry['max_s'] = max(entry['max_s'], seconds)
+        if peak_MB is not None:
+            entry['peak_MB'] = max(entry.get('peak_MB', 0.), peak_MB)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        return {'timers': {name: dict(entry) for name, entry in self.timers.items()},
+                'counters': dict(self.counters), 'records': list(self.records)}
+
+    def merge(self, snapshot: dict):
+        """Add another Metrics' snapshot, e.g. one returned from a worker process"""
+        for name, other in snapshot['timers'].items():
+            entry = self.timers.setdefault(name, {'count': 0, 'total_s': 0., 'max_s': 0.})
+            entry['count'] += other['count']
+            entry['total_s'] += other['total_s']
+            entry['max_s'] = max(entry['max_s'], other['max_s'])
+            if 'peak_MB' in other:
+                entry['peak_MB'] = max(entry.get('peak_MB', 0.), other['peak_MB'])
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+        self.records.extend(snapshot['records'])
+
+METRICS = Metrics()
+_activetimers = []  # enclosing timers while tracemalloc is tracing
+
+class timer(ContextDecorator):
+    """Time a block or function under name. With labels (e.g. site=...), also keep a
+    record of this call in METRICS.records."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            # resetting the traced peak hides the enclosing timer's peak so far, keep it there
+            self.hiddenpeak = 0
+            if _activetimers:
+                parent = _activetimers[-1]
+                parent.hiddenpeak = max(parent.hiddenpeak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            _activetimers.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        peak_MB = None
+        if self.tracing:
+            _activetimers.remove(self)
+            peak = max(tracemalloc.get_traced_memory()[1], self.hiddenpeak)
+            if _activetimers:
+                parent = _activetimers[-1]
+                parent.hiddenpeak = max(parent.hiddenpeak, self.hiddenpeak)
+            peak_MB = peak / 2**20
+        METRICS.add_time(self.name, seconds, peak_MB)
+        if self.labels:
+            record = {'name': self.name, **self.labels, 'seconds': seconds, 'maxrss_MB': maxrss_MB()}
+            if peak_MB is not None:
+                record['peak_MB'] = peak_MB
+            METRICS.records.append(record)
+        return False
+
+    def __call__(self, func):
+        # a fresh timer per call, so decorated functions can recurse or run in threads
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(self.name, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+def count(name, n=1):
+    """Increase counter name by n"""
+    METRICS.count(name, n)
+
+def maxrss_MB() -> float:
+    """Maximum resident set size of this process so far"""
+    try:
+        import resource
+    except ImportError:     # Windows
+        return float('nan')
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+def profile_modes() -> set[str]:
+    return {mode.strip() for mode in os.environ.get(PROFILE_ENV, '').lower().split(',') if mode.strip()}
+
+@contextmanager
+def collect_metrics():
+    """Gather the metrics of a block into a fresh Metrics, e.g. in a worker process, so they 
+    can be returned with the results and merged into METRICS by the caller"""
+    global METRICS
+    outer, METRICS = METRICS, Metrics()
+    try:
+        yield METRICS
+    finally:
+        METRICS = outer
+
+_profiler = None    # active cProfile profiler, there can only be one per process
+
+@contextmanager
+def profiling(outdir: Path, label: str, cprofile: bool = True):
+    """cProfile and/or tracemalloc for a block if switched on in RIVERICE_PROFILE. cProfile 
+    stats go to outdir/profile/<label>.prof, unless an enclosing block is already profiling
+    or cprofile is False."""
+    global _profiler
+    modes = profile_modes()
+    if 'tracemalloc' in modes and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if 'cprofile' not in modes or not cprofile or _profiler is not None:
+        yield
+        return
+    import cProfile
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    try:
+        yield
+    finally:
+        _profiler.disable()
+        profdir = Path(outdir) / 'profile'
+        profdir.mkdir(parents=True, exist_ok=True)
+        _profiler.dump_stats(profdir / f"{label.replace(' ', '_')}.prof")
+        _profiler = None
+
+def write_summary(pth: Path, started: dt.datetime, **info) -> dict:
+    """Write the run's metrics and info (script arguments etc.) as JSON"""
+    summary = {
+        'started': started.isoformat(timespec='seconds'),
+        'finished': dt.datetime.now().isoformat(timespec='seconds'),
+        'wall_s': (dt.datetime.now() - started).total_seconds(),
+        'profile': sorted(profile_modes()),
+        'maxrss_MB': maxrss_MB(),
+        **info,
+        **METRICS.snapshot(),
+    }
+    if tracemalloc.is_tracing():
+        summary['traced_peak_MB'] = tracemalloc.get_traced_memory()[1] / 2**20
+    with open(pth, 'w') as dst:
+        json.dump(summary, dst, indent=1, default=str)
+    return summary
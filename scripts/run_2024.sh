@@ -2,21 +2,23 @@
 
 
 ACISDIR="../data/weatherstations/ACIS/stationdata/RFC_new_model"
-OUTDIR="../data/DDforecast_2024"
+# the forecast season, defaults to the current year
+export RIVERICE_YEAR=${RIVERICE_YEAR:-$(date +%Y)}
+OUTDIR="../data/DDforecast_${RIVERICE_YEAR}"
 CLOUDDIR="/Users/chris/Library/CloudStorage/GoogleDrive-cwaigl@alaska.edu/My\ Drive/Shortcuts/Alaska\ River\ Ice\ Forecasting/Forecasts2024/from_DD25_only"
 
 SCRIPTDIR=`pwd`
 
 conda activate fiweps
 
-# refresh ACIS data for model stations
-python get_acisdata.py
-# rename Nenana station 
-mv ${ACISDIR}/NENANA_MUNICIPAL_AIRPORT_T_max_min_avg_sd_swe.csv ${ACISDIR}/NENANA_MUN_AP_T_max_min_avg_sd_swe.csv
-# generate combined DD25 datasets for each location
-python acis2combinedDD.py
+# refresh ACIS data for model stations (only the days not yet stored)
+python riverice.py fetch --incremental
+# update this season's DD25 columns for each station
+python riverice.py update-dd --season ${RIVERICE_YEAR}
+# and the combined multi-station DD25 for each breakup site
+python riverice.py combine --season
 # run new forecast
-python make_forecast_2024.py 
+python riverice.py forecast
 
 echo "Copying to Google Drive"
 cd ${OUTDIR}
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# Station subsets per breakup site, searched instead of picked by hand
+#
+# Scripted replacement for the station choice of the APRFC_breakupdata_stationselect
+# notebooks. A subset's series is the mean DD anomaly of its stations that have data
+# (as in the combined DD files). Its skill is the correlation of that series with the
+# breakup day over the site's years, sign flipped (more degree days, earlier breakup)
+# and less one standard error so that short records don't win by chance, averaged over
+# a few forecast dates. The anomalies come from the same (station, year, day) cube as
+# generate_TDDcorr. For every site, a subset keeps the running sum and station count of
+# the anomalies per date and year; adding a station only adds its anomalies, and the
+# correlations of all extensions of a subset come from the sums of x, y, x², xy and y²
+# in one array operation. Stations without positive skill on their own, and all but the
+# best --candidates, are pruned first. A beam search then extends the --beam best
+# subsets of each size one station at a time (--beam 1 is greedy forward selection,
+# --exhaustive tries all subsets of the candidates instead). A larger subset is only
+# chosen if it adds at least MINGAIN skill. A site where no station has skill on its
+# own keeps the stations of its existing combined file, or gets its best single station,
+# flagged in the CSV.
+# Sites run in parallel in --workers processes.
+# Writes <prefix>_selectedstations.json ({site: [stations]}, for build_combinedDD
+# --stations) and <prefix>_stationsubsets.csv with the best subset of each size.
+#
+# usage: python stationselect.py -k 4 --workers 4
+
+from pathlib import Path
+import argparse
+import datetime as dt
+import functools
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+import build_combinedDD
+
+PREFIX = "DD25"
+OUTPATH = ru.PROJPATH / "data/breakupdata/working"
+DATES = ('04-15', '04-25', '05-01')     # as the archived beststations_TDD_<date>.json
+MAXSTATIONS = 4
+CANDIDATES = 10
+BEAM = 5
+MINYEARS = 15       # fewer years with breakup and data, no skill
+MINGAIN = 0.01      # skill a larger subset needs to add
+CHUNKSIZE = 4096    # subsets scored at once with --exhaustive
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Search the station subset of each breakup site')
+    parser.add_argument('-p', '--prefix', default=PREFIX,
+        help='DD threshold (default %(default)s)')
+    parser.add_argument('-d', '--dates', default=','.join(DATES),
+        help='comma separated forecast dates (MM-DD) the skill is averaged over (default %(default)s)')
+    parser.add_argument('-k', '--maxstations', type=int, default=MAXSTATIONS,
+        help='largest subset (default %(default)s)')
+    parser.add_argument('-c', '--candidates', type=int, default=CANDIDATES,
+        help='stations with the best skill on their own that are searched (default %(default)s)')
+    parser.add_argument('-b', '--beam', type=int, default=BEAM,
+        help='subsets of each size that are extended, 1 is greedy (default %(default)s)')
+    parser.add_argument('-x', '--exhaustive', action='store_true',
+        help='score all subsets of the candidates instead of the beam search')
+    parser.add_argument('-s', '--sites', default=None,
+        help='comma separated sites (default all sites of the breakup file and the combined DD files)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+        help='number of worker processes, sites are distributed among them (default %(default)s)')
+    parser.add_argument('-o', '--outdir', type=Path, default=OUTPATH,
+        help='output folder (default %(default)s)')
+    return parser.parse_args()
+
+def read_breakup(breakuppth: Path = ru.BREAKUPPTH) -> pd.DataFrame:
+    breakup = pd.read_csv(breakuppth, header=3, index_col=0)
+    breakup['days_since_march1'] = breakup.apply(lambda row: ru.datestr2dayssince(row.breakup), axis=1)
+    return breakup
+
+def site_anomalies(prefix: str, breakup: pd.DataFrame, datestrs, sites) -> tuple[list[str], list[tuple]]:
+    """Station names and, per site, the (station, date, year) anomalies and the breakup
+    days of the site's years"""
+    station_dd = sorted(ru.get_stationdata(prefix).glob("*.csv"))
+    cube, stationnames, cubeyears = ru.build_anomaly_cube(station_dd, ru.get_climpath(prefix))
+    years = np.array(sorted(breakup.year.unique()))
+    days = np.stack([ru.fixed_date_days(years, datestr) for datestr in datestrs])
+    anomalies = ru.gather_anomalies(cube, cubeyears, np.broadcast_to(years, days.shape), days)
+    breakupdays = ru.make_breakupmatrix(breakup, years, sites)
+    siteyears = [~np.isnan(days_) for days_ in breakupdays]
+    return stationnames, [(anomalies[:, :, valid], days_[valid]) for days_, valid in zip(breakupdays, siteyears)]
+
+def pearson_from_sums(n, sx, sy, sxx, sxy, syy) -> np.ndarray:
+    """Pearson r from the sums of 1, x, y, x², xy and y², elementwise"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (n * sxy - sx * sy) / np.sqrt((n * sxx - sx**2) * (n * syy - sy**2))
+
+def subset_skill(total: np.ndarray, count: np.ndarray, breakupdays: np.ndarray,
+                 minyears: int = MINYEARS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Skill, mean r and fewest years over the dates of (..., date, year) anomaly sums and
+    station counts. The skill is the lower one-standard-error bound of minus r (in Fisher
+    z), averaged over the dates, so short records don't win by chance. NaN with fewer
+    than minyears years."""
+    valid = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(valid, total / count, 0.)
+    y = np.where(valid, breakupdays, 0.)
+    n = valid.sum(axis=-1)
+    r = pearson_from_sums(n, x.sum(axis=-1), y.sum(axis=-1), (x**2).sum(axis=-1),
+                          (x * y).sum(axis=-1), (y**2).sum(axis=-1))
+    r = np.where(n >= minyears, r, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        skill = np.tanh(np.arctanh(-r.clip(-0.9999, 0.9999)) - 1 / np.sqrt(n - 3))
+    return skill.mean(axis=-1), r.mean(axis=-1), n.min(axis=-1)
+
+def beam_search(values: np.ndarray, present: np.ndarray, breakupdays: np.ndarray,
+                candidates: np.ndarray, maxstations: int, beam: int) -> list[list[tuple]]:
+    """Best subsets of each size, as (skill, r, years, stations) lists of up to beam
+    entries, extending each kept subset by every candidate that isn't in it"""
+    ndates, nyears = values.shape[1:]
+    kept = [((), np.zeros((ndates, nyears)), np.zeros((ndates, nyears)))]
+    best = []
+    for _ in range(maxstations):
+        scored = {}
+        for stations, total, count in kept:
+            extra = np.array([cc for cc in candidates if cc not in stations])
+            if not len(extra):
+                continue
+            totals = total + values[extra]
+            counts = count + present[extra]
+            skill, r, n = subset_skill(totals, counts, breakupdays)
+            for ii, cc in enumerate(extra):
+                key = tuple(sorted((*stations, cc)))
+                if key not in scored and not np.isnan(skill[ii]):
+                    scored[key] = (skill[ii], r[ii], n[ii], totals[ii], counts[ii])
+        if not scored:
+            break
+        ranked = sorted(scored.items(), key=lambda item: -item[1][0])[:beam]
+        kept = [(stations, total, count) for stations, (_, _, _, total, count) in ranked]
+        best.append([(skill, r, n, stations) for stations, (skill, r, n, _, _) in ranked])
+    return best
+
+def exhaustive_search(values: np.ndarray, present: np.ndarray, breakupdays: np.ndarray,
+                      candidates: np.ndarray, maxstations: int, beam: int) -> list[list[tuple]]:
+    """Same as beam_search, scoring every subset of the candidates"""
+    best = []
+    for size in range(1, min(maxstations, len(candidates)) + 1):
+        ranked = []
+        subsets = itertools.combinations(sorted(candidates), size)
+        while len(chunk := np.array(list(itertools.islice(subsets, CHUNKSIZE)))):
+            skill, r, n = subset_skill(values[chunk].sum(axis=1), present[chunk].sum(axis=1), breakupdays)
+            ranked += [(skill[ii], r[ii], n[ii], tuple(chunk[ii])) for ii in np.flatnonzero(~np.isnan(skill))]
+            ranked = sorted(ranked, key=lambda item: -item[0])[:beam]
+        if not ranked:
+            break
+        best.append(ranked)
+    return best
+
+def select_stations(anomalies: np.ndarray, breakupdays: np.ndarray, maxstations: int = MAXSTATIONS,
+                    ncandidates: int = CANDIDATES, beam: int = BEAM, exhaustive: bool = False) -> list[tuple]:
+    """Best subset of each size for one site, as (skill, r, years, station indices),
+    from its (station, date, year) anomalies and breakup days"""
+    present = ~np.isnan(anomalies)
+    values = np.where(present, anomalies, 0.)
+    single, r, n = subset_skill(values, present.astype(float), breakupdays)
+    ranked = np.argsort(-np.nan_to_num(single, nan=-np.inf), kind='stable')
+    candidates = np.array([cc for cc in ranked[:ncandidates] if single[cc] > 0], dtype=int)
+    if not len(candidates):
+        # no station with skill on its own: only the best single one, if any has enough years
+        if np.isnan(single).all():
+            return []
+        return [(single[ranked[0]], r[ranked[0]], n[ranked[0]], (ranked[0],))]
+    search = exhaustive_search if exhaustive else beam_search
+    return [subsets[0] for subsets in search(values, present.astype(float), breakupdays,
+                                             candidates, maxstations, beam)]
+
+def choose(best: list[tuple], mingain: float = MINGAIN) -> int:
+    """Position of the chosen subset size: the next larger one only if it adds mingain skill"""
+    chosen = 0
+    for ii in range(1, len(best)):
+        if best[ii][0] >= best[chosen][0] + mingain:
+            chosen = ii
+    return chosen
+
+def search_sites(sitedata: list[tuple], workers: int = 1, **options) -> list[list[tuple]]:
+    """select_stations for every site's (anomalies, breakup days), optionally in a pool
+    of worker processes"""
+    search = functools.partial(select_stations, **options)
+    args = ([anomalies for anomalies, _ in sitedata], [days for _, days in sitedata])
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(search, *args))
+    return list(map(search, *args))
+
+def to_table(sites, stationnames, results, existing: dict | None = None,
+             mingain: float = MINGAIN) -> pd.DataFrame:
+    """Best subset of each size per site. A site where no station has skill on its own
+    keeps its existing stations from {site: [stations]} (flag 'existing') if it has
+    any, otherwise its best single station is selected (flag 'noskill')"""
+    existing = existing or {}
+    rows = []
+    for site, best in zip(sites, results):
+        noskill = not best or best[0][0] <= 0
+        if noskill and existing.get(site):
+            rows.append({'site': site, 'nstations': len(existing[site]), 'stations': ';'.join(existing[site]),
+                         'skill': np.nan, 'r': np.nan, 'r2': np.nan, 'years': np.nan, 'selected': True,
+                         'flag': 'existing'})
+            continue
+        chosen = choose(best, mingain) if best else None
+        for ii, (skill, r, n, stations) in enumerate(best):
+            rows.append({'site': site, 'nstations': len(stations),
+                         'stations': ';'.join(stationnames[ss] for ss in stations),
+                         'skill': skill, 'r': r, 'r2': r**2, 'years': n, 'selected': ii == chosen,
+                         'flag': 'noskill' if noskill else ''})
+    return pd.DataFrame(rows).astype({'years': 'Int64'})
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    started = dt.datetime.now()
+    datestrs = args.dates.split(',')
+    breakup = read_breakup()
+    existing = {site: list(stations) for site, stations in build_combinedDD.sitestations_from_headers(args.prefix).items()}
+    # the sites of the breakup file and those that have combined files
+    sites = args.sites.split(',') if args.sites else list(dict.fromkeys([*breakup.siteID.unique(), *existing]))
+    stationnames, sitedata = site_anomalies(args.prefix, breakup, datestrs, sites)
+    results = search_sites(sitedata, args.workers, maxstations=args.maxstations,
+                           ncandidates=args.candidates, beam=args.beam, exhaustive=args.exhaustive)
+    table = to_table(sites, stationnames, results, existing)
+    selected = table[table.selected]
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    with open(args.outdir / f"{args.prefix}_selectedstations.json", 'w') as dst:
+        json.dump({row.site: row.stations.split(';') for row in selected.itertuples()}, dst, indent=2)
+    with open(args.outdir / f"{args.prefix}_stationsubsets.csv", 'w') as dst:
+        dst.write(f"# Best {args.prefix} station subsets per site, skill averaged over {', '.join(datestrs)}\n")
+        table.to_csv(dst, float_format='%.4f', index=False)
+    for flag, message in (('existing', "kept the existing stations"), ('noskill', "selected the best station")):
+        flagged = selected.site[selected.flag == flag].tolist()
+        if flagged:
+            print(f"No station with skill for {', '.join(flagged)}, {message}")
+    missing = sorted(set(sites) - set(selected.site))
+    if missing:
+        print(f"No station with data for {', '.join(missing)}")
+    print(f"{len(selected)} sites, {len(stationnames)} stations, "
+          f"{(dt.datetime.now() - started).total_seconds():.1f} s, written to {args.outdir}")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Synthetic ACIS station and breakup data for benchmarks and tests
+#
+# Writes a tree laid out like data/ with files in the same formats as the real ones:
+# ACIS station csvs, per-station cumulative DD pivots, the all-station climatology,
+# combined DD files per breakup site and breakupDate_cleaned.csv. Temperatures follow a
+# seasonal cycle plus noise, and breakup happens when a site's combined DD reach a
+# site-specific threshold, so correlations and fits behave roughly like the real data.
+
+from pathlib import Path
+import argparse
+import numpy as np
+import pandas as pd
+import riverice_util as ru
+
+PREFIX = "DD25"
+NSTATIONS = 40
+NSITES = 40
+FIRSTYEAR = 1980
+LASTYEAR = 2023
+MISSINGFRAC = 0.01   # fraction of days with missing ('M') temperatures
+STATIONSPERSITE = 4
+NDAYS = 122          # March 1 to June 30
+SEED = 42
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Write a synthetic ACIS/breakup data tree')
+    parser.add_argument('outdir', type=Path, help='root of the data tree')
+    parser.add_argument('-s', '--stations', type=int, default=NSTATIONS,
+        help=f'number of weather stations (default {NSTATIONS})')
+    parser.add_argument('-l', '--sites', type=int, default=NSITES,
+        help=f'number of breakup sites (default {NSITES})')
+    parser.add_argument('-y', '--years', type=int, default=LASTYEAR - FIRSTYEAR + 1,
+        help=f'number of years ending in {LASTYEAR} (default {LASTYEAR - FIRSTYEAR + 1})')
+    parser.add_argument('--seed', type=int, default=SEED)
+    return parser.parse_args()
+
+def get_paths(root: Path, prefix: str = PREFIX) -> dict[str, Path]:
+    """Locations of the synthetic files, mirroring the data/ tree"""
+    root = Path(root)
+    acispath = root / "weatherstations/ACIS"
+    return {
+        'stationdata': acispath / "stationdata/RFC_new_model",
+        'ddcumul': acispath / f"{prefix}/dd_cumul_bystation",
+        'climatology': acispath / f"{prefix}/all_cumul_clim1991_2020.csv",
+        'combined': root / "weatherstations/ACIS_combined_DD",
+        'breakup': root / "breakupdata/derived/breakupDate_cleaned.csv",
+    }
+
+def make_temperatures(nstations: int, years: np.ndarray, rng: np.random.Generator):
+    """Daily T_max and T_min (°F, whole degrees) for all stations, shape (station, day),
+    and the dates"""
+    dates = pd.date_range(f"{years[0]}-01-01", f"{years[-1]}-12-31", freq='D')
+    doy = dates.dayofyear.to_numpy()
+    offset = rng.normal(0, 6, size=(nstations, 1))
+    amplitude = rng.uniform(25, 40, size=(nstations, 1))
+    yearly = rng.normal(0, 3, size=(nstations, len(years)))[:, dates.year.to_numpy() - years[0]]
+    tavg = (25 + offset - amplitude * np.cos(2 * np.pi * (doy - 15) / 365.25) + yearly
+            + rng.normal(0, 6, size=(nstations, len(dates))))
+    spread = rng.uniform(4, 10, size=(nstations, len(dates)))
+    return np.round(tavg + spread), np.round(tavg - spread), dates
+
+def write_station_csvs(outdir: Path, stationnames: list[str], tmax: np.ndarray, tmin: np.ndarray,
+                       dates: pd.DatetimeIndex, rng: np.random.Generator,
+                       missingfrac: float = MISSINGFRAC) -> list[Path]:
+    """ACIS StnData csv output: station name, then date,maxt,mint,avgt,snwd,swe rows"""
+    outdir.mkdir(parents=True, exist_ok=True)
+    datestrs = dates.strftime('%Y-%m-%d')
+    paths = []
+    for name, mx, mn in zip(stationnames, tmax, tmin):
+        df = pd.DataFrame({
+            'date': datestrs,
+            'maxt': mx.astype(int).astype(str),
+            'mint': mn.astype(int).astype(str),
+            'avgt': pd.Series((mx + mn) / 2).map('{:g}'.format),
+            'snwd': np.where(dates.month.isin([11, 12, 1, 2, 3, 4]),
+                             rng.integers(0, 30, len(dates)).astype(str), '0'),
+            'swe': rng.choice(['M', 'T', '0.10', '0.50'], size=len(dates)),
+        })
+        missing = rng.random(len(dates)) < missingfrac
+        df.loc[missing, ['maxt', 'mint', 'avgt']] = 'M'
+        pth = outdir / f"{name}_T_max_min_avg_sd_swe.csv"
+        with open(pth, 'w') as dst:
+            dst.write(f"{name.replace('_', ' ')}\n")
+            df.to_csv(dst, header=False, index=False)
+        paths.append(pth)
+    return paths
+
+def cumulative_dd(tmax: np.ndarray, tmin: np.ndarray, dates: pd.DatetimeIndex, years: np.ndarray,
+                  prefix: str = PREFIX) -> np.ndarray:
+    """Cumulative DD since March 1, shape (station, day since March 1, year)"""
+    tavg = (tmax + tmin) / 2
+    deltaT = ru.DD_CONFIG[prefix]['deltaT']
+    march1 = np.searchsorted(dates, pd.to_datetime([f"{year}-03-01" for year in years]))
+    idx = march1[None, :] + np.arange(NDAYS)[:, None]
+    return np.clip(tavg[:, idx] - deltaT, 0, None).cumsum(axis=1)
+
+def write_pivot(pth: Path, header: list[str], matrix: np.ndarray, columns):
+    """Commented DD csv with one row per day since March 1"""
+    pth.parent.mkdir(parents=True, exist_ok=True)
+    df = pd.DataFrame(matrix, index=pd.RangeIndex(len(matrix), name='d_since_march1'),
+                      columns=[str(col) for col in columns])
+    with open(pth, 'w') as dst:
+        for line in header:
+            dst.write(f"# {line}\n" if line else "#\n")
+        df.to_csv(dst, float_format='%.2f')
+
+def write_breakups(pth: Path, siteIDs: list[str], years: np.ndarray, breakupdays: np.ndarray):
+    """breakupDate_cleaned.csv with one row per site and year"""
+    pth.parent.mkdir(parents=True, exist_ok=True)
+    siteidx, yearidx = np.nonzero(np.ones_like(breakupdays, dtype=bool))
+    dates = (pd.to_datetime([f"{year}-03-01" for year in years[yearidx]])
+             + pd.to_timedelta(breakupdays.ravel(), unit='D'))
+    df = pd.DataFrame({
+        'id': np.arange(len(dates)),
+        'siteID': np.array(siteIDs)[siteidx],
+        'year': years[yearidx],
+        'breakup': dates.strftime('%Y-%m-%d'),
+        'JulianDay': dates.dayofyear,
+    })
+    with open(pth, 'w') as dst:
+        dst.write("# Synthetic breakup dates\n")
+        dst.write("# Generated by synthdata.py\n")
+        dst.write("# \n")
+        df.to_csv(dst)
+
+def make_dataset(root: Path, nstations: int = NSTATIONS, nsites: int = NSITES,
+                 nyears: int = LASTYEAR - FIRSTYEAR + 1, prefix: str = PREFIX,
+                 seed: int = SEED) -> dict[str, Path]:
+    """Write a complete synthetic data tree under root, returns get_paths(root)"""
+    rng = np.random.default_rng(seed)
+    paths = get_paths(root, prefix)
+    years = np.arange(LASTYEAR - nyears + 1, LASTYEAR + 1)
+    stationnames = [f"SYNTH_{ii:03d}_AP" for ii in range(nstations)]
+    tmax, tmin, dates = make_temperatures(nstations, years, rng)
+    write_station_csvs(paths['stationdata'], stationnames, tmax, tmin, dates, rng)
+    cumul = cumulative_dd(tmax, tmin, dates, years, prefix)
+    deltaT = ru.DD_CONFIG[prefix]['deltaT']
+    for name, matrix in zip(stationnames, cumul):
+        write_pivot(paths['ddcumul'] / f"{name}_yearly_{prefix}_cumul.csv",
+                    [name, f"Cumulative degree days > {deltaT} starting March 1 (synthetic)",
+                     "No years excluded", ""], matrix, years)
+    climyears = (years >= 1991) & (years <= 2020)
+    clim = cumul[:, :, climyears if climyears.any() else slice(None)].mean(axis=-1)
+    write_pivot(paths['climatology'],
+                [f"All climatologies for cumulative degree days > {deltaT}, 1991-2020 (synthetic)",
+                 "Cumulative degree days starting March 1", ""], clim.T, stationnames)
+    # breakup sites: mean of a few stations, breakup when DD reach a threshold
+    siteIDs = [f"Synth{ii:02d} River at Town{ii:02d}" for ii in range(nsites)]
+    breakupdays = np.empty((nsites, len(years)), dtype=int)
+    for ii, siteID in enumerate(siteIDs):
+        members = rng.choice(nstations, size=min(STATIONSPERSITE, nstations), replace=False)
+        combined = cumul[members].mean(axis=0)
+        threshold = np.quantile(combined[60], 0.5) + rng.uniform(0, 100)
+        reached = (combined >= threshold).argmax(axis=0)
+        reached[~(combined >= threshold).any(axis=0)] = NDAYS - 1
+        breakupdays[ii] = np.clip(reached + rng.normal(0, 3, len(years)).round(), 30, NDAYS - 1)
+        write_pivot(paths['combined'] / f"{prefix}_combined_{siteID.replace(' ', '_')}.csv",
+                    [f"Cumulative {prefix} averaged for {siteID}",
+                     f"Sites: {', '.join(stationnames[jj] for jj in members)}", ""],
+                    combined, years)
+    write_breakups(paths['breakup'], siteIDs, years, breakupdays)
+    return paths
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    paths = make_dataset(args.outdir, args.stations, args.sites, args.years, seed=args.seed)
+    for name, pth in paths.items():
+        print(f"{name}: {pth}")
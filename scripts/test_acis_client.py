@@ -0,0 +1,101 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import pytest
+import acis_client
+
+class FakeResponse:
+    def __init__(self, payload, status=200):
+        self.payload, self.status_code = payload, status
+        self.text = str(payload)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise acis_client.requests.HTTPError(f"{self.status_code}")
+
+    def json(self):
+        return self.payload
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append((url, params, timeout))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def flaky_server():
+    """Local server that answers 503 twice, then 200 with the request count"""
+    counts = {'requests': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            counts['requests'] += 1
+            status = 503 if counts['requests'] <= 2 else 200
+            body = f"attempt {counts['requests']}".encode()
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", counts
+    server.shutdown()
+    server.server_close()
+
+def test_adapter_retries_server_errors():
+    with acis_client.ACISClient(retries=3, backoff=0.5) as client:
+        retry = client.session.get_adapter('http://data.rcc-acis.org').max_retries
+    assert retry.total == 3
+    assert retry.backoff_factor == 0.5
+    assert {429, 500, 502, 503, 504} <= set(retry.status_forcelist)
+
+def test_fetch_retries_until_success(flaky_server):
+    url, counts = flaky_server
+    with acis_client.ACISClient(url, backoff=0, min_interval=0) as client:
+        assert client.fetch(f"{url}/StnData", {'uid': 1}) == "attempt 3"
+    assert counts['requests'] == 3
+
+def test_fetch_gives_up_after_retries(flaky_server):
+    url, counts = flaky_server
+    with acis_client.ACISClient(url, retries=1, backoff=0, min_interval=0) as client:
+        with pytest.raises(acis_client.requests.RequestException):
+            client.fetch(f"{url}/StnData", {'uid': 1})
+    assert counts['requests'] == 2
+
+def test_throttle_spaces_request_starts(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(acis_client.time, 'monotonic', lambda: 100.)
+    monkeypatch.setattr(acis_client.time, 'sleep', sleeps.append)
+    client = acis_client.ACISClient(min_interval=0.1)
+    for _ in range(3):
+        client._throttle()
+    assert sleeps == pytest.approx([0.1, 0.2])
+
+def test_fetch_json_raises_acis_errors():
+    client = acis_client.ACISClient('http://acis.test', min_interval=0)
+    client.session = FakeSession(FakeResponse({'error': 'bad sids'}))
+    with pytest.raises(ValueError, match='bad sids'):
+        client.fetch_json('StnMeta', {'sids': 'x'})
+
+def test_stn_meta_batches_requests():
+    client = acis_client.ACISClient('http://acis.test', max_workers=1, min_interval=0)
+    client.session = FakeSession(FakeResponse({'meta': [{'uid': 1}, {'uid': 2}]}),
+                                 FakeResponse({'meta': [{'uid': 3}]}))
+    meta = client.stn_meta(['a', 'b', 'c'], batchsize=2)
+    assert [item['uid'] for item in meta] == [1, 2, 3]
+    assert [params['sids'] for _, params, _ in client.session.calls] == ['a,b', 'c']
+    assert all(url == 'http://acis.test/StnMeta' for url, _, _ in client.session.calls)
+
+def test_map_keeps_input_order():
+    with acis_client.ACISClient(max_workers=4) as client:
+        assert client.map(lambda x: x * x, range(10)) == [x * x for x in range(10)]
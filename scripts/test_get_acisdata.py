@@ -0,0 +1,81 @@
+import datetime as dt
+import pytest
+import get_acisdata
+
+def rows(first: str, last: str, value: str = '30') -> list[str]:
+    day, last = dt.date.fromisoformat(first), dt.date.fromisoformat(last)
+    out = []
+    while day <= last:
+        out.append(f"{day},{value},10,20.0,5,M")
+        day += dt.timedelta(days=1)
+    return out
+
+def fake_fetch(served: list[str], calls: list):
+    """fetch(url, params) returning the served rows from params['sdate'] on, as ACIS csv"""
+    def fetch(url, params):
+        calls.append(params)
+        return "EAGLE\n" + "".join(f"{row}\n" for row in served if row[:10] >= params['sdate'])
+    return fetch
+
+@pytest.fixture
+def stationfile(tmp_path):
+    pth = tmp_path / "EAGLE_T_max_min_avg_sd_swe.csv"
+    pth.write_text("EAGLE\n" + "\n".join(rows('2023-12-20', '2024-01-10')) + "\n")
+    return pth
+
+def test_last_stored_date(stationfile, tmp_path):
+    assert get_acisdata.last_stored_date(stationfile) == dt.date(2024, 1, 10)
+    empty = tmp_path / "empty.csv"
+    empty.write_text("EAGLE\n")
+    assert get_acisdata.last_stored_date(empty) is None
+
+def test_update_replaces_overlap_and_appends(stationfile):
+    # ACIS revised 2024-01-05 and has two new days
+    served = rows('2023-12-20', '2024-01-12')
+    served[16] = "2024-01-05,35,12,23.5,5,M"
+    calls = []
+    years = get_acisdata.update_stationfile(stationfile, 'uid', edate='2024-01-12', overlap=7,
+                                            fetch=fake_fetch(served, calls))
+    assert calls[0]['sdate'] == '2024-01-03'
+    assert years == [2024]
+    assert stationfile.read_text() == "EAGLE\n" + "".join(f"{row}\n" for row in served)
+
+def test_update_without_changes(stationfile):
+    before = stationfile.read_text()
+    years = get_acisdata.update_stationfile(stationfile, 'uid', edate='2024-01-10', overlap=7,
+                                            fetch=fake_fetch(rows('2023-12-20', '2024-01-10'), []))
+    assert years == []
+    assert stationfile.read_text() == before
+
+def test_update_with_empty_fetch(stationfile):
+    before = stationfile.read_text()
+    for served in ("", "EAGLE\n"):
+        years = get_acisdata.update_stationfile(stationfile, 'uid', overlap=7,
+                                                fetch=lambda url, params: served)
+        assert years == []
+        assert stationfile.read_text() == before
+
+def test_update_keeps_rows_before_the_first_fetched(stationfile):
+    # ACIS has nothing for the first overlap days, the stored ones stay
+    served = rows('2024-01-06', '2024-01-11')
+    get_acisdata.update_stationfile(stationfile, 'uid', overlap=7, fetch=fake_fetch(served, []))
+    assert stationfile.read_text() == "EAGLE\n" + "".join(f"{row}\n" for row in rows('2023-12-20', '2024-01-11'))
+
+def test_update_across_the_year_boundary(stationfile):
+    served = rows('2023-12-20', '2024-01-10', value='31')
+    years = get_acisdata.update_stationfile(stationfile, 'uid', overlap=30,
+                                            fetch=fake_fetch(served, []))
+    assert years == [2023, 2024]
+    assert stationfile.read_text().count("\n") == len(served) + 1
+
+def test_update_file_without_trailing_newline(stationfile):
+    stationfile.write_text(stationfile.read_text().rstrip("\n"))
+    served = rows('2023-12-20', '2024-01-11')
+    get_acisdata.update_stationfile(stationfile, 'uid', overlap=2, fetch=fake_fetch(served, []))
+    assert stationfile.read_text() == "EAGLE\n" + "".join(f"{row}\n" for row in served)
+
+def test_update_empty_file_raises(tmp_path):
+    pth = tmp_path / "empty.csv"
+    pth.write_text("EAGLE\n")
+    with pytest.raises(ValueError):
+        get_acisdata.update_stationfile(pth, 'uid', fetch=fake_fetch([], []))
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+import nbm
+
+IDX = """1:0:d=2024041612:TMP:2 m above ground:6 hour fcst:
+2:120:d=2024041612:TMP:2 m above ground:6 hour fcst:ens std dev
+3:300:d=2024041612:DPT:2 m above ground:6 hour fcst:
+4:420:d=2024041612:APCP:surface:0-6 hour acc fcst:
+"""
+
+def grib_message(body: bytes) -> bytes:
+    """Bytes that pass for a GRIB2 message: 'GRIB', 4 bytes, total length in 8 bytes"""
+    return b'GRIB' + bytes(4) + (16 + len(body)).to_bytes(8, 'big') + body
+
+def test_parse_idx_byte_ranges():
+    idx = nbm.parse_idx(IDX)
+    assert idx.msg.tolist() == [1, 2, 3, 4]
+    assert idx.offset.tolist() == [0, 120, 300, 420]
+    assert idx.end.tolist()[:3] == [120, 300, 420] and np.isnan(idx.end.iloc[-1])
+    assert idx.date.iloc[0] == '2024041612'
+    assert idx.extra.tolist() == ['', 'ens std dev', '', '']
+
+def test_find_message():
+    idx = nbm.parse_idx(IDX)
+    assert nbm.find_message(idx) == (0, 120)
+    assert nbm.find_message(idx, extra='ens std dev') == (120, 300)
+    assert nbm.find_message(idx, variable='APCP', level='surface') == (420, None)
+    with pytest.raises(KeyError):
+        nbm.find_message(idx, variable='WIND')
+
+def test_read_bytes_local_range(tmp_path):
+    pth = tmp_path / "file.grib2"
+    pth.write_bytes(bytes(range(20)))
+    assert nbm.read_bytes(str(pth), 5, 8) == bytes([5, 6, 7])
+    assert nbm.read_bytes(str(pth), 18) == bytes([18, 19])
+
+class RangeSession:
+    """Session answering 206 to range requests, or 200 with honor_range False"""
+    def __init__(self, honor_range=True):
+        self.honor_range = honor_range
+
+    def get(self, url, headers=None, timeout=None):
+        self.headers = headers
+        status = 206 if headers and self.honor_range else 200
+        response = type('Response', (), {'content': b'abc', 'status_code': status,
+                                         'raise_for_status': lambda self: None})
+        return response()
+
+def test_read_bytes_range_request():
+    session = RangeSession()
+    nbm.read_bytes("https://bucket/file.grib2", 100, 200, session)
+    assert session.headers == {'Range': 'bytes=100-199'}
+    nbm.read_bytes("https://bucket/file.grib2", 100, None, session)
+    assert session.headers == {'Range': 'bytes=100-'}
+    nbm.read_bytes("https://bucket/file.grib2.idx", session=session)
+    assert session.headers == {}
+
+def test_read_bytes_ignored_range():
+    session = RangeSession(honor_range=False)
+    with pytest.raises(nbm.requests.HTTPError):
+        nbm.read_bytes("https://bucket/file.grib2", 100, 200, session)
+    assert nbm.read_bytes("https://bucket/file.grib2.idx", session=session) == b'abc'
+
+def test_read_message_trims_to_message_length(tmp_path):
+    first, second = grib_message(b'temperature'), grib_message(b'spread')
+    pth = tmp_path / "blend.grib2"
+    pth.write_bytes(first + second + b'7777')
+    (tmp_path / "blend.grib2.idx").write_text(
+        f"1:0:d=2024041612:TMP:2 m above ground:6 hour fcst:\n"
+        f"2:{len(first)}:d=2024041612:TMP:2 m above ground:6 hour fcst:ens std dev\n")
+    assert nbm.read_message(str(pth)) == first
+    assert nbm.read_message(str(pth), extra='ens std dev') == second
+
+def test_parse_hours():
+    assert nbm.parse_hours('1-3,198') == [1, 2, 3, 198]
+    assert nbm.parse_hours('37-40') == [39]
+    assert nbm.parse_hours(None) == nbm.FORECASTHOURS
+
+def run_temps(hours, start='2024-04-16 12:00') -> pd.DataFrame:
+    times = pd.DatetimeIndex([pd.Timestamp(start, tz='UTC') + pd.Timedelta(hours=hour) for hour in hours])
+    return pd.DataFrame({'A': np.arange(len(times), dtype=float)}, index=times)
+
+def test_daily_tavg_keeps_coarse_lead_times():
+    tavg = nbm.daily_tavg(run_temps(nbm.FORECASTHOURS))
+    days = [day.strftime('%m-%d') for day in tavg.index]
+    # the run starts 05 AKDT on 04-16 and ends 04 AKDT on 04-27, both cut off
+    assert days == [f"04-{day}" for day in range(17, 27)]
+
+def test_daily_tavg_six_hourly_days():
+    temps = run_temps(range(198, 265, 6))
+    tavg = nbm.daily_tavg(temps)
+    local = temps.index.tz_convert(nbm.TIMEZONE)
+    day = tavg.index[0].date()
+    values = temps.A[local.date == day]
+    # 04-24 starts at 10 AKDT and 04-27 has only 04 AKDT, 04-25 and 04-26 are whole
+    assert [day.strftime('%m-%d') for day in tavg.index] == ['04-25', '04-26']
+    assert len(values) == 4
+    assert tavg.A.iloc[0] == (values.max() + values.min()) / 2
+
+def test_daily_tavg_drops_days_cut_by_gaps():
+    # from 00 AKDT on 04-16: hours 1-36 and 49-60 leave 04-17 and 04-18 cut off at the gap
+    tavg = nbm.daily_tavg(run_temps([*range(1, 37), *range(49, 61)], start='2024-04-16 07:00'))
+    assert [day.strftime('%m-%d') for day in tavg.index] == ['04-16']
+
+def test_extend_cumulative_skips_locations_without_data():
+    observed = pd.DataFrame({'A': [10., 12., np.nan], 'B': np.nan}, index=[45, 46, 47])
+    dd = pd.DataFrame({'A': [1., 2., 3.], 'B': [1., 1., 1.]}, index=[46, 47, 48])
+    projected = nbm.extend_cumulative(observed, dd)
+    assert projected.columns.tolist() == ['A']
+    assert projected.A.tolist() == [14., 17.]
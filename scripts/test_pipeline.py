@@ -0,0 +1,102 @@
+from pathlib import Path
+import os
+import pytest
+import pipeline
+from pipeline import Task
+
+def upper(src: str, dst: str):
+    Path(dst).write_text(Path(src).read_text().upper())
+
+def length(src: str, dst: str):
+    Path(dst).write_text(str(len(Path(src).read_text())))
+
+def fail(*args):
+    raise RuntimeError("broken input")
+
+@pytest.fixture
+def chain(tmp_path):
+    """raw -> upper -> length: a change in raw that keeps its length stops at length"""
+    raw, up, size = tmp_path / "raw.txt", tmp_path / "upper.txt", tmp_path / "length.txt"
+    raw.write_text("ice")
+    tasks = [Task("upper", upper, (str(raw), str(up)), (raw,), (up,)),
+             Task("length", length, (str(up), str(size)), (up,), (size,))]
+    return tasks, raw, up, size
+
+def rewrite(pth: Path, text: str):
+    """Write text with a modification time one second later, so that the change is seen
+    even on file systems with coarse timestamps"""
+    mtime = pth.stat().st_mtime_ns
+    pth.write_text(text)
+    os.utime(pth, ns=(mtime + 10**9, mtime + 10**9))
+
+def new_state() -> dict:
+    return {'files': {}, 'tasks': {}}
+
+def test_reruns_only_stale_tasks(chain):
+    tasks, raw, up, size = chain
+    state = new_state()
+    assert pipeline.run(tasks, state) == {'upper': 'ran', 'length': 'ran'}
+    assert size.read_text() == "3"
+    assert pipeline.run(tasks, state) == {'upper': 'current', 'length': 'current'}
+    rewrite(raw, "ice")     # same content, new modification time
+    assert pipeline.run(tasks, state) == {'upper': 'current', 'length': 'current'}
+    rewrite(raw, "icy")
+    assert pipeline.run(tasks, state) == {'upper': 'ran', 'length': 'ran'}
+    assert up.read_text() == "ICY"
+
+def test_unchanged_output_stops_propagation(chain):
+    tasks, raw, up, size = chain
+    state = new_state()
+    pipeline.run(tasks, state)
+    extra = Task("length2", length, (str(size), str(size) + "2"), (size,), (Path(str(size) + "2"),))
+    pipeline.run(tasks + [extra], state)
+    rewrite(raw, "icy")
+    status = pipeline.run(tasks + [extra], state)
+    assert status == {'upper': 'ran', 'length': 'ran', 'length2': 'current'}
+
+def test_missing_or_edited_output_reruns(chain):
+    tasks, raw, up, size = chain
+    state = new_state()
+    pipeline.run(tasks, state)
+    size.unlink()
+    assert pipeline.run(tasks, state) == {'upper': 'current', 'length': 'ran'}
+    rewrite(size, "edited")
+    assert pipeline.run(tasks, state) == {'upper': 'current', 'length': 'ran'}
+    assert size.read_text() == "3"
+
+def test_changed_arguments_rerun(chain, tmp_path):
+    tasks, raw, up, size = chain
+    state = new_state()
+    pipeline.run(tasks, state)
+    other = tmp_path / "other.txt"
+    tasks[1] = Task("length", length, (str(up), str(other)), (up,), (other,))
+    assert pipeline.run(tasks, state) == {'upper': 'current', 'length': 'ran'}
+
+def test_failure_skips_everything_downstream(chain, tmp_path):
+    tasks, raw, up, size = chain
+    final = tmp_path / "final.txt"
+    tasks[0] = Task("upper", fail, (), (raw,), (up,))
+    tasks.append(Task("final", length, (str(size), str(final)), (size, raw), (final,)))
+    tasks.append(Task("unrelated", length, (str(raw), str(tmp_path / "u.txt")), (raw,), (tmp_path / "u.txt",)))
+    status = pipeline.run(tasks, new_state())
+    assert status == {'upper': 'failed', 'length': 'skipped', 'final': 'skipped', 'unrelated': 'ran'}
+
+def test_dry_run_marks_downstream_stale(chain):
+    tasks, raw, up, size = chain
+    state = new_state()
+    pipeline.run(tasks, state)
+    rewrite(raw, "icy")
+    assert pipeline.run(tasks, state, dryrun=True) == {'upper': 'stale', 'length': 'stale'}
+    assert up.read_text() == "ICE"
+
+def test_file_hash_memo(tmp_path):
+    pth = tmp_path / "data.txt"
+    pth.write_text("a")
+    state = new_state()
+    digest = pipeline.file_hash(pth, state)
+    # a stale memo with the same modification time and size is trusted
+    state['files'][str(pth)][2] = "memo"
+    assert pipeline.file_hash(pth, state) == "memo"
+    rewrite(pth, "bb")
+    assert pipeline.file_hash(pth, state) not in ("memo", digest)
+    assert pipeline.file_hash(tmp_path / "missing.txt", state) is None
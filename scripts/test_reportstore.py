@@ -0,0 +1,95 @@
+import datetime as dt
+import numpy as np
+import pytest
+import reportstore
+
+SITEIDS = {
+    ('Nenana', 'Tanana River'): 'Tanana River at Nenana',
+    ('Gakona', 'Gakona River'): 'Gakona River at Gakona',
+    ('Gakona', 'Gulkana River'): 'Gulkana River nr Gakona',
+    ('McGrath', 'Kuskokwim River'): 'Kuskokwim River at McGrath',
+}
+
+def record(location, river, date, mostlikely, average='04-29', prob=0.5) -> dict:
+    forecasted = dt.date.fromisoformat(date) + dt.timedelta(days=mostlikely)
+    return {
+        "location": location, "river": river, "forecastdate": date,
+        "most likely breakup in (days)": mostlikely, "forecasted date": forecasted.isoformat(),
+        "average breakup date": average,
+        "probability of breakup within ± 3 days around forecasted": prob,
+        "probability of breakup within 1 or 2 days": 0.,
+        "probability of breakup within 3-7 days": 0.1,
+        "probability of breakup within week 2 from now": 0.4,
+        "probability of breakup within week 3 from now": 0.2,
+    }
+
+@pytest.fixture
+def store(tmp_path):
+    return reportstore.ReportStore(tmp_path / "store")
+
+def test_append_and_query(store):
+    store.append([record('Nenana', 'Tanana River', '2024-04-16', 12),
+                  record('Gakona', 'Gakona River', '2024-04-16', 14),
+                  record('Nenana', 'Tanana River', '2024-04-17', 11)], SITEIDS)
+    assert store.seasons() == [2024]
+    series = store.site_series('Tanana River at Nenana')
+    assert series.mostlikely.tolist() == [12, 11]
+    assert series.index.tolist() == [np.datetime64('2024-04-16'), np.datetime64('2024-04-17')]
+    assert len(store.snapshot(dt.date(2024, 4, 16))) == 2
+
+def test_rerun_replaces_earlier_records(store):
+    store.append([record('Nenana', 'Tanana River', '2024-04-16', 12),
+                  record('Gakona', 'Gakona River', '2024-04-16', 14)], SITEIDS)
+    store.append([record('Nenana', 'Tanana River', '2024-04-16', 10)], SITEIDS)
+    snapshot = store.snapshot(dt.date(2024, 4, 16)).set_index('site')
+    assert len(snapshot) == 2
+    assert snapshot.at['Tanana River at Nenana', 'mostlikely'] == 10
+    assert snapshot.at['Gakona River at Gakona', 'mostlikely'] == 14
+
+def test_compact_keeps_latest_records(store):
+    for mostlikely in (12, 11, 10):
+        store.append([record('Nenana', 'Tanana River', '2024-04-16', mostlikely),
+                      record('Gakona', 'Gakona River', f'2024-04-{mostlikely + 5}', mostlikely)], SITEIDS)
+    before = store.frame(2024).sort_values(reportstore.KEY, ignore_index=True)
+    store.compact(2024)
+    assert len(store.segments(2024)) == 1
+    assert len([pth for pth in store.seasondir(2024).iterdir() if pth.is_dir()]) == 1
+    after = reportstore.ReportStore(store.storedir).frame(2024).sort_values(reportstore.KEY, ignore_index=True)
+    assert after.equals(before)
+    assert len(after) == 4
+
+def test_appends_split_by_season(store):
+    store.append([record('Nenana', 'Tanana River', '2023-04-20', 9),
+                  record('Nenana', 'Tanana River', '2024-04-20', 8)], SITEIDS)
+    assert store.seasons() == [2023, 2024]
+    assert store.site_series('Tanana River at Nenana', 2023).mostlikely.tolist() == [9]
+
+def test_export_round_trip(store, tmp_path):
+    records = [record('Gakona', 'Gulkana River', '2024-04-16', 13, average='04-28'),
+               record('Nenana', 'Tanana River', '2024-04-16', 12)]
+    store.append(records, SITEIDS)
+    report = store.report(dt.date(2024, 4, 16))
+    assert report['river'].tolist() == ['Gulkana River', 'Tanana River']
+    assert report['forecasted date'].tolist() == ['2024-04-29', '2024-04-28']
+    assert store.export_csv(dt.date(2024, 4, 16), tmp_path).name == "daily_report_2024-04-16.csv"
+
+def test_older_layout_without_river(store):
+    records = [record('Gakona', None, '2024-04-13', 19), record('Gakona', None, '2024-04-13', 17),
+               record('McGr', None, '2024-04-13', 20)]
+    for item in records:
+        del item['river'], item['average breakup date'], item['probability of breakup within week 3 from now']
+    store.append(records, SITEIDS)
+    snapshot = store.snapshot(dt.date(2024, 4, 13)).set_index('site')
+    assert snapshot.mostlikely.to_dict() == {'Gakona River at Gakona': 19, 'Gulkana River nr Gakona': 17,
+                                             'Kuskokwim River at McGrath': 20}
+    assert snapshot.prob_wk3.isna().all()
+    assert 'average breakup date' not in store.report(dt.date(2024, 4, 13)).columns
+
+def test_read_report_with_stale_header(tmp_path):
+    pth = tmp_path / "daily_report_2024-04-13.csv"
+    pth.write_text("location,forecastdate,most likely breakup in (days)\n"
+                   ",location,forecastdate,most likely breakup in (days)\n"
+                   "0,Buckland,2024-04-13,34\n")
+    report = reportstore.read_report(pth)
+    assert report.columns.tolist() == ['location', 'forecastdate', 'most likely breakup in (days)']
+    assert report.location.tolist() == ['Buckland']
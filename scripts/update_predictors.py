@@ -1,25 +1,37 @@
 #!/usr/bin/env python
-# 
+#
 # 2023-02-28 cwaigl@alaska.edu
+#
+# Download the teleconnection indices and build the predictor tables from them.
+# The dataframe step parses the PSL-format index files (a "first last" year line, one row
+# of 12 monthly values per year, a footer) with pandas' C parser, reading exactly the
+# year rows announced in the first line instead of using skipfooter. Parsed indices are
+# cached under the SHA-256 of their file, so unchanged downloads aren't parsed again.
+# Writes a (year, month) x index table and the Dec-Jan / Feb-Mar means per year.
 
 from pathlib import Path
+import argparse
+import datetime as dt
 import urllib.request
-import pandas as pd
-import geopandas as gp
 import numpy as np
-import argparse
-from fiweps.data import d_urls
+import pandas as pd
+import ddcache
 
-OUTPATH = Path("/Users/christine/Projects/2023_Riverice/data/working/predictors")
+PROJPATH = Path(__file__).resolve().parent.parent
+OUTPATH = PROJPATH / "data/working/predictors"
 RAWPREDPATH = OUTPATH
+CACHEDIR = PROJPATH / "data/cache/predictors"
 STARTYEAR = 1980
+# seasonal means as ML predictors, December is the previous year's
+SEASONS = {'DJ': (12, 1), 'FM': (2, 3)}
+MONTHCOLUMNS = [str(ii) for ii in range(1, 13)]
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Download new predictor data and update dataframe')
     parser.add_argument('-d', '--download',
         help='download new files',
         action='store_true')
-    parser.add_argument('-d', '--dataframe',
+    parser.add_argument('-f', '--dataframe',
         help='make new dataframe',
         action='store_true')
     parser.add_argument('-a', '--all',
@@ -27,29 +39,88 @@ def parse_arguments():
         action='store_true')
     return parser.parse_args()
 
-def get_data(row):
-    columns = ['Year'] + [str(ii) for ii in range(1, 13)]
-    fp = RAWPREDPATH / f"{row['name']}.txt"
-    data = pd.read_csv(fp, skiprows=1, skipfooter=row.skipfooter, delim_whitespace=True, names=columns,
-                       engine='python')
-    data = data.astype(float)
-    data['Year'] = data['Year'].astype(int)
-    data.replace(row.nodata, np.nan, inplace=True)
-    data = data[data['Year'] >= STARTYEAR]
-    data.meta = row['shortname']
+def get_records() -> list[dict]:
+    """Teleconnection index sources (name, shortname, format, nodata, skipfooter, URL)"""
+    from fiweps.data import d_urls
+    return d_urls.TELECONNECTIONURLS
+
+def count_yearrows(fp: Path, skipfooter: int = None) -> int:
+    """Number of data rows of a PSL file, from its 'first last' year line, or from the line
+    count and footer length if that line is something else"""
+    with open(fp) as src:
+        first = src.readline().split()
+        if len(first) == 2 and all(item.isdigit() for item in first):
+            return int(first[1]) - int(first[0]) + 1
+        nlines = 1 + sum(1 for line in src if line.strip())
+    return nlines - 1 - (skipfooter or 0)
+
+def read_psl(fp: Path, nodata: float, skipfooter: int = None) -> np.ndarray:
+    """(year, 13) array of year and the 12 monthly values, NaN where missing"""
+    data = pd.read_csv(fp, skiprows=1, nrows=count_yearrows(fp, skipfooter), sep=r'\s+',
+                       header=None, names=['Year'] + MONTHCOLUMNS, dtype=float,
+                       engine='c').to_numpy()
+    data[:, 1:][data[:, 1:] == nodata] = np.nan
     return data
 
+def get_data(record: dict, rawpath: Path = RAWPREDPATH, cachedir: Path = CACHEDIR) -> np.ndarray:
+    """Parsed PSL index file, from the cache if the file is unchanged"""
+    fp = rawpath / f"{record['name']}.txt"
+    cachepth = cachedir / f"{record['name']}_{ddcache.file_sha256(fp)[:16]}.npy"
+    if cachepth.exists():
+        return np.load(cachepth)
+    data = read_psl(fp, record['nodata'], record.get('skipfooter'))
+    cachedir.mkdir(parents=True, exist_ok=True)
+    for stale in cachedir.glob(f"{record['name']}_*.npy"):
+        if stale.stem.rsplit('_', 1)[0] == record['name']:
+            stale.unlink()
+    np.save(cachepth, data)
+    return data
+
+def monthly_table(records: list[dict], rawpath: Path = RAWPREDPATH, cachedir: Path = CACHEDIR,
+                  startyear: int = STARTYEAR) -> pd.DataFrame:
+    """All indices as columns (by shortname), one row per year and month from the year
+    before startyear (for the December of the first winter)"""
+    columns = {}
+    for record in records:
+        data = get_data(record, rawpath, cachedir)
+        data = data[data[:, 0] >= startyear - 1]
+        index = pd.MultiIndex.from_product([data[:, 0].astype(int), range(1, 13)],
+                                           names=['Year', 'month'])
+        columns[record['shortname']] = pd.Series(data[:, 1:].ravel(), index=index)
+    return pd.concat(columns, axis=1)
+
+def seasonal_means(monthly: pd.DataFrame, seasons: dict = SEASONS, startyear: int = STARTYEAR) -> pd.DataFrame:
+    """Mean of each index over the months of each season per year, named like AO_DJ.
+    Months after the season's last month belong to the previous year."""
+    wide = monthly.unstack('month')
+    years = wide.index
+    means = {}
+    for label, months in seasons.items():
+        parts = []
+        for month in months:
+            part = wide.xs(month, axis=1, level='month')
+            if month > months[-1]:
+                part = part.set_axis(part.index + 1).reindex(years)
+            parts.append(part)
+        means[label] = pd.concat(parts).groupby(level=0).mean()
+    table = pd.DataFrame({f"{name}_{label}": means[label][name]
+                          for name in monthly.columns for label in seasons})
+    return table.loc[startyear:]
+
 if __name__ == '__main__':
-    
+
     args = parse_arguments()
+    records = get_records()
     if args.download or args.all:
-        for record in d_urls.TELECONNECTIONURLS:
+        for record in records:
             print(f"retrieving {record['name']} from {record['URL']}")
             urllib.request.urlretrieve(record['URL'], OUTPATH / f"{record['name']}.txt")
-            # print(d_urls.TELECONNECTIONURLS)
 
     if args.dataframe or args.all:
-        
-        
-
-
+        psl = [record for record in records if record['format'] == 'PSL'
+               and (RAWPREDPATH / f"{record['name']}.txt").exists()]
+        monthly = monthly_table(psl)
+        today = dt.date.today().strftime('%Y%m%d')
+        monthly.to_csv(OUTPATH / f"teleconnections_psl_monthly_{today}.csv", float_format='%.3f')
+        seasonal_means(monthly).to_csv(OUTPATH / f"teleconnections_psl_{today}.csv", float_format='%.3f')
+        print(f"{len(psl)} indices, {monthly.index.get_level_values('Year').max()} last year, written to {OUTPATH}")
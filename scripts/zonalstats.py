@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+# HUC6 means of gridded fields (ERA5) as in data/predictors/era5_<var>_by_month_HUC6.csv
+#
+# The HUC6 mask (data/masks/WBD_AK_HUC6mask.nc, longitudes 0...359.75, or the _180
+# version, -180...180) holds one object id per grid cell, with the HUC6 of each id in
+# the flag_values/flag_meanings attributes. It is read once into a sparse
+# (HUC x grid cell) matrix of normalized cell weights (cell area by default) and cached
+# under data/cache/zonal by the mask's SHA-256. A field on any lat/lon grid that shares
+# the mask's grid points (either longitude convention, either latitude order, whole
+# globe or a subset) gets the matrix's columns reordered to its own cells, and
+# (time x lat x lon) values reduce to (time x HUC) means with one sparse product per
+# chunk of time steps. Cells with missing values are left out of a HUC's mean.
+# xarray is imported when a NetCDF file is read.
+#
+# usage: python zonalstats.py -v t2m -i ../data/era5/era5_t2m_monthly.nc
+
+from pathlib import Path
+import argparse
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import ddcache
+
+PROJPATH = Path(__file__).resolve().parent.parent
+MASKPTH = PROJPATH / "data/masks/WBD_AK_HUC6mask.nc"
+MASKVAR = 'objectid'
+CACHEDIR = PROJPATH / "data/cache/zonal"
+OUTPATH = PROJPATH / "data/working/predictors"
+WEIGHTINGS = ('area', 'coslat', 'none')
+CHUNKSIZE = 120     # time steps read and reduced at once
+LATNAMES = ('latitude', 'lat')
+LONNAMES = ('longitude', 'lon')
+TOLERANCE = 1e-4    # degrees, for matching a field's grid points to the mask's
+
+class ZonalIndex(NamedTuple):
+    matrix: sparse.csr_matrix   # (zone x mask cell) weights, rows add up to 1
+    objid: np.ndarray           # mask object id of each zone
+    huc6: np.ndarray            # HUC6 of each zone
+    lats: np.ndarray            # mask grid
+    lons: np.ndarray
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='HUC6 means of a gridded NetCDF field')
+    parser.add_argument('-v', '--variable', required=True,
+        help='variable name in the NetCDF file, e.g. t2m')
+    parser.add_argument('-i', '--input', type=Path, nargs='+', required=True,
+        help='NetCDF file(s) with the (time, latitude, longitude) field')
+    parser.add_argument('-m', '--mask', type=Path, default=MASKPTH,
+        help='HUC6 mask (default %(default)s)')
+    parser.add_argument('-w', '--weighting', choices=WEIGHTINGS, default='area',
+        help='cell weights within a HUC (default %(default)s)')
+    parser.add_argument('-d', '--daily', action='store_true',
+        help='write daily means instead of monthly ones')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+        help=f'output csv (default era5_<variable>_by_month_HUC6.csv in {OUTPATH})')
+    return parser.parse_args()
+
+def get_coordname(names, candidates) -> str:
+    for name in candidates:
+        if name in names:
+            return name
+    raise KeyError(f"None of {', '.join(candidates)} in {', '.join(map(str, names))}")
+
+def parse_flags(flag_values: str, flag_meanings: str) -> dict[int, int]:
+    """Object id to HUC6, from the mask's flag attributes (one entry per polygon, so ids repeat)"""
+    values = flag_values.split() if isinstance(flag_values, str) else flag_values
+    return dict(zip(map(int, values), map(int, str(flag_meanings).split())))
+
+def read_mask(maskpth: Path = MASKPTH, maskvar: str = MASKVAR) -> tuple:
+    """Object id grid (0/NaN outside the HUCs), its latitudes and longitudes and the
+    object id to HUC6 mapping"""
+    import xarray as xr
+    with xr.open_dataset(maskpth) as ds:
+        mask = ds[maskvar]
+        lats = mask[get_coordname(mask.dims, LATNAMES)].values
+        lons = mask[get_coordname(mask.dims, LONNAMES)].values
+        objid = np.nan_to_num(mask.values.astype(float), nan=0).astype(int)
+        hucs = parse_flags(mask.attrs['flag_values'], mask.attrs['flag_meanings'])
+    return objid, lats, lons, hucs
+
+def cell_weights(lats, nlon: int, weighting: str = 'area') -> np.ndarray:
+    """(lat x lon) weights of the cells of a regular grid: the area of the cell (the
+    difference of the sines of its edge latitudes), the cosine of its latitude or 1"""
+    lats = np.asarray(lats, dtype=float)
+    if weighting == 'area':
+        halfstep = np.abs(np.gradient(lats)) / 2 if len(lats) > 1 else np.ones(1)
+        edges = np.radians(np.clip([lats - halfstep, lats + halfstep], -90, 90))
+        weights = np.sin(edges[1]) - np.sin(edges[0])
+    elif weighting == 'coslat':
+        weights = np.cos(np.radians(lats))
+    elif weighting == 'none':
+        weights = np.ones_like(lats)
+    else:
+        raise ValueError(f"Unknown weighting {weighting}, use one of {', '.join(WEIGHTINGS)}")
+    return np.repeat(weights[:, np.newaxis], nlon, axis=1)
+
+def build_index(objid: np.ndarray, lats, lons, hucs: dict[int, int],
+                weighting: str = 'area') -> ZonalIndex:
+    """Sparse zone x cell weight matrix from an object id grid"""
+    flatids = objid.ravel()
+    cells = np.flatnonzero(flatids > 0)
+    zones, rows = np.unique(flatids[cells], return_inverse=True)
+    weights = cell_weights(lats, len(lons), weighting).ravel()[cells]
+    matrix = sparse.csr_matrix((weights, (rows, cells)), shape=(len(zones), flatids.size))
+    matrix = sparse.diags(1 / np.asarray(matrix.sum(axis=1)).ravel()) @ matrix
+    return ZonalIndex(matrix.tocsr(), zones, np.array([hucs[zone] for zone in zones]),
+                      np.asarray(lats), np.asarray(lons))
+
+def save_index(index: ZonalIndex, pth: Path):
+    pth.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(pth, data=index.matrix.data, indices=index.matrix.indices, indptr=index.matrix.indptr,
+             shape=index.matrix.shape, objid=index.objid, huc6=index.huc6, lats=index.lats, lons=index.lons)
+
+def load_index(pth: Path) -> ZonalIndex:
+    with np.load(pth) as npz:
+        matrix = sparse.csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['shape']))
+        return ZonalIndex(matrix, npz['objid'], npz['huc6'], npz['lats'], npz['lons'])
+
+def get_index(maskpth: Path = MASKPTH, weighting: str = 'area', cachedir: Path = CACHEDIR) -> ZonalIndex:
+    """Zonal index of a mask, from the cache if the mask is unchanged"""
+    cachepth = cachedir / f"{Path(maskpth).stem}_{weighting}_{ddcache.file_sha256(maskpth)[:16]}.npz"
+    if cachepth.exists():
+        return load_index(cachepth)
+    index = build_index(*read_mask(maskpth), weighting=weighting)
+    save_index(index, cachepth)
+    return index
+
+def match_coords(values, reference, period: float = None) -> np.ndarray:
+    """Position of the nearest reference coordinate of each value, -1 if none is within
+    TOLERANCE. With a period (360 for longitudes) values match modulo the period."""
+    distances = np.abs(np.subtract.outer(np.asarray(values, dtype=float), np.asarray(reference, dtype=float)))
+    if period:
+        distances %= period
+        distances = np.minimum(distances, period - distances)
+    nearest = np.argmin(distances, axis=1)
+    return np.where(distances[np.arange(len(nearest)), nearest] <= TOLERANCE, nearest, -1)
+
+def grid_matrix(index: ZonalIndex, lats, lons) -> sparse.csr_matrix:
+    """The index's weight matrix with one column per cell of a (lat x lon) field grid
+    (row-major); grid cells that aren't on the mask grid get no weight"""
+    latpos = match_coords(lats, index.lats)
+    lonpos = match_coords(lons, index.lons, period=360)
+    maskcells = latpos[:, np.newaxis] * len(index.lons) + lonpos[np.newaxis, :]
+    maskcells[(latpos < 0)[:, np.newaxis] | (lonpos < 0)[np.newaxis, :]] = -1
+    # missing cells point at an extra all-zero column
+    padded = sparse.hstack([index.matrix, sparse.csr_matrix((index.matrix.shape[0], 1))]).tocsc()
+    matrix = padded[:, np.where(maskcells.ravel() < 0, padded.shape[1] - 1, maskcells.ravel())].tocsr()
+    covered = np.asarray(matrix.sum(axis=1)).ravel()
+    if (covered < 1 - 1e-6).any():
+        raise ValueError(f"The field grid misses cells of {(covered < 1 - 1e-6).sum()} zones")
+    return matrix
+
+def zonal_means(values: np.ndarray, matrix: sparse.csr_matrix) -> np.ndarray:
+    """(time x zone) means of (time x lat x lon) values, skipping missing cells"""
+    flat = np.asarray(values, dtype=float).reshape(len(values), -1)
+    missing = np.isnan(flat)
+    if not missing.any():
+        return np.asarray(matrix @ flat.T).T
+    totals = matrix @ np.where(missing, 0, flat).T
+    covered = matrix @ (~missing).T.astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.asarray(totals / covered).T
+
+def reduce_field(fieldpth: Path, variable: str, index: ZonalIndex, chunksize: int = CHUNKSIZE) -> pd.DataFrame:
+    """HUC means of a NetCDF field (time x HUC6), reading chunksize time steps at a time"""
+    import xarray as xr
+    with xr.open_dataset(fieldpth) as ds:
+        field = ds[variable]
+        latname, lonname = get_coordname(field.dims, LATNAMES), get_coordname(field.dims, LONNAMES)
+        timedims = [dim for dim in field.dims if dim not in (latname, lonname)]
+        if len(timedims) != 1:
+            raise ValueError(f"{variable} should have one time dimension besides {latname} and {lonname}, "
+                             f"has {', '.join(timedims) or 'none'}")
+        field = field.transpose(timedims[0], latname, lonname)
+        matrix = grid_matrix(index, field[latname].values, field[lonname].values)
+        means = [zonal_means(field[start:start + chunksize].values, matrix)
+                 for start in range(0, field.shape[0], chunksize)]
+        times = pd.DatetimeIndex(field[timedims[0]].values, name='time')
+    return pd.DataFrame(np.concatenate(means), index=times, columns=pd.Index(index.huc6, name='huc6'))
+
+def to_table(means: pd.DataFrame, variable: str, index: ZonalIndex, daily: bool = False) -> pd.DataFrame:
+    """Long format of the predictor files: hucmask, <variable>, year, month, objid, huc6,
+    averaging daily (or finer) time steps to months unless daily"""
+    objids = dict(zip(index.huc6, index.objid))
+    if daily:
+        means = means.groupby(means.index.normalize()).mean()
+        keys = {'date': means.index.date}
+    else:
+        means = means.groupby([means.index.year, means.index.month]).mean()
+        keys = {'year': means.index.get_level_values(0), 'month': means.index.get_level_values(1)}
+    tables = [pd.DataFrame({'hucmask': objids[huc6], variable: means[huc6].to_numpy(), **keys,
+                            'objid': objids[huc6], 'huc6': huc6})
+              for huc6 in means.columns]
+    return pd.concat(tables, ignore_index=True).dropna(subset=[variable])
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    index = get_index(args.mask, args.weighting)
+    means = pd.concat([reduce_field(pth, args.variable, index) for pth in args.input]).sort_index()
+    table = to_table(means[~means.index.duplicated(keep='last')], args.variable, index, args.daily)
+    outpth = args.output or OUTPATH / f"era5_{args.variable}_by_{'day' if args.daily else 'month'}_HUC6.csv"
+    outpth.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(outpth)
+    print(f"{args.variable}: {len(means)} time steps, {len(index.huc6)} HUC6, written to {outpth}")